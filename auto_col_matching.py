@@ -1,11 +1,12 @@
 import dspy
+from convert_func_generate.src.cassette import use_cassette
 from typing import List
 import random
 from collections import Counter
 import copy
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import pprint
-lm = dspy.LM('ollama_chat/llama3.2', api_base='http://localhost:11434', api_key='')
+lm = use_cassette(dspy.LM('ollama_chat/llama3.2', api_base='http://localhost:11434', api_key=''))
 dspy.configure(lm=lm)
 
 class SelectBackendColumn(dspy.Signature):
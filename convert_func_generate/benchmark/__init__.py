@@ -0,0 +1,10 @@
+"""
+Benchmark suite of the convertor workflow.
+
+The LM is replaced by a local ollama-compatible stub server answering with
+scripted responses after a configurable latency, so that runs are deterministic
+and do not need a live Ollama. Run from `convert_func_generate`:
+
+    python -m benchmark.run --sizes 10 1000 100000 --output report.json
+    python -m benchmark.run --baseline report.json --output new_report.json
+"""
@@ -0,0 +1,100 @@
+"""
+Synthetic columns for benchmarking, each with a known convertor
+"""
+import datetime
+import random
+from typing import Callable, Dict, List
+
+__all__ = [
+    'COLUMN_KINDS',
+    'make_column',
+    'scripted_responses'
+]
+
+CATEGORIES = {'M': 'Male', 'F': 'Female', 'U': 'Unknown', 'X': 'Other'}
+
+
+def _dates(rng: random.Random, size: int) -> Dict:
+    start = datetime.date(1990, 1, 1)
+    days = [start + datetime.timedelta(days=rng.randrange(0, 15000)) for _ in range(size)]
+    return {
+        'value_descriptions': ['date', 'date_yyyymmdd'],
+        'input_values': [day.strftime('%Y%m%d') for day in days],
+        'target_values': [day.strftime('%Y-%m-%d') for day in days],
+        'func_string': 'def func(x):\n    return x[:4] + "-" + x[4:6] + "-" + x[6:]\n',
+        'marker': r'"\d{4}-\d{2}-\d{2}"',
+    }
+
+
+def _percents(rng: random.Random, size: int) -> Dict:
+    ratios = [rng.randrange(0, 10000) / 10000 for _ in range(size)]
+    return {
+        'value_descriptions': ['ratio_percent', 'ratio'],
+        'input_values': [str(ratio) for ratio in ratios],
+        'target_values': [f'{ratio * 100:.2f}%' for ratio in ratios],
+        'func_string': "def func(x):\n    return f'{float(x) * 100:.2f}%'\n",
+        'marker': r'"\d+\.\d{2}%"',
+    }
+
+
+def _quarters(rng: random.Random, size: int) -> Dict:
+    months = [rng.randrange(2000 * 12, 2030 * 12) for _ in range(size)]
+    return {
+        'value_descriptions': ['quarter', 'month_yyyymm'],
+        'input_values': [f'{month // 12}{month % 12 + 1:02d}' for month in months],
+        'target_values': [f'{month // 12}Q{month % 12 // 3 + 1}' for month in months],
+        'func_string': 'def func(x):\n    return x[:4] + "Q" + str((int(x[4:]) - 1) // 3 + 1)\n',
+        'marker': r'"\d{4}Q[1-4]"',
+    }
+
+
+def _scaled(rng: random.Random, size: int) -> Dict:
+    amounts = [rng.randrange(0, 10 ** 7) for _ in range(size)]
+    return {
+        'value_descriptions': ['amount_thousands', 'amount'],
+        'input_values': [str(amount) for amount in amounts],
+        'target_values': [str(round(amount / 1000, 3)) for amount in amounts],
+        'func_string': 'def func(x):\n    return str(round(float(x) / 1000, 3))\n',
+        'marker': r'input_values ## \]\]\n\["\d+"',
+    }
+
+
+def _categorical(rng: random.Random, size: int) -> Dict:
+    codes = [rng.choice(list(CATEGORIES)) for _ in range(size)]
+    return {
+        'value_descriptions': ['gender', 'gender_code'],
+        'input_values': codes,
+        'target_values': [CATEGORIES[code] for code in codes],
+        'func_string': f'def func(x):\n    return {CATEGORIES!r}[x]\n',
+        'marker': '"(' + '|'.join(CATEGORIES.values()) + ')"',
+    }
+
+
+COLUMN_KINDS: Dict[str, Callable[[random.Random, int], Dict]] = {
+    'dates': _dates,
+    'percents': _percents,
+    'quarters': _quarters,
+    'scaled': _scaled,
+    'categorical': _categorical,
+}
+
+
+def make_column(kind: str, size: int, seed: int=0) -> Dict:
+    """
+    A payload with `value_descriptions`, `input_values` and `target_values`
+    plus the `func_string` of a convertor fitting the column and a `marker`
+    regular expression matching prompts about the column
+    """
+    return COLUMN_KINDS[kind](random.Random(f'{kind}:{size}:{seed}'), size)
+
+
+def scripted_responses(kinds: List[str]) -> List:
+    """
+    (marker, fields) pairs answering the prompts about each column kind with its convertor,
+    in the order of COLUMN_KINDS so that the specific markers are tried first
+    """
+    script = []
+    for kind in [kind for kind in COLUMN_KINDS if kind in kinds]:
+        column = make_column(kind, 1)
+        script.append((column['marker'], {'convertion_code': column['func_string']}))
+    return script
@@ -0,0 +1,96 @@
+"""
+Run the benchmark scenarios and write a JSON report.
+
+    python -m benchmark.run --scenarios evaluator sampler --sizes 10 1000 --output report.json
+    python -m benchmark.run --baseline report.json --output new_report.json
+
+Cases carrying a `passed` flag are regression checks; the run exits with
+status 1 when any of them fails.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from .columns import COLUMN_KINDS
+from .scenarios import SCENARIOS
+
+KEY_FIELDS = ('scenario', 'variant', 'kind', 'size', 'seed')
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result: Dict[str, Any]) -> Tuple:
+    return tuple(result.get(field) for field in KEY_FIELDS)
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Speed ratio (baseline seconds / seconds) of every case present in both reports
+    """
+    baseline_results = {_key(result): result for result in baseline['results']}
+    comparison = []
+    for result in results:
+        previous = baseline_results.get(_key(result))
+        if previous is None or not result['seconds'] or not previous['seconds']:
+            continue
+        comparison.append(dict(
+            zip(KEY_FIELDS, _key(result)),
+            seconds=result['seconds'],
+            baseline_seconds=previous['seconds'],
+            speedup=previous['seconds'] / result['seconds']
+        ))
+    return comparison
+
+
+def main(argv: Optional[List[str]]=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--kinds', nargs='+', default=list(COLUMN_KINDS), choices=list(COLUMN_KINDS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 1000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stub LM waits before each answer')
+    parser.add_argument('--workflow-max-size', type=int, default=10000, help='largest column run through the whole workflow')
+    parser.add_argument('--baseline', help='an earlier report to compare against')
+    parser.add_argument('--output', default='benchmark_report.json')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.scenarios:
+        for result in SCENARIOS[name](args.kinds, args.sizes, args.repeat, latency=args.latency, workflow_max_size=args.workflow_max_size):
+            print('[benchmark:result]', json.dumps({key: result[key] for key in KEY_FIELDS + ('seconds',) if key in result}))
+            results.append(result)
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'arguments': vars(args),
+        },
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report['comparison'] = compare(results, json.load(f))
+        for row in report['comparison']:
+            print('[benchmark:compare]', json.dumps(row))
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print('[benchmark:report]', args.output)
+    failed = [result for result in results if result.get('passed') is False]
+    for result in failed:
+        print('[benchmark:check] failed', json.dumps({key: result[key] for key in KEY_FIELDS + ('accuracy',) if key in result}))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
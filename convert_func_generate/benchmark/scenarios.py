@@ -0,0 +1,174 @@
+"""
+Benchmark scenarios. Each scenario yields one result dict per measured case.
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List
+from src.alignment import ValueAligner
+from src.convertor import Convertor
+from src.data_sampler import PairTrainTestDataSampler, DiverseTrainTestDataSampler
+from src.evaluator import Evaluator
+from src.program_synthesis import ProgramSynthesizer
+from src.sandbox import SandboxedCallable
+from .columns import make_column
+from .stub_lm import StubOllamaServer
+
+__all__ = [
+    'SCENARIOS'
+]
+
+# Regression checks: the least share of pairs the alignment must recover per column kind
+MIN_ALIGNMENT_ACCURACY = {'quarters': 1.0, 'dates': 1.0}
+
+
+def _time(func: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """
+    Run `func` `repeat` times and summarise the wall times of the runs
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        seconds.append(time.perf_counter() - start)
+    return {'seconds': min(seconds), 'median_seconds': statistics.median(seconds), 'repeat': repeat, 'output': output}
+
+
+def _result(scenario: str, variant: str, kind: str, size: int, timing: Dict[str, Any], **extra) -> Dict[str, Any]:
+    result = {'scenario': scenario, 'variant': variant, 'kind': kind, 'size': size}
+    result.update({key: value for key, value in timing.items() if key != 'output'})
+    result['values_per_second'] = size / result['seconds'] if result['seconds'] > 0 else None
+    result.update(extra)
+    return result
+
+
+def evaluator_scenario(kinds: List[str], sizes: List[int], repeat: int, **options) -> Iterator[Dict[str, Any]]:
+    """
+    Evaluate the known sandboxed convertor of each column, fail-fast and full
+    """
+    for kind in kinds:
+        for size in sizes:
+            column = make_column(kind, size)
+            func = Convertor(SandboxedCallable(column['func_string']))
+            timing = _time(lambda: Evaluator.evaluate(func, column['input_values'], column['target_values'], fail_fast=True).is_fit, repeat)
+            yield _result('evaluator', 'is_fit', kind, size, timing, is_fit=timing['output'])
+            timing = _time(lambda: Evaluator.evaluate(func, column['input_values'], column['target_values']).f1_score, repeat)
+            yield _result('evaluator', 'f1_score', kind, size, timing, f1_score=timing['output'])
+
+
+def apply_batch_scenario(kinds: List[str], sizes: List[int], repeat: int, **options) -> Iterator[Dict[str, Any]]:
+    """
+    Convert whole columns in process with Convertor.apply_batch
+    """
+    for kind in kinds:
+        for size in sizes:
+            column = make_column(kind, size)
+            convertor = Convertor(ProgramSynthesizer.compile(column['func_string']))
+            timing = _time(lambda: convertor.apply_batch(column['input_values']) == column['target_values'], repeat)
+            yield _result('apply_batch', 'list', kind, size, timing, correct=timing['output'])
+
+
+def sampler_scenario(kinds: List[str], sizes: List[int], repeat: int, **options) -> Iterator[Dict[str, Any]]:
+    """
+    Split columns into training and testing values
+    """
+    samplers = {
+        'pair': PairTrainTestDataSampler(),
+        'diverse': DiverseTrainTestDataSampler(),
+    }
+    for kind in kinds:
+        for size in sizes:
+            column = make_column(kind, size)
+            for name, sampler in samplers.items():
+                timing = _time(lambda: sampler.split(column['input_values'], column['target_values']), repeat)
+                (train_input_values, _), (test_input_values, _) = timing['output']
+                yield _result('sampler', name, kind, size, timing, train_size=len(train_input_values), test_size=len(test_input_values))
+
+
+def alignment_scenario(kinds: List[str], sizes: List[int], repeat: int, **options) -> Iterator[Dict[str, Any]]:
+    """
+    Recover the pairing of shuffled target values with ValueAligner, without
+    and with the known convertor of the column, and check the share of pairs
+    recovered against MIN_ALIGNMENT_ACCURACY
+    """
+    aligner = ValueAligner()
+    for kind in kinds:
+        for size in sizes:
+            column = make_column(kind, size)
+            input_values, target_values = column['input_values'], column['target_values']
+            shuffled = list(target_values)
+            random.Random(size).shuffle(shuffled)
+            convertor = Convertor(ProgramSynthesizer.compile(column['func_string']))
+            for variant, func in (('similarity', None), ('convertor', convertor)):
+                timing = _time(lambda: aligner.align(input_values, shuffled, func=func), repeat)
+                _, aligned = timing['output']
+                accuracy = sum(target == expected for target, expected in zip(aligned, target_values)) / size
+                min_accuracy = MIN_ALIGNMENT_ACCURACY.get(kind)
+                yield _result(
+                    'alignment', variant, kind, size, timing,
+                    accuracy=accuracy,
+                    passed=None if min_accuracy is None else accuracy >= min_accuracy,
+                )
+
+
+def _cold_main():
+    """
+    A fresh instance of main.py whose LM cache, convertor library, checkpoints
+    and traces live in a new temporary folder
+    """
+    import importlib
+    from src import dspy_agent
+    from src.lm_cache import LMResponseCache
+    folder = tempfile.mkdtemp(prefix='convertor_benchmark_')
+    os.environ['CONVERTOR_LM_CACHE'] = os.path.join(folder, 'lm_cache.sqlite')
+    os.environ['CONVERTOR_LIBRARY'] = os.path.join(folder, 'library.jsonl')
+    os.environ['CONVERTOR_CHECKPOINT'] = os.path.join(folder, 'checkpoints.jsonl')
+    os.environ['CONVERTOR_TRACE'] = os.path.join(folder, 'trace')
+    dspy_agent.response_cache = LMResponseCache(os.environ['CONVERTOR_LM_CACHE'])
+    import main
+    return importlib.reload(main)
+
+
+def workflow_scenario(kinds: List[str], sizes: List[int], repeat: int, latency: float=0.0, workflow_max_size: int=10000, **options) -> Iterator[Dict[str, Any]]:
+    """
+    Run the workflow of main.py end-to-end against the stub LM server.
+
+    Every (kind, size, repeat) case runs on a fresh main.py whose LM cache,
+    convertor library, checkpoints and traces are in an empty temporary folder,
+    so every case starts cold instead of being served by the library or the
+    LM cache filled by the previous cases.
+    """
+    from .columns import scripted_responses
+    from .stub_lm import ScriptedResponder
+    import dspy
+    with StubOllamaServer(ScriptedResponder(scripted_responses(kinds)), latency=latency) as server:
+        for kind in kinds:
+            for size in sizes:
+                if size > workflow_max_size:
+                    continue
+                for i in range(repeat):
+                    main = _cold_main()
+                    dspy.configure(lm=server.make_lm())
+                    column = make_column(kind, size, seed=i)
+                    payload = {field: column[field] for field in ('value_descriptions', 'input_values', 'target_values')}
+                    requests = server.requests
+                    timing = _time(lambda: main.controller.run(payload), 1)
+                    output = timing['output']
+                    yield _result(
+                        'workflow', 'run', kind, size, timing,
+                        seed=i,
+                        is_fit=bool(output.get('is_fit')),
+                        lm_requests=server.requests - requests,
+                        nodes=[node.__class__.__name__ for node in output['workflow_records']],
+                    )
+
+
+SCENARIOS: Dict[str, Callable[..., Iterator[Dict[str, Any]]]] = {
+    'evaluator': evaluator_scenario,
+    'apply_batch': apply_batch_scenario,
+    'sampler': sampler_scenario,
+    'alignment': alignment_scenario,
+    'workflow': workflow_scenario,
+}
@@ -0,0 +1,163 @@
+"""
+Ollama-compatible stub LM server with scripted responses
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+import dspy
+
+__all__ = [
+    'ScriptedResponder',
+    'StubOllamaServer'
+]
+
+
+class ScriptedResponder:
+    """
+    Answer chat messages in the dspy ChatAdapter format.
+
+    `script` is a list of (marker, fields) pairs: the fields of the first pair
+    whose marker (a regular expression) matches the last user message are
+    answered, falling back to DEFAULT_FIELDS. Only the output fields requested
+    by the prompt are written.
+    """
+    DEFAULT_FIELDS = {
+        'reasoning': 'The target value is derived from the input value.',
+        'difference_explaination': 'The target values are formatted differently from the input values.',
+        'convertion_hint': 'Convert the input value to the format of the target value.',
+        'convertion_code': 'def func(x):\n    return x',
+    }
+    FIELD_PATTERN = re.compile(r'\[\[ ## (\w+) ## \]\]')
+
+    def __init__(self, script: Optional[List[Tuple[str, Dict[str, str]]]]=None):
+        self._script = [(re.compile(marker), fields) for marker, fields in (script if script is not None else [])]
+
+    def output_fields(self, messages: List[Dict[str, Any]]) -> List[str]:
+        content = str(messages[-1]['content'])
+        position = content.rfind('Respond with the corresponding output fields')
+        if position < 0:
+            return ['reasoning', 'convertion_code']
+        return [field for field in self.FIELD_PATTERN.findall(content[position:]) if field != 'completed']
+
+    def __call__(self, messages: List[Dict[str, Any]]) -> str:
+        content = str(messages[-1]['content'])
+        fields = dict(self.DEFAULT_FIELDS)
+        for marker, scripted in self._script:
+            if marker.search(content):
+                fields.update(scripted)
+                break
+        sections = [f'[[ ## {field} ## ]]\n{fields.get(field, "")}' for field in self.output_fields(messages)]
+        return '\n\n'.join(sections + ['[[ ## completed ## ]]'])
+
+
+class StubOllamaServer:
+    """
+    A threaded HTTP server speaking the parts of the Ollama API used by LM
+    clients: the native `/api/chat`, `/api/generate`, `/api/tags`, `/api/show`
+    and the OpenAI-compatible `/v1/chat/completions`.
+
+    Every answer is delayed by `latency` seconds plus `seconds_per_token`
+    per (estimated) completion token.
+    """
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, responder: Optional[ScriptedResponder]=None, latency: float=0.0, seconds_per_token: float=0.0, host: str='127.0.0.1', port: int=0):
+        self.responder = responder if responder is not None else ScriptedResponder()
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def make_lm(self, model: str='llama3.2:3b') -> dspy.LM:
+        return dspy.LM(f'ollama_chat/{model}', api_base=self.url, api_key='stub', cache=False)
+
+    def start(self) -> 'StubOllamaServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StubOllamaServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _answer(self, messages: List[Dict[str, Any]]) -> Tuple[str, int, int]:
+        with self._lock:
+            self.requests += 1
+        content = self.responder(messages)
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in messages) // self.CHARS_PER_TOKEN
+        completion_tokens = len(content) // self.CHARS_PER_TOKEN
+        time.sleep(self.latency + self.seconds_per_token * completion_tokens)
+        return content, prompt_tokens, completion_tokens
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body: Dict[str, Any]):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.startswith('/api/tags'):
+                    self._send({'models': [{'name': 'llama3.2:3b', 'model': 'llama3.2:3b'}]})
+                elif self.path.startswith('/api/version'):
+                    self._send({'version': '0.0.0-stub'})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+                if self.path.endswith('/chat/completions'):
+                    content, prompt_tokens, completion_tokens = server._answer(request.get('messages', []))
+                    self._send({
+                        'id': f'chatcmpl-stub-{server.requests}', 'object': 'chat.completion',
+                        'created': int(time.time()), 'model': request.get('model'),
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+                    })
+                elif self.path.startswith('/api/chat'):
+                    content, prompt_tokens, completion_tokens = server._answer(request.get('messages', []))
+                    self._send({
+                        'model': request.get('model'), 'created_at': now,
+                        'message': {'role': 'assistant', 'content': content},
+                        'done': True, 'done_reason': 'stop',
+                        'prompt_eval_count': prompt_tokens, 'eval_count': completion_tokens,
+                    })
+                elif self.path.startswith('/api/generate'):
+                    content, prompt_tokens, completion_tokens = server._answer([{'role': 'user', 'content': request.get('prompt', '')}])
+                    self._send({
+                        'model': request.get('model'), 'created_at': now, 'response': content,
+                        'done': True, 'done_reason': 'stop',
+                        'prompt_eval_count': prompt_tokens, 'eval_count': completion_tokens,
+                    })
+                elif self.path.startswith('/api/show'):
+                    self._send({'modelfile': '', 'parameters': '', 'template': '', 'details': {}, 'model_info': {}})
+                else:
+                    self.send_error(404)
+
+        return Handler
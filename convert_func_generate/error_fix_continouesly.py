@@ -97,6 +97,7 @@ targets: ['2024Q3', '2024Q2', '2024Q1', '2023Q4', '2023Q3', '2023Q2', '2023Q1',
 evaluation: {'f1_score': 0.875, 'accuracy': 0.5}
 """
 from src.evaluator import Evaluator
+from src.candidate_beam import CandidateBeam
 import dspy
 from typing import List
 from typing import Dict
@@ -186,9 +187,11 @@ def func(x: str) -> str:
 """
 value_pairs = list(zip(copy.copy(input_values), copy.copy(target_values)))
 accuracy = 0.0
+max_iteration = 5
+beam = CandidateBeam(k=3)
 
 iteration_cnt = 0
-while accuracy < 1.0:
+while accuracy < 1.0 and iteration_cnt < max_iteration:
     print('[flow] iteration:', iteration_cnt, '................................................................')
     random.shuffle(value_pairs)
     _input_values = [x[0] for x in value_pairs]
@@ -225,4 +228,8 @@ while accuracy < 1.0:
     accuracy = Evaluator.accuracy(func, input_values, target_values)
     print('[flow] accurecy:', accuracy)
     iteration_cnt += 1
-    incorrect_function = func_string
\ No newline at end of file
+    beam.add({'func_string': func_string, 'reasoning': response.reasoning}, accuracy, Evaluator.f1_score(func, input_values, target_values))
+    incorrect_function = beam.next_parent()['convertor']['func_string']
+
+print('[flow] best function with accuracy', beam.best['accuracy'], 'and f1 score', beam.best['f1_score'])
+print(beam.best['convertor']['func_string'])
\ No newline at end of file
@@ -97,6 +97,7 @@ targets: ['2024Q3', '2024Q2', '2024Q1', '2023Q4', '2023Q3', '2023Q2', '2023Q1',
 evaluation: {'f1_score': 0.875, 'accuracy': 0.5}
 """
 from src.evaluator import Evaluator
+from src.alignment import ValueAligner
 import dspy
 from typing import List, Callable, Tuple
 import copy
@@ -240,8 +241,7 @@ while True:
     print('[flow1] accurecy:', accuracy)
     print('[flow1] f1_score:', f1_score)
     if f1_score < 1.0:
-        input_values = sorted(input_values)
-        target_values = sorted(target_values)
+        input_values, target_values = ValueAligner().align(input_values, target_values, func=response.callable)
         continue
     else:
         break
\ No newline at end of file
@@ -1,10 +1,125 @@
-from src.data_sampler import EvaluateDataGenerator, PairTrainTestDataSampler
+from src.data_sampler import EvaluateDataGenerator, DiverseTrainTestDataSampler
 from src.workflow_tool import WorkflowController, WorkflowNode
-from src.dspy_agent import AdvanceConvertorGenerator, NumericConvertorGenerator, InvalidConvertorReviser
-from src.evaluator import Evaluator
+from src.dspy_agent import AdvanceConvertorGenerator, SpeculativeConvertorGenerator, NumericConvertorGenerator, InvalidConvertorReviser, response_cache, prompt_encoder
+from src.evaluator import FAILED, Evaluator, EvaluationResult
+from src.program_synthesis import SynthesisConvertorGenerator
+from src.convertor_library import ConvertorLibrary
+from src.convertor import Convertor
+from src.instrumentation import Tracer
+from src.checkpoint import CheckpointStore
+from src.scheduler import IterationScheduler
+from src.code_checks import CodeChecker
+from src.candidate_beam import CandidateBeam
+from src.composition import ConvertorComposer
+from src.alignment import ValueAligner
+import asyncio
+import os
 import pprint
 
 MAX_ITERATION = 5
+COLUMN_SECONDS_BUDGET = 120.0
+COLUMN_TOKEN_BUDGET = 30000
+MAX_WORKERS = 4
+MAX_LLM_CONCURRENCY = 4
+SPECULATIVE_CANDIDATES = 4
+TRAIN_TOKEN_BUDGET = 512
+BEAM_WIDTH = 3
+BEAM_MAX_REVISIONS = 2
+PARENT_MAX_FAILURES = 8
+COMPOSE_MIN_ACCURACY = 0.5
+COMPOSE_MAX_PARTITIONS = 4
+
+tracer = Tracer()
+scheduler = IterationScheduler(seconds_per_column=COLUMN_SECONDS_BUDGET, tokens_per_column=COLUMN_TOKEN_BUDGET, max_iterations=MAX_ITERATION)
+convertor_library = ConvertorLibrary(os.environ.get('CONVERTOR_LIBRARY', '.convertor_library/library.jsonl'))
+
+def evaluate_convertor(payload, fail_fast: bool=False) -> EvaluationResult:
+    """
+    Evaluate the current convertor on the current column, reusing
+    the evaluation in the payload if the convertor has been run already.
+    """
+    result = payload.get('evaluation_result')
+    func = payload['convertor']['callable']
+    if result is None or not result.matches(func, payload['input_values'], payload['target_values']):
+        result = evaluated_candidate(payload)
+        if result is None:
+            result = Evaluator.evaluate(func, payload['input_values'], payload['target_values'], fail_fast=fail_fast)
+            payload.setdefault('evaluated_candidates', dict())[candidate_hash(payload)] = result
+        payload['evaluation_result'] = result
+    return result
+
+def candidate_hash(payload):
+    try:
+        return CodeChecker.normalized_hash(payload['convertor']['func_string'])
+    except SyntaxError:
+        return None
+
+def evaluated_candidate(payload):
+    """
+    The evaluation of an equivalent convertor generated earlier on the same column, if any.
+    The convertor is swapped for the evaluated one so that the evaluation matches it.
+    """
+    result = payload.get('evaluated_candidates', dict()).get(candidate_hash(payload))
+    if result is None or result.input_values != list(payload['input_values']) or result.target_values != list(payload['target_values']):
+        return None
+    payload['convertor']['callable'] = result.func
+    return result
+
+def failure_values(payload) -> list:
+    """
+    Input values on which the last evaluated convertor did not produce the target
+    """
+    result = payload.get('evaluation_result')
+    if result is None or 'convertor' not in payload or not result.matches(payload['convertor']['callable'], payload['input_values'], payload['target_values']):
+        return []
+    return [row['input'] for row in result.pairwise_matching if not row['correct']]
+
+def split_train_test(payload):
+    return DiverseTrainTestDataSampler(token_budget=TRAIN_TOKEN_BUDGET).split(
+        payload['input_values'],
+        payload['target_values'],
+        failure_values=failure_values(payload)
+    )
+
+def revise_if_invalid(payload) -> str:
+    """
+    'again' to revise a convertor raising errors while the scheduler allows it, 'next' otherwise
+    """
+    if evaluate_convertor(payload, fail_fast=True).is_valid or not scheduler.may_revise():
+        return 'next'
+    return 'again'
+
+def revision_parent(payload):
+    """
+    The convertor to revise in the next inference, i.e., the beam's next parent
+    put in the payload by RepeatCounter, with up to PARENT_MAX_FAILURES of the
+    rows it does not convert; None before the first evaluation
+    """
+    if 'candidate_beam' not in payload or 'convertor' not in payload:
+        return None
+    result = evaluate_convertor(payload)
+    failures = [
+        f"{row['input']!r} -> {'an error' if row['output'] is FAILED else repr(row['output'])}, expected {row['target']!r}"
+        for row in result.pairwise_matching if not row['correct']
+    ]
+    return {
+        'func_string': payload['convertor']['func_string'],
+        'reasoning': payload['convertor']['reasoning'],
+        'failures': failures[:PARENT_MAX_FAILURES],
+    }
+
+def candidate_beam(payload) -> CandidateBeam:
+    return CandidateBeam(payload.setdefault('candidate_beam', []), k=BEAM_WIDTH, max_revisions=BEAM_MAX_REVISIONS)
+
+def split_accuracy(payload, result: EvaluationResult, split: str) -> float:
+    """
+    Accuracy of the evaluated convertor on the training or on the held-out testing values
+    """
+    outputs = dict(zip(payload['input_values'], result.outputs))
+    pairs = list(zip(payload.get(f'{split}_input_values', []), payload.get(f'{split}_target_values', [])))
+    if len(pairs) == 0:
+        return float('nan')
+    return sum(outputs.get(input) == target for input, target in pairs) / len(pairs)
 
 class IsNullConvertion(WorkflowNode):
     def determine_downstream(self, payload):
@@ -17,11 +132,11 @@ class IsNullConvertion(WorkflowNode):
 class NullConvertorProducer(WorkflowNode):
     def process(self, payload):
         payload['convertor'] = {
-            'callable': lambda x: x,
+            'callable': Convertor(lambda x: x),
             'reasoning': 'The input values are exactly the same the the target values.',
             'func_string': 'func = lambda x: x'
         }
-        payload['is_fit'] = Evaluator.is_fit(lambda x: x, payload['input_values'], payload['target_values'])
+        payload['is_fit'] = evaluate_convertor(payload, fail_fast=True).is_fit
         return payload
 
 class IsNumericConvertion(WorkflowNode):
@@ -45,7 +160,55 @@ class NumericConvertorProducer(WorkflowNode):
             'reasoning': response.reasoning,
             'func_string': response.func_string
         }
-        payload['is_fit'] = Evaluator.is_fit(response.callable, payload['input_values'], payload['target_values'])
+        payload['is_fit'] = evaluate_convertor(payload, fail_fast=True).is_fit
+        return payload
+
+class ConvertorLibraryLookup(WorkflowNode):
+    """
+    Reuse a convertor verified on an earlier column with the same value patterns
+    """
+    def determine_downstream(self, payload):
+        if payload.get('is_fit'):
+            return 'end'
+        else:
+            return 'continue'
+
+    def process(self, payload):
+        found = convertor_library.find(payload['input_values'], payload['target_values'])
+        if found is not None:
+            entry, result = found
+            payload['convertor'] = {
+                'callable': result.func,
+                'reasoning': f"Reused from the convertor library (originally produced by {entry['provenance'].get('source')}).",
+                'func_string': entry['func_string']
+            }
+            payload['evaluation_result'] = result
+            payload['is_fit'] = True
+        return payload
+
+class ProgramSynthesisProducer(WorkflowNode):
+    """
+    Try to synthesize the convertor from a DSL of string and number
+    operations before falling back to the LLM
+    """
+    def determine_downstream(self, payload):
+        if payload.get('is_fit'):
+            return 'end'
+        else:
+            return 'continue'
+
+    def process(self, payload):
+        response = SynthesisConvertorGenerator()(
+            input_values=payload['input_values'],
+            target_values=payload['target_values']
+        )
+        if response is not None:
+            payload['convertor'] = {
+                'callable': response.callable,
+                'reasoning': response.reasoning,
+                'func_string': response.func_string
+            }
+            payload['is_fit'] = evaluate_convertor(payload, fail_fast=True).is_fit
         return payload
 
 class PairwiseDataSampler(WorkflowNode):
@@ -54,10 +217,7 @@ class PairwiseDataSampler(WorkflowNode):
             train_input_values, train_target_values
         ), (
             test_input_values, test_target_values
-        ) = PairTrainTestDataSampler().split(
-            payload['input_values'],
-            payload['target_values']
-        )
+        ) = split_train_test(payload)
         payload.update(
             {
                 'train_input_values': train_input_values,
@@ -69,15 +229,14 @@ class PairwiseDataSampler(WorkflowNode):
         return payload
 
 class PairConvertorInference(WorkflowNode):
+    llm_bound = True
+
     def determine_downstream(self, payload):
-        if Evaluator.is_valid(payload['convertor']['callable'], payload['input_values']):
-            return 'next'
-        else:
-            return 'again'
+        return revise_if_invalid(payload)
         
-    def process(self, payload):
+    async def process(self, payload):
         generator = AdvanceConvertorGenerator()
-        response = generator(payload['train_input_values'], payload['train_target_values'])
+        response = await generator.acall(payload['train_input_values'], payload['train_target_values'], parent=revision_parent(payload))
         payload.update(
             {
                 'convertor': {
@@ -89,17 +248,49 @@ class PairConvertorInference(WorkflowNode):
         )
         return payload
     
+class SpeculativeConvertorInference(WorkflowNode):
+    """
+    Infer SPECULATIVE_CANDIDATES convertors concurrently, each from a different
+    training sample, and keep the first one that fits the column.
+    Every candidate holds its own LLM slot, so the fan-out respects MAX_LLM_CONCURRENCY.
+    """
+    llm_fanout = True
+
+    def determine_downstream(self, payload):
+        return revise_if_invalid(payload)
+
+    async def process(self, payload):
+        splits = [split_train_test(payload) for _ in range(SPECULATIVE_CANDIDATES)]
+        samples = [train for train, _ in splits]
+        generator = SpeculativeConvertorGenerator()
+        response = await generator.acall(samples, payload['input_values'], payload['target_values'], parent=revision_parent(payload))
+        (train_input_values, train_target_values), (test_input_values, test_target_values) = splits[response.sample_index]
+        payload.update(
+            {
+                'train_input_values': train_input_values,
+                'train_target_values': train_target_values,
+                'test_input_values': test_input_values,
+                'test_target_values': test_target_values,
+                'convertor': {
+                    'callable': response.callable,
+                    'reasoning': response.reasoning,
+                    'func_string': response.func_string,
+                },
+                'evaluation_result': response.evaluation_result
+            }
+        )
+        return payload
+
 class InvalidConvertorRevise(WorkflowNode):
+    llm_bound = True
+
     def determine_downstream(self, payload):
-        if Evaluator.is_valid(payload['convertor']['callable'], payload['input_values']):
-            return 'next'
-        else:
-            return 'again'
+        return revise_if_invalid(payload)
         
-    def process(self, payload):
+    async def process(self, payload):
         payload['train_target_values']
         reviser = InvalidConvertorReviser()
-        response = reviser(
+        response = await reviser.acall(
             payload['convertor']['func_string'],
             payload['convertor']['reasoning'],
             payload['input_values'],
@@ -111,14 +302,15 @@ class InvalidConvertorRevise(WorkflowNode):
                     'callable': response.callable,
                     'reasoning': response.reasoning,
                     'func_string': response.func_string,
-                }
+                },
+                'evaluation_result': response.evaluation_result
             }
         )
         return payload
     
 class FitEvaluator(WorkflowNode):
     def determine_downstream(self, payload):
-        if Evaluator.is_fit(payload['convertor']['callable'], payload['input_values'], payload['target_values']):
+        if payload['is_fit']:
             return 'end'
         else:
             return 'again'
@@ -126,109 +318,193 @@ class FitEvaluator(WorkflowNode):
     def process(self, payload):
         payload.update(
             {
-                'is_fit': Evaluator.is_fit(payload['convertor']['callable'], payload['input_values'], payload['target_values'])
+                'is_fit': evaluate_convertor(payload, fail_fast=True).is_fit
             }
         )
         return payload
     
 class RepeatCounter(WorkflowNode):
+    """
+    Evaluate the convertor and let the scheduler decide whether
+    to iterate again within the budget of the column.
+
+    The convertor joins the beam of best candidates and the next
+    iteration revises the beam's next parent, which is not
+    necessarily the latest convertor (see `revision_parent`).
+    """
     def determine_downstream(self, payload):
-        if payload['repeat_count'] > MAX_ITERATION:
-            return 'end'
-        elif payload['repeat_count'] >  2 and (payload['evaluation']['f1_score'] > payload['evaluation']['accuracy'] + 0.1):
-            return 'sort_values'
-        else:
-            return 'feedback'
-        
+        decision = scheduler.decide(payload['evaluation'])
+        if decision == 'feedback' and self._composable(payload):
+            return 'compose'
+        return decision
+
+    @staticmethod
+    def _composable(payload) -> bool:
+        """
+        Whether the convertor fits enough of the column to be composed
+        with sub-convertors, and has not been composed already
+        """
+        return (
+            payload['evaluation']['accuracy'] >= COMPOSE_MIN_ACCURACY
+            and payload['convertor']['func_string'] not in payload.get('composed_func_strings', [])
+        )
+
     def process(self, payload):
         print('[RepeatCounter:process] # repeat:', payload.get('repeat_count'), ''.join(['.'] * 50))
         print('func_string:', payload['convertor']['func_string'])
         print('reasoning:', payload['convertor']['reasoning'])
         print('inputs:', payload['input_values'])
-        print('outputs:', list(map(payload['convertor']['callable'], payload['input_values'])))
+        result = evaluate_convertor(payload)
+        print('outputs:', result.outputs)
         print('targets:', payload['target_values'])
         payload.update({
                 'evaluation': {
-                    'f1_score': Evaluator.f1_score(
-                        payload['convertor']['callable'], 
-                        payload['input_values'], 
-                        payload['target_values']
-                    ),
-                    'accuracy': Evaluator.accuracy(
-                        payload['convertor']['callable'], 
-                        payload['input_values'], 
-                        payload['target_values']
-                    )
+                    'f1_score': result.f1_score,
+                    'accuracy': result.accuracy,
+                    'train_accuracy': split_accuracy(payload, result, 'train'),
+                    'test_accuracy': split_accuracy(payload, result, 'test')
                 }
             })
         pprint.pprint(payload['evaluation'])
+        if payload['evaluation']['train_accuracy'] == 1.0 and payload['evaluation']['test_accuracy'] < 1.0:
+            print('[RepeatCounter:overfit] the convertor fits the training values only')
+        scheduler.observe(payload['evaluation'])
+        beam = candidate_beam(payload)
+        beam.add(payload['convertor'], result.accuracy, result.f1_score)
+        parent = beam.next_parent()
+        if parent['convertor']['func_string'] != payload['convertor']['func_string']:
+            print('[RepeatCounter:beam] continue from an earlier candidate with accuracy', parent['accuracy'])
+            payload['convertor'] = parent['convertor']
+            parent_result = evaluate_convertor(payload)
+            payload['evaluation'].update({'f1_score': parent_result.f1_score, 'accuracy': parent_result.accuracy})
         if 'repeat_count' in payload:
             payload['repeat_count'] += 1
         else:
             payload['repeat_count'] = 1
         return payload
 
-class ValueSort(WorkflowNode):
+class ConvertorComposition(WorkflowNode):
+    """
+    Keep the partially fitting convertor for the values it converts and
+    add sub-convertors for the shapes of the values it misses.
+    The sub-convertors are inferred concurrently, each holding its own LLM slot.
+    """
+    llm_fanout = True
+
+    async def process(self, payload):
+        func_string = payload['convertor']['func_string']
+        payload.setdefault('composed_func_strings', []).append(func_string)
+        composer = ConvertorComposer(max_partitions=COMPOSE_MAX_PARTITIONS)
+        response = await composer.acompose(func_string, evaluate_convertor(payload))
+        if response is not None:
+            payload.update(
+                {
+                    'convertor': {
+                        'callable': response.callable,
+                        'reasoning': response.reasoning,
+                        'func_string': response.func_string,
+                    },
+                    'evaluation_result': response.evaluation_result
+                }
+            )
+            payload['composed_func_strings'].append(response.func_string)
+        return payload
+
+class ValueAlignment(WorkflowNode):
     """
-    Sorting Values for better inferencing on 
-    Convertion
+    Re-pair the target values with the input values, by similarity or by
+    sorting, whichever matches more outputs of the current convertor,
+    for better inferencing on Convertion
     """
     def process(self, payload):
-        payload['input_values'] = sorted(payload['input_values'])
-        payload['target_values'] = sorted(payload['target_values'])
+        func = payload['convertor']['callable'] if 'convertor' in payload else None
+        payload['input_values'], payload['target_values'] = ValueAligner().align(payload['input_values'], payload['target_values'], func=func)
         return payload
 
 
 class CompareOutputAndGroundTruth(WorkflowNode):
     """
-    Add the output for debugging
+    Add the output for debugging. An unfit run ends
+    with the best candidate it has seen.
     """
     def process(self, payload):
+        best = candidate_beam(payload).best
+        if not payload.get('is_fit') and best is not None:
+            payload['convertor'] = best['convertor']
+        result = evaluate_convertor(payload)
         payload.update(
             {
                 'evaluation': {
-                    'f1_score': Evaluator.f1_score(
-                        payload['convertor']['callable'], 
-                        payload['input_values'], 
-                        payload['target_values']
-                    ),
-                    'accuracy': Evaluator.accuracy(
-                        payload['convertor']['callable'], 
-                        payload['input_values'], 
-                        payload['target_values']
-                    )
+                    'f1_score': result.f1_score,
+                    'accuracy': result.accuracy
                 }
             }
         )
         return payload
-        
+
+
+class ConvertorLibraryRecorder(WorkflowNode):
+    """
+    Add fitted convertors produced by synthesis or by the LLM to the convertor library
+    """
+    def process(self, payload):
+        sources = [node for node in payload['workflow_records'] if isinstance(node, LIBRARY_SOURCES)]
+        if payload['is_fit'] and len(sources) > 0:
+            convertor_library.add(
+                payload['input_values'],
+                payload['target_values'],
+                payload['convertor']['func_string'],
+                {
+                    'source': sources[-1].__class__.__name__,
+                    'value_descriptions': payload['value_descriptions'],
+                    'repeat_count': payload.get('repeat_count', 0)
+                }
+            )
+        return payload
+
+LIBRARY_SOURCES = (ProgramSynthesisProducer, PairConvertorInference, SpeculativeConvertorInference, InvalidConvertorRevise, ConvertorComposition)
+
 
 # Define Operator Nodes
 is_null_convertion = IsNullConvertion()
 null_convertion_producer = NullConvertorProducer()
 is_numeric_convertion = IsNumericConvertion()
 numeric_convertion_producer = NumericConvertorProducer()
+convertor_library_lookup = ConvertorLibraryLookup()
+program_synthesis_producer = ProgramSynthesisProducer()
 pairwise_data_generator = PairwiseDataSampler()
 pairwise_data_generator_for_invalid_reviser = PairwiseDataSampler()
 invalid_reviser = InvalidConvertorRevise()
 pairwise_convertor_inferencer = PairConvertorInference()
+speculative_convertor_inferencer = SpeculativeConvertorInference()
 fit_evaluator = FitEvaluator()
 repeat_counter = RepeatCounter()
-value_sortor = ValueSort()
+value_aligner = ValueAlignment()
+convertor_composition = ConvertorComposition()
 final_debug = CompareOutputAndGroundTruth()
+convertor_library_recorder = ConvertorLibraryRecorder()
+
+# Enter convertor inference through the speculative node unless it is disabled
+convertor_inference_entry = speculative_convertor_inferencer if SPECULATIVE_CANDIDATES > 1 else pairwise_data_generator
 
 # Connecting the Operator Nodes
 is_null_convertion.attach_downstream('do_null_convertion', null_convertion_producer)
 null_convertion_producer.attach_downstream('end', final_debug)
 
 is_null_convertion.attach_downstream('continue', is_numeric_convertion)
-is_numeric_convertion.attach_downstream('continue', pairwise_data_generator)
+is_numeric_convertion.attach_downstream('continue', convertor_library_lookup)
 is_numeric_convertion.attach_downstream('do_numeric_convertion', numeric_convertion_producer)
 numeric_convertion_producer.attach_downstream('end', final_debug)
+convertor_library_lookup.attach_downstream('end', final_debug)
+convertor_library_lookup.attach_downstream('continue', program_synthesis_producer)
+program_synthesis_producer.attach_downstream('end', final_debug)
+program_synthesis_producer.attach_downstream('continue', convertor_inference_entry)
 
 pairwise_data_generator.attach_downstream('next', pairwise_convertor_inferencer)
 pairwise_convertor_inferencer.attach_downstream('next', fit_evaluator)
 pairwise_convertor_inferencer.attach_downstream('again', pairwise_data_generator_for_invalid_reviser)
+speculative_convertor_inferencer.attach_downstream('next', fit_evaluator)
+speculative_convertor_inferencer.attach_downstream('again', pairwise_data_generator_for_invalid_reviser)
 pairwise_data_generator_for_invalid_reviser.attach_downstream('next', invalid_reviser)
 invalid_reviser.attach_downstream('next', fit_evaluator)
 invalid_reviser.attach_downstream('again', pairwise_data_generator_for_invalid_reviser)
@@ -236,30 +512,48 @@ invalid_reviser.attach_downstream('again', pairwise_data_generator_for_invalid_r
 fit_evaluator.attach_downstream('end', final_debug)
 fit_evaluator.attach_downstream('again', repeat_counter)
 repeat_counter.attach_downstream('end', final_debug)
-repeat_counter.attach_downstream('feedback', pairwise_data_generator)
-repeat_counter.attach_downstream('sort_values', value_sortor)
-value_sortor.attach_downstream('next', pairwise_data_generator)
+repeat_counter.attach_downstream('feedback', convertor_inference_entry)
+repeat_counter.attach_downstream('align_values', value_aligner)
+repeat_counter.attach_downstream('compose', convertor_composition)
+convertor_composition.attach_downstream('next', fit_evaluator)
+value_aligner.attach_downstream('next', convertor_inference_entry)
+final_debug.attach_downstream('next', convertor_library_recorder)
+
+checkpoint_store = CheckpointStore(os.environ.get('CONVERTOR_CHECKPOINT', '.checkpoints/checkpoints.jsonl'), is_null_convertion)
+controller = WorkflowController(is_null_convertion, verbose=False, verbose_callback=lambda x: (x.get('convertor'), x['input_values']), hooks=[tracer, checkpoint_store, scheduler])
 
-controller = WorkflowController(is_null_convertion, verbose=False, verbose_callback=lambda x: (x.get('convertor'), x['input_values']))
 
 
+def report(i, payload):
+    print('====================================================================')
+    if not payload['is_fit']:
+        print('[main:failed]', i, '\n', payload['convertor']['func_string'])
+        print('reasoning:', payload['convertor']['reasoning'])
+        print('inputs:', payload['input_values'])
+        print('outputs:', evaluate_convertor(payload).outputs)
+        print('targets:', payload['target_values'])
+        print('evaluation:', payload['evaluation'])
+    else:
+        print('[main:success] no.', i, '\n', 
+              'accuracy:', payload['evaluation']['accuracy'], 
+              'f1_score:', payload['evaluation']['f1_score'], 
+              '\nfunc:\n', 
+              payload['convertor']['func_string'], [r.__class__ for r in payload['workflow_records']])
+
+
+async def main():
+    instances = EvaluateDataGenerator(['f00032q']).generate()
+    async for i, payload in controller.run_batch_async(instances, max_llm_concurrency=MAX_LLM_CONCURRENCY, max_workers=MAX_WORKERS):
+        report(i, payload)
+    print('[main:lm_cache]', response_cache.stats)
+    print('[main:prompt_tokens]', prompt_encoder.stats)
+    print('[main:scheduler]', scheduler.stats)
+    pprint.pprint(tracer.summary())
+    trace_path = os.environ.get('CONVERTOR_TRACE', '.traces/trace')
+    tracer.export_jsonl(f'{trace_path}.jsonl')
+    tracer.export_chrome_trace(f'{trace_path}.chrome.json')
+    print('[main:trace]', f'{trace_path}.jsonl', f'{trace_path}.chrome.json')
+
 
 if __name__ == '__main__':
-    for i, instance in enumerate(EvaluateDataGenerator(['f00032q']).generate()):
-        # instance['input_values'] = list(map(float, instance['input_values']))
-        # print(set(instance['input_values']) == set(instance['target_values']))
-        print('====================================================================')
-        payload = controller.run(instance)
-        if not payload['is_fit']:
-            print('[main:failed]', i, '\n', payload['convertor']['func_string'])
-            print('reasoning:', payload['convertor']['reasoning'])
-            print('inputs:', payload['input_values'])
-            print('outputs:', list(map(payload['convertor']['callable'], payload['input_values'])))
-            print('targets:', payload['target_values'])
-            print('evaluation:', payload['evaluation'])
-        else:
-            print('[main:success] no.', i, '\n', 
-                  'accuracy:', payload['evaluation']['accuracy'], 
-                  'f1_score:', payload['evaluation']['f1_score'], 
-                  '\nfunc:\n', 
-                  payload['convertor']['func_string'], [r.__class__ for r in payload['workflow_records']])
\ No newline at end of file
+    asyncio.run(main())
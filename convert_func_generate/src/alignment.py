@@ -0,0 +1,280 @@
+"""
+Recovering the pairing of shuffled input and target values.
+
+A similarity matrix between the input and the target values combines the
+case-insensitive Jaro-Winkler and token-sorted similarities (rapidfuzz `cdist`,
+vectorized over the whole column), the ratio of the numeric values and the
+overlap of the digits they contain.
+The pairing maximizing the total similarity is found with the Hungarian
+algorithm (`scipy.optimize.linear_sum_assignment`).
+
+Above `max_exact_size` values the dense matrix is too large: candidate pairs
+are then blocked with MinHash LSH over character bigrams, only those pairs are
+scored, and the matching is solved on the sparse graph.
+
+Conversions keeping the order of the values (e.g., `201903` -> `2019Q1`) are
+paired best by sorting both columns, which the similarity cannot tell apart
+from the neighbouring values. The sorted pairing is therefore kept as a
+candidate: the pairing matching more outputs of the current convertor wins,
+and without a convertor (or on a tie) the sorted pairing is used when its
+similarity comes within `sorted_tolerance` of the best pairing's.
+"""
+import zlib
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from rapidfuzz import fuzz
+from rapidfuzz.distance import JaroWinkler
+from rapidfuzz.utils import default_process
+from rapidfuzz.process import cdist, cpdist
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from .evaluator import FAILED, Evaluator
+
+__all__ = [
+    'ValueAligner'
+]
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def _to_float(values: Sequence[Any]) -> np.ndarray:
+    numbers = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            numbers[i] = float(str(value).replace(',', ''))
+        except ValueError:
+            pass
+    return numbers
+
+
+def _digit_counts(values: Sequence[Any]) -> np.ndarray:
+    counts = np.zeros((len(values), 10), dtype=np.float32)
+    for i, value in enumerate(values):
+        for char in str(value):
+            if '0' <= char <= '9':
+                counts[i, ord(char) - 48] += 1
+    return counts
+
+
+def _shingles(value: Any) -> List[int]:
+    text = str(value).lower()
+    grams = [text[i:i + 2] for i in range(len(text) - 1)] or [text]
+    return [zlib.crc32(gram.encode('utf-8')) for gram in grams]
+
+
+class ValueAligner:
+    """
+    Align target values to input values by similarity.
+
+    The weights apply to the Jaro-Winkler similarity, the similarity of the
+    values with their words sorted, the numeric ratio (only when both columns
+    are mostly numeric) and the shared digits (only when both columns contain
+    digits); unused weights are dropped.
+    """
+    def __init__(
+            self,
+            jaro_winkler_weight: float=0.35,
+            token_weight: float=0.25,
+            numeric_weight: float=0.2,
+            digit_weight: float=0.2,
+            max_exact_size: int=2000,
+            num_perm: int=64,
+            rows_per_band: int=2,
+            max_bucket_pairs: int=4096,
+            chunk_size: int=512,
+            sorted_tolerance: float=0.85,
+            seed: int=0):
+        self._sorted_tolerance = sorted_tolerance
+        self._weights = (jaro_winkler_weight, token_weight, numeric_weight, digit_weight)
+        self._max_exact_size = max_exact_size
+        self._num_perm = num_perm
+        self._rows_per_band = rows_per_band
+        self._max_bucket_pairs = max_bucket_pairs
+        self._chunk_size = chunk_size
+        rng = np.random.default_rng(seed)
+        self._perm_a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._perm_b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def _features(self, input_values: Sequence[Any], target_values: Sequence[Any]):
+        input_numbers, target_numbers = _to_float(input_values), _to_float(target_values)
+        input_digits, target_digits = _digit_counts(input_values), _digit_counts(target_values)
+        use_numeric = np.mean(~np.isnan(input_numbers)) > 0.5 and np.mean(~np.isnan(target_numbers)) > 0.5
+        use_digits = input_digits.sum() > 0 and target_digits.sum() > 0
+        weights = np.array([
+            self._weights[0],
+            self._weights[1],
+            self._weights[2] if use_numeric else 0.0,
+            self._weights[3] if use_digits else 0.0
+        ])
+        return weights / weights.sum(), (input_numbers, target_numbers), (input_digits, target_digits)
+
+    @staticmethod
+    def _numeric_similarity(inputs: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        min(|a|, |b|) / max(|a|, |b|) of same-signed numbers, 0 otherwise
+        """
+        a, b = np.abs(inputs), np.abs(targets)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.minimum(a, b) / np.maximum(a, b)
+        ratio = np.where((a == 0) & (b == 0), 1.0, ratio)
+        ratio = np.where(np.sign(inputs) == np.sign(targets), ratio, 0.0)
+        return np.nan_to_num(ratio, nan=0.0).astype(np.float32)
+
+    @staticmethod
+    def _digit_similarity(inputs: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        shared = np.minimum(inputs, targets).sum(axis=-1)
+        total = np.maximum(inputs, targets).sum(axis=-1)
+        return np.where(total > 0, shared / np.maximum(total, 1), 0.0).astype(np.float32)
+
+    def similarity_matrix(self, input_values: Sequence[Any], target_values: Sequence[Any]) -> np.ndarray:
+        """
+        The (len(input_values), len(target_values)) similarity matrix in [0, 1]
+        """
+        weights, (input_numbers, target_numbers), (input_digits, target_digits) = self._features(input_values, target_values)
+        inputs = [str(value) for value in input_values]
+        targets = [str(value) for value in target_values]
+        matrix = weights[0] * cdist(inputs, targets, scorer=JaroWinkler.normalized_similarity, processor=default_process, dtype=np.float32, workers=-1)
+        if weights[1] > 0:
+            matrix += weights[1] / 100 * cdist(inputs, targets, scorer=fuzz.token_sort_ratio, processor=default_process, dtype=np.float32, workers=-1)
+        if weights[2] > 0:
+            matrix += weights[2] * self._numeric_similarity(input_numbers[:, None], target_numbers[None, :])
+        if weights[3] > 0:
+            for start in range(0, len(input_values), self._chunk_size):
+                rows = slice(start, start + self._chunk_size)
+                matrix[rows] += weights[3] * self._digit_similarity(input_digits[rows, None, :], target_digits[None, :, :])
+        return matrix
+
+    def pair_similarity(self, input_values: Sequence[Any], target_values: Sequence[Any], rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """
+        The similarity of the pairs (input_values[rows[k]], target_values[columns[k]])
+        """
+        weights, (input_numbers, target_numbers), (input_digits, target_digits) = self._features(input_values, target_values)
+        inputs = [str(input_values[i]) for i in rows]
+        targets = [str(target_values[j]) for j in columns]
+        similarity = weights[0] * cpdist(inputs, targets, scorer=JaroWinkler.normalized_similarity, processor=default_process, dtype=np.float32, workers=-1)
+        if weights[1] > 0:
+            similarity += weights[1] / 100 * cpdist(inputs, targets, scorer=fuzz.token_sort_ratio, processor=default_process, dtype=np.float32, workers=-1)
+        if weights[2] > 0:
+            similarity += weights[2] * self._numeric_similarity(input_numbers[rows], target_numbers[columns])
+        if weights[3] > 0:
+            similarity += weights[3] * self._digit_similarity(input_digits[rows], target_digits[columns])
+        return similarity
+
+    def _signatures(self, values: Sequence[Any]) -> np.ndarray:
+        signatures = np.empty((len(values), self._num_perm), dtype=np.uint64)
+        for i, value in enumerate(values):
+            hashes = np.asarray(_shingles(value), dtype=np.uint64)
+            signatures[i] = ((np.outer(hashes, self._perm_a) + self._perm_b) % MERSENNE_PRIME).min(axis=0)
+        return signatures
+
+    def candidate_pairs(self, input_values: Sequence[Any], target_values: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (row, column) index arrays of the pairs sharing at least one LSH band.
+        Buckets with more than `max_bucket_pairs` pairs are skipped.
+        """
+        input_signatures, target_signatures = self._signatures(input_values), self._signatures(target_values)
+        m = len(target_values)
+        keys = []
+        for start in range(0, self._num_perm, self._rows_per_band):
+            buckets = defaultdict(lambda: ([], []))
+            for i, band in enumerate(map(bytes, input_signatures[:, start:start + self._rows_per_band])):
+                buckets[band][0].append(i)
+            for j, band in enumerate(map(bytes, target_signatures[:, start:start + self._rows_per_band])):
+                if band in buckets:
+                    buckets[band][1].append(j)
+            for rows, columns in buckets.values():
+                if columns and len(rows) * len(columns) <= self._max_bucket_pairs:
+                    keys.append((np.asarray(rows, dtype=np.int64)[:, None] * m + np.asarray(columns, dtype=np.int64)[None, :]).ravel())
+        keys = np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.int64)
+        return keys // m, keys % m
+
+    def _match_blocked(self, input_values: Sequence[Any], target_values: Sequence[Any]) -> np.ndarray:
+        n = len(input_values)
+        rows, columns = self.candidate_pairs(input_values, target_values)
+        similarity = self.pair_similarity(input_values, target_values, rows, columns)
+        try:
+            graph = csr_matrix((2.0 - similarity, (rows, columns)), shape=(n, n))
+            matched_rows, matched_columns = min_weight_full_bipartite_matching(graph)
+            assignment = np.empty(n, dtype=np.int64)
+            assignment[matched_rows] = matched_columns
+            return assignment
+        except ValueError:
+            pass
+        # No full matching among the candidate pairs: match greedily, then the rest
+        assignment = np.full(n, -1, dtype=np.int64)
+        used = np.zeros(n, dtype=bool)
+        for k in np.argsort(-similarity, kind='stable'):
+            i, j = rows[k], columns[k]
+            if assignment[i] < 0 and not used[j]:
+                assignment[i] = j
+                used[j] = True
+        left_rows, left_columns = np.flatnonzero(assignment < 0), np.flatnonzero(~used)
+        if len(left_rows) <= self._max_exact_size:
+            matrix = self.similarity_matrix([input_values[i] for i in left_rows], [target_values[j] for j in left_columns])
+            sub_rows, sub_columns = linear_sum_assignment(matrix, maximize=True)
+            assignment[left_rows[sub_rows]] = left_columns[sub_columns]
+        else:
+            order_rows = sorted(left_rows, key=lambda i: str(input_values[i]))
+            order_columns = sorted(left_columns, key=lambda j: str(target_values[j]))
+            assignment[order_rows] = order_columns
+        return assignment
+
+    def assignment(self, input_values: Sequence[Any], target_values: Sequence[Any]) -> np.ndarray:
+        """
+        For each input value, the index of the target value paired with it
+        """
+        if len(input_values) != len(target_values):
+            raise ValueError(f'cannot align {len(input_values)} input values with {len(target_values)} target values')
+        if len(input_values) <= self._max_exact_size:
+            rows, columns = linear_sum_assignment(self.similarity_matrix(input_values, target_values), maximize=True)
+            assignment = np.empty(len(input_values), dtype=np.int64)
+            assignment[rows] = columns
+            return assignment
+        return self._match_blocked(input_values, target_values)
+
+    @staticmethod
+    def sorted_assignment(input_values: Sequence[Any], target_values: Sequence[Any]) -> np.ndarray:
+        """
+        The assignment pairing the k-th smallest input value with the k-th smallest target value
+        """
+        if len(input_values) != len(target_values):
+            raise ValueError(f'cannot align {len(input_values)} input values with {len(target_values)} target values')
+        assignment = np.empty(len(input_values), dtype=np.int64)
+        assignment[sorted(range(len(input_values)), key=input_values.__getitem__)] = sorted(range(len(target_values)), key=target_values.__getitem__)
+        return assignment
+
+    def choose(self, input_values: Sequence[Any], target_values: Sequence[Any], candidates: Dict[str, np.ndarray], func: Optional[Callable]=None) -> str:
+        """
+        The name of the candidate assignment matching the most outputs of `func`;
+        on a tie (or without `func`) 'sorted' when its mean similarity is within
+        `sorted_tolerance` of the other candidates', 'similarity' otherwise
+        """
+        if func is not None:
+            outputs = Evaluator.evaluate(func, input_values).outputs
+            matches = {
+                name: sum(output is not FAILED and output == target_values[j] for output, j in zip(outputs, assignment))
+                for name, assignment in candidates.items()
+            }
+            best = max(matches.values())
+            tied = [name for name, count in matches.items() if count == best]
+            if len(tied) == 1:
+                return tied[0]
+        rows = np.arange(len(input_values))
+        similarities = {name: float(self.pair_similarity(input_values, target_values, rows, assignment).mean()) for name, assignment in candidates.items()}
+        if similarities['sorted'] >= self._sorted_tolerance * similarities['similarity']:
+            return 'sorted'
+        return 'similarity'
+
+    def align(self, input_values: List[Any], target_values: List[Any], func: Optional[Callable]=None) -> Tuple[List[Any], List[Any]]:
+        """
+        The input values and the target values reordered to pair with them,
+        by similarity or by sorting, whichever `choose` prefers
+        """
+        candidates = {
+            'similarity': self.assignment(input_values, target_values),
+            'sorted': self.sorted_assignment(input_values, target_values),
+        }
+        assignment = candidates[self.choose(input_values, target_values, candidates, func=func)]
+        return list(input_values), [target_values[j] for j in assignment]
@@ -0,0 +1,73 @@
+"""
+Beam of the best convertor candidates seen while revising a convertor.
+"""
+from typing import Any, Dict, List, Optional
+from .code_checks import CodeChecker
+
+__all__ = [
+    'CandidateBeam'
+]
+
+
+class CandidateBeam:
+    """
+    Keep the top `k` candidates by (accuracy, f1_score).
+    Each candidate is revised at most `max_revisions` times before the
+    next best one is revised (unless every candidate reached the cap).
+
+    The beam is a view over a plain list of entries (e.g., kept in the workflow
+    payload, so that it is checkpointed with it). Each entry holds the convertor
+    dict, its scores, its normalized code hash and how often it was revised.
+    Equivalent candidates (same normalized code) are only kept once.
+    """
+    def __init__(self, entries: Optional[List[Dict[str, Any]]]=None, k: int=3, max_revisions: int=2):
+        self.entries = entries if entries is not None else []
+        self.k = k
+        self.max_revisions = max_revisions
+
+    @staticmethod
+    def _score(entry: Dict[str, Any]):
+        return (entry['accuracy'], entry['f1_score'])
+
+    @staticmethod
+    def _hash(convertor: Dict[str, Any]) -> str:
+        try:
+            return CodeChecker.normalized_hash(convertor['func_string'])
+        except SyntaxError:
+            return convertor['func_string']
+
+    def add(self, convertor: Dict[str, Any], accuracy: float, f1_score: float) -> bool:
+        """
+        Add a scored candidate; return whether it is kept in the beam
+        """
+        candidate_hash = self._hash(convertor)
+        if any(entry['hash'] == candidate_hash for entry in self.entries):
+            return False
+        entry = {'convertor': convertor, 'accuracy': accuracy, 'f1_score': f1_score, 'hash': candidate_hash, 'revisions': 0}
+        self.entries.append(entry)
+        self.entries.sort(key=self._score, reverse=True)
+        del self.entries[self.k:]
+        return entry in self.entries
+
+    @property
+    def best(self) -> Optional[Dict[str, Any]]:
+        return self.entries[0] if self.entries else None
+
+    def next_parent(self) -> Optional[Dict[str, Any]]:
+        """
+        The candidate to revise next: the best one of the beam revised fewer
+        than `max_revisions` times, the less revised one among equally scored
+        candidates. Once every candidate reached the cap, the least revised one.
+        """
+        if not self.entries:
+            return None
+        if all(entry['revisions'] >= self.max_revisions for entry in self.entries):
+            key = lambda entry: (entry['revisions'], -entry['accuracy'], -entry['f1_score'])
+        else:
+            key = lambda entry: (entry['revisions'] >= self.max_revisions, -entry['accuracy'], -entry['f1_score'], entry['revisions'])
+        parent = min(self.entries, key=key)
+        parent['revisions'] += 1
+        return parent
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,167 @@
+"""
+Record/replay cassettes of LM traffic.
+
+`CassetteLM` wraps a dspy LM. In record mode every request and the provider
+response of the wrapped LM are appended to a JSON-lines file (gzip-compressed
+when the path ends with `.gz`); in replay mode the recorded responses are served
+back from `forward`/`aforward` without calling the wrapped LM, so no model server
+is needed while dspy still parses the outputs and keeps the history and usage.
+Scripts enable it through `use_cassette`:
+
+    LM_CASSETTE=runs/main.jsonl.gz LM_CASSETTE_MODE=record python main.py
+    LM_CASSETTE=runs/main.jsonl.gz LM_CASSETTE_MODE=replay python main.py
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+import dspy
+from .lm_cache import canonicalize
+
+__all__ = [
+    'CassetteLM',
+    'CassetteMiss',
+    'use_cassette'
+]
+
+MODES = ('record', 'replay', 'auto')
+
+
+class CassetteMiss(KeyError):
+    """
+    A request made in replay mode that the cassette has no recording of
+    """
+
+
+def _plain(response: Any) -> Any:
+    """
+    The provider response as plain JSON-serializable dicts and lists
+    """
+    if hasattr(response, 'model_dump'):
+        response = response.model_dump()
+    if isinstance(response, dict):
+        return {key: _plain(item) for key, item in response.items()}
+    if isinstance(response, (list, tuple)):
+        return [_plain(item) for item in response]
+    return json.loads(json.dumps(response, ensure_ascii=False, default=str))
+
+
+def _open(path: str, mode: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class CassetteLM(dspy.BaseLM):
+    """
+    A dspy LM recording the provider responses of `lm` to `path` or replaying them.
+
+    - record: call `lm` and append every request/response pair
+    - replay: serve recorded responses only, raising CassetteMiss otherwise
+    - auto: replay what is recorded and record the rest
+
+    Requests are matched on a hash of the model, the prompt/messages and the
+    call arguments; without `lm` or `model` the model of the first recording is
+    assumed. Identical requests are replayed in their recorded order,
+    the last recording being repeated once they are used up.
+    """
+    def __init__(self, path: str, mode: str='replay', lm: Optional[dspy.BaseLM]=None, model: Optional[str]=None):
+        if mode not in MODES:
+            raise ValueError(f'unknown cassette mode {mode!r}, expected one of {MODES}')
+        if mode != 'replay' and lm is None:
+            raise ValueError(f'cassette mode {mode!r} requires an lm to record from')
+        super().__init__(model=model or getattr(lm, 'model', None) or 'cassette', cache=False)
+        self.lm = lm
+        self.path = path
+        self.mode = mode
+        self.kwargs = dict(getattr(lm, 'kwargs', {}) or {})
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._served: Dict[str, int] = defaultdict(int)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            if self.mode == 'replay':
+                raise FileNotFoundError(self.path)
+            return
+        with _open(self.path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    if self.lm is None and self.model == 'cassette':
+                        self.model = entry['model']
+                    self._recordings[entry['key']].append(entry['response'])
+
+    def __len__(self) -> int:
+        return sum(len(recordings) for recordings in self._recordings.values())
+
+    def request_key(self, prompt: Optional[str], messages: Optional[List[Dict[str, Any]]], kwargs: Dict[str, Any]) -> str:
+        content = json.dumps(canonicalize({
+            'model': self.model,
+            'prompt': prompt,
+            'messages': messages,
+            'kwargs': {key: value for key, value in kwargs.items() if not key.startswith('api_')},
+        }), sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _replay(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                return None
+            index = min(self._served[key], len(recordings) - 1)
+            self._served[key] += 1
+            return recordings[index]
+
+    def _record(self, key: str, response: Any):
+        response = _plain(response)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with _open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'model': self.model, 'response': response}, ensure_ascii=False) + '\n')
+            self._recordings[key].append(response)
+            self._served[key] += 1
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.mode == 'record':
+            return None
+        response = self._replay(key)
+        if response is None and self.mode == 'replay':
+            raise CassetteMiss(f'no recording for request {key} in {self.path}')
+        return response
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        key = self.request_key(prompt, messages, kwargs)
+        response = self._lookup(key)
+        if response is None:
+            response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+            self._record(key, response)
+        return response
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        key = self.request_key(prompt, messages, kwargs)
+        response = self._lookup(key)
+        if response is None:
+            response = await self.lm.aforward(prompt=prompt, messages=messages, **kwargs)
+            self._record(key, response)
+        return response
+
+
+def use_cassette(lm: Optional[dspy.BaseLM]) -> dspy.BaseLM:
+    """
+    Wrap `lm` in a CassetteLM when the LM_CASSETTE environment variable
+    names a cassette file (mode from LM_CASSETTE_MODE, default auto).
+    """
+    path = os.environ.get('LM_CASSETTE')
+    if not path:
+        return lm
+    mode = os.environ.get('LM_CASSETTE_MODE', 'auto')
+    print(f'[use_cassette] {mode} {path}')
+    return CassetteLM(path, mode=mode, lm=lm)
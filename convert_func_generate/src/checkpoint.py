@@ -0,0 +1,184 @@
+"""
+Append-only checkpoints of workflow payloads for resuming batch runs.
+
+After every node the payload of a run is appended to a JSON-lines file under
+the content hash of the run's initial payload (the run key). A restarted batch
+finds the last checkpoint of each run key: finished runs are returned as they
+were, unfinished runs continue right after the last processed node.
+
+Long value lists are written once as content-addressed blobs and referenced by
+hash from the checkpoints, so a column is not copied into the file per node.
+The input and target columns are only encoded and hashed again when the
+payload holds another column object (e.g., after the values were aligned).
+
+The budget of the run in the IterationScheduler is saved with each checkpoint
+and restored with it, so a resumed run continues with the budget it had left.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Sequence
+from typing import Any, Dict, Optional, Tuple
+from .lm_cache import canonicalize
+from .sandbox import SandboxedCallable
+from .convertor import Convertor
+from .scheduler import IterationScheduler
+from .workflow_tool import WorkflowHook, WorkflowNode, WorkflowRun, workflow_node_ids
+
+__all__ = [
+    'CheckpointStore'
+]
+
+BLOB_MIN_LENGTH = 16
+
+
+def _hash(content: Any) -> str:
+    return hashlib.sha256(json.dumps(canonicalize(content), sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class CheckpointStore(WorkflowHook):
+    """
+    Workflow hook checkpointing the payload after each node.
+
+    The convertor callable is not written; it is rebuilt from `func_string`
+    when a checkpoint is restored. `evaluation_result` and `evaluated_candidates`
+    are dropped and recomputed on demand. Nodes are referred to by their `workflow_node_ids`.
+    """
+    KEY_FIELDS = ('value_descriptions', 'input_values', 'target_values')
+    COLUMN_FIELDS = ('input_values', 'target_values')
+    DROPPED_FIELDS = ('evaluation_result', 'evaluated_candidates')
+
+    def __init__(self, path: str, start_node: WorkflowNode):
+        self._path = path
+        self._node_ids = workflow_node_ids(start_node)
+        self._nodes = {node_id: node for node, node_id in self._node_ids.items()}
+        self._lock = threading.Lock()
+        self._checkpoints: Dict[str, int] = dict()
+        self._blobs: Dict[str, int] = dict()
+        self._load()
+
+    def _load(self):
+        """
+        Index the offsets of the latest checkpoint per run key and of every blob
+        """
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print('[CheckpointStore:_load] skip a truncated record at offset', offset)
+                    offset += len(line)
+                    continue
+                if record['kind'] == 'blob':
+                    self._blobs[record['hash']] = offset
+                else:
+                    self._checkpoints[record['run_key']] = offset
+                offset += len(line)
+
+    def _read(self, offset: int) -> Dict[str, Any]:
+        with open(self._path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def _append(self, records):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self._path, 'ab') as f:
+            offsets = []
+            for record in records:
+                offsets.append(f.tell())
+                f.write((json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        return offsets
+
+    @classmethod
+    def run_key(cls, payload: Dict[str, Any]) -> str:
+        return _hash({field: payload.get(field) for field in cls.KEY_FIELDS})
+
+    def __len__(self) -> int:
+        return len(self._checkpoints)
+
+    def _encode(self, value: Any, blobs: Dict[str, Any]) -> Any:
+        if isinstance(value, WorkflowNode):
+            return {'$node': self._node_ids[value]}
+        if isinstance(value, dict):
+            encoded = {key: self._encode(item, blobs) for key, item in value.items() if key != 'callable'}
+            return {'$dict': encoded}
+        if isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+            items = [self._encode(item, blobs) for item in value]
+            if len(items) >= BLOB_MIN_LENGTH:
+                blob_hash = _hash(items)
+                blobs[blob_hash] = items
+                return {'$blob': blob_hash}
+            return items
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+        return {'$repr': repr(value)}
+
+    def _decode(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._decode(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if '$node' in value:
+            return self._nodes[value['$node']]
+        if '$blob' in value:
+            return self._decode(self._read(self._blobs[value['$blob']])['value'])
+        if '$repr' in value:
+            return value['$repr']
+        decoded = {key: self._decode(item) for key, item in value['$dict'].items()}
+        if 'func_string' in decoded and 'reasoning' in decoded:
+            decoded['callable'] = Convertor(SandboxedCallable(decoded['func_string']))
+        return decoded
+
+    def on_run_start(self, run: WorkflowRun, payload: Any):
+        run.metadata['checkpoint_key'] = self.run_key(payload)
+
+    def restore(self, run: WorkflowRun, payload: Any) -> Optional[Tuple[WorkflowNode, Any]]:
+        with self._lock:
+            offset = self._checkpoints.get(run.metadata['checkpoint_key'])
+            if offset is None:
+                return None
+            record = self._read(offset)
+            restored = self._decode(record['payload'])
+        budget = IterationScheduler.current()
+        if budget is not None and record.get('budget') is not None:
+            budget.load_state(record['budget'])
+        print('[CheckpointStore:restore]', record['run_key'][:12], 'after', record['node_id'], '(finished)' if record['finished'] else '')
+        return self._nodes[record['node_id']], restored
+
+    def after_node(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        if error is not None:
+            return
+        blobs = dict()
+        columns = run.metadata.setdefault('checkpoint_columns', dict())
+        reused = {
+            field: columns[field][2] for field in self.COLUMN_FIELDS
+            if field in columns and payload.get(field) is columns[field][0] and len(payload[field]) == columns[field][1]
+        }
+        encoded = self._encode({key: value for key, value in payload.items() if key not in self.DROPPED_FIELDS and key not in reused}, blobs)
+        encoded['$dict'].update(reused)
+        for field in self.COLUMN_FIELDS:
+            if field in payload and field not in reused:
+                columns[field] = (payload[field], len(payload[field]), encoded['$dict'][field])
+        budget = IterationScheduler.current()
+        with self._lock:
+            new_blobs = [{'kind': 'blob', 'hash': blob_hash, 'value': value} for blob_hash, value in blobs.items() if blob_hash not in self._blobs]
+            record = {
+                'kind': 'checkpoint',
+                'run_key': run.metadata['checkpoint_key'],
+                'node_id': self._node_ids[run.current_node],
+                'finished': run.current_node.is_end,
+                'payload': encoded,
+                'budget': budget.state() if budget is not None else None
+            }
+            offsets = self._append(new_blobs + [record])
+            for blob, offset in zip(new_blobs, offsets):
+                self._blobs[blob['hash']] = offset
+            self._checkpoints[record['run_key']] = offsets[-1]
@@ -0,0 +1,172 @@
+"""
+Static checks of generated convertor code.
+
+Candidates are parsed and inspected before they are executed, so code breaking
+the rules given to the LLM (hard-coded lookup tables of input values, user
+input, file/network/process access, loops without an exit) is rejected without
+running it, and the violated rules can be sent back in the next prompt.
+
+`normalized_hash` identifies candidates that only differ by comments,
+docstrings, formatting or the names of their local variables, so a candidate
+generated twice is evaluated once.
+"""
+import ast
+import hashlib
+from typing import Any, Iterable, List, Optional
+from .sandbox import BLOCKED_BUILTINS, DEFAULT_ALLOWED_IMPORTS
+
+__all__ = [
+    'CodeChecker',
+    'CodeCheckError'
+]
+
+
+class CodeCheckError(SyntaxError):
+    """
+    Generated code rejected by the static checks. A subclass of SyntaxError
+    so that the retry loops of the generators handle it like unparsable code.
+    """
+    def __init__(self, violations: List[str], func_string: str):
+        super().__init__('; '.join(violations))
+        self.violations = violations
+        self.func_string = func_string
+
+
+class CodeChecker:
+    """
+    Reject code violating the rules of convertor functions:
+
+    - a literal dict/set/list/tuple holding more than `max_lookup_entries` of the input values
+    - requesting user input or calling other blocked builtins (`open`, `eval`, ...)
+    - importing modules outside of the sandbox allow-list (file, network or process access)
+    - `while` loops with an always-true condition and no `break` or `return`
+    """
+    def __init__(self, max_lookup_entries: int=12):
+        self._max_lookup_entries = max_lookup_entries
+
+    def violations(self, func_string: str, input_values: Optional[Iterable[Any]]=None) -> List[str]:
+        tree = ast.parse(func_string)
+        known_inputs = set(map(str, input_values)) if input_values is not None else set()
+        violations = []
+        for node in ast.walk(tree):
+            violation = self._check_node(node, known_inputs)
+            if violation is not None and violation not in violations:
+                violations.append(violation)
+        return violations
+
+    def check(self, func_string: str, input_values: Optional[Iterable[Any]]=None):
+        """
+        Raise CodeCheckError listing the violated rules, if any
+        """
+        violations = self.violations(func_string, input_values)
+        if violations:
+            raise CodeCheckError(violations, func_string)
+
+    def _check_node(self, node: ast.AST, known_inputs: set) -> Optional[str]:
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in BLOCKED_BUILTINS:
+            if node.func.id == 'input':
+                return 'Do not request user input: `input()` is not allowed.'
+            return f'Do not call `{node.func.id}()`: file access and dynamic code execution are not allowed.'
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or '']
+            blocked = [module for module in modules if module.split('.')[0] not in DEFAULT_ALLOWED_IMPORTS]
+            if blocked:
+                return f"Do not import {', '.join(blocked)}: only {', '.join(DEFAULT_ALLOWED_IMPORTS)} may be imported (no file, network or process access)."
+        if isinstance(node, ast.While) and self._always_true(node.test) and not self._exits(node):
+            return f'The `while` loop at line {node.lineno} never ends: give it a terminating condition or a `break`.'
+        if known_inputs and isinstance(node, (ast.Dict, ast.Set, ast.List, ast.Tuple)):
+            elements = node.keys if isinstance(node, ast.Dict) else node.elts
+            hard_coded = [
+                element.value for element in elements
+                if isinstance(element, ast.Constant) and str(element.value) in known_inputs
+            ]
+            if len(hard_coded) > self._max_lookup_entries:
+                return (
+                    f'Do not hard code the mapping of input values to output values: the literal at line {node.lineno} '
+                    f'lists {len(hard_coded)} of the input values (e.g., {hard_coded[0]!r}). Derive the output from the input instead.'
+                )
+        return None
+
+    @staticmethod
+    def _always_true(test: ast.AST) -> bool:
+        return isinstance(test, ast.Constant) and bool(test.value)
+
+    @staticmethod
+    def _exits(loop: ast.While) -> bool:
+        """
+        Whether the loop body contains a `break` of this loop, a `return` or a `raise`
+        """
+        stack = [(node, False) for node in loop.body]
+        while stack:
+            node, nested = stack.pop()
+            if isinstance(node, (ast.Return, ast.Raise)) or (isinstance(node, ast.Break) and not nested):
+                return True
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+                continue
+            nested_loop = nested or isinstance(node, (ast.For, ast.AsyncFor, ast.While))
+            stack.extend((child, nested_loop) for child in ast.iter_child_nodes(node))
+        return False
+
+    @staticmethod
+    def strip(func_string: str) -> str:
+        """
+        The code without docstrings and comments
+        """
+        tree = ast.parse(func_string)
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                body = node.body
+                if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+                    node.body = body[1:] or [ast.Pass()]
+        return ast.unparse(tree) + '\n'
+
+    @staticmethod
+    def normalized_hash(func_string: str) -> str:
+        """
+        Hash of the code ignoring comments, docstrings, formatting
+        and the names of the arguments and local variables
+        """
+        tree = ast.parse(CodeChecker.strip(func_string))
+        tree = _LocalNameNormalizer().visit(tree)
+        return hashlib.sha256(ast.dump(tree, annotate_fields=False).encode('utf-8')).hexdigest()
+
+
+class _LocalNameNormalizer(ast.NodeTransformer):
+    """
+    Rename the arguments and assigned names inside functions and lambdas
+    to `_0`, `_1`, ... in the order they first appear
+    """
+    def __init__(self):
+        self._scopes: List[dict] = []
+
+    def _visit_scope(self, node: ast.AST, arguments: ast.arguments) -> ast.AST:
+        scope = dict()
+        for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg]:
+            if arg is not None:
+                scope[arg.arg] = f'_{len(scope)}'
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store) and child.id not in scope:
+                scope[child.id] = f'_{len(scope)}'
+        self._scopes.append(scope)
+        for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg]:
+            if arg is not None:
+                arg.arg = scope[arg.arg]
+                arg.annotation = None
+        if hasattr(node, 'returns'):
+            node.returns = None
+        self.generic_visit(node)
+        self._scopes.pop()
+        return node
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.AST:
+        return self._visit_scope(node, node.args)
+
+    def visit_Lambda(self, node: ast.Lambda) -> ast.AST:
+        return self._visit_scope(node, node.args)
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        for scope in reversed(self._scopes):
+            if node.id in scope:
+                node.id = scope[node.id]
+                break
+        return node
@@ -0,0 +1,209 @@
+"""
+Divide-and-conquer composition of a partially fitting convertor.
+
+The input values a convertor gets wrong are partitioned by their value shape.
+A sub-convertor is produced for each partition, by program synthesis first and
+by the LLM otherwise, from the values of that partition only. The convertor and
+the sub-convertors fitting their partitions are then compiled into one function
+dispatching on the shape of its input, which is verified on the whole column.
+"""
+import ast
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import dspy
+from .convertor import Convertor
+from .dspy_agent import AdvanceConvertorGenerator
+from .evaluator import Evaluator, EvaluationResult
+from .program_synthesis import ProgramSynthesizer
+from .sandbox import SandboxedCallable
+from .value_pattern import value_shape
+from .workflow_tool import llm_slot
+
+__all__ = [
+    'ConvertorComposer'
+]
+
+SHAPE_SOURCE = '''
+def _char_class(char):
+    if char.isdigit():
+        return 'd'
+    if char.isalpha():
+        return 'A' if char.isupper() else 'a'
+    if char.isspace():
+        return ' '
+    return char
+
+def _value_shape(value, coarse):
+    runs = []
+    for char in str(value):
+        current = _char_class(char)
+        if runs and runs[-1][0] == current and current in 'dAa ':
+            runs[-1][1] += 1
+        else:
+            runs.append([current, 1])
+    return ''.join(c if coarse or c not in 'dAa ' else f'{c}{n}' for c, n in runs)
+'''
+
+
+class _TopLevelRenamer(ast.NodeTransformer):
+    """
+    Suffix every occurrence of the names bound at the top level of a module
+    """
+    def __init__(self, names: set, suffix: str):
+        self._names = names
+        self._suffix = suffix
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id in self._names:
+            node.id = f'{node.id}_{self._suffix}'
+        return node
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.AST:
+        if node.name in self._names:
+            node.name = f'{node.name}_{self._suffix}'
+        self.generic_visit(node)
+        return node
+
+
+def _rename_func(func_string: str, suffix: str) -> str:
+    """
+    The code with `func` and its other top-level names suffixed,
+    so that several convertors can live in one module
+    """
+    tree = ast.parse(func_string)
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                names.update(child.id for child in ast.walk(target) if isinstance(child, ast.Name))
+    tree = _TopLevelRenamer(names, suffix).visit(tree)
+    return ast.unparse(tree)
+
+
+class ConvertorComposer:
+    """
+    Keep a convertor for the inputs it already converts and add
+    sub-convertors for at most `max_partitions` shapes of the inputs it misses.
+
+    A partition is solved when its sub-convertor converts every input
+    of that shape in the column to its own target (pairwise, not merely to
+    some target of the partition), so the dispatch cannot break inputs
+    the convertor already handled.
+    """
+    def __init__(self, max_partitions: int=4, synthesizer: Optional[ProgramSynthesizer]=None):
+        self._max_partitions = max_partitions
+        self._synthesizer = synthesizer if synthesizer is not None else ProgramSynthesizer()
+
+    def partition(self, result: EvaluationResult) -> Tuple[bool, Dict[str, List[Tuple[str, str]]]]:
+        """
+        Group the pairs of the column by the shape of the input values the convertor misses.
+        Coarse shapes are used when the fine shapes are more than `max_partitions`.
+
+        Return whether the shapes are coarse and the pairs of each partition,
+        largest partition first.
+        """
+        failing = [row for row in result.pairwise_matching if not row['correct']]
+        coarse = len(set(value_shape(row['input']) for row in failing)) > self._max_partitions
+        failing_shapes = defaultdict(int)
+        for row in failing:
+            failing_shapes[value_shape(row['input'], coarse=coarse)] += 1
+        shapes = sorted(failing_shapes, key=lambda shape: -failing_shapes[shape])[:self._max_partitions]
+        partitions = {shape: [] for shape in shapes}
+        for input, target in dict.fromkeys(zip(result.input_values, result.target_values)):
+            shape = value_shape(input, coarse=coarse)
+            if shape in partitions:
+                partitions[shape].append((input, target))
+        return coarse, partitions
+
+    def _failing_partitions(self, result: EvaluationResult) -> Tuple[bool, Dict[str, List[Tuple[str, str]]], Dict[str, List[Tuple[str, str]]]]:
+        """
+        `partition` of the result along with the pairs of each partition the convertor gets wrong
+        """
+        coarse, partitions = self.partition(result)
+        outputs = dict(zip(result.input_values, result.outputs))
+        failing_pairs = {
+            shape: [(input, target) for input, target in pairs if outputs[input] != target]
+            for shape, pairs in partitions.items()
+        }
+        return coarse, partitions, failing_pairs
+
+    @staticmethod
+    def _evaluate_composition(composed: str, result: EvaluationResult) -> Tuple[Convertor, EvaluationResult, bool]:
+        """
+        The composed convertor, its evaluation on the column and whether it is more accurate than `result`
+        """
+        callable = Convertor(SandboxedCallable(composed))
+        composed_result = Evaluator.evaluate(callable, result.input_values, result.target_values)
+        return callable, composed_result, composed_result.accuracy > result.accuracy
+
+    async def _solve(self, pairs: List[Tuple[str, str]], failing_pairs: List[Tuple[str, str]]) -> Optional[str]:
+        """
+        The func_string of a sub-convertor converting every pair of a partition, if found
+        """
+        input_values = [input for input, _ in pairs]
+        target_values = [target for _, target in pairs]
+        func_string = await asyncio.to_thread(self._synthesizer.synthesize, input_values, target_values)
+        if func_string is not None:
+            return func_string
+        try:
+            async with llm_slot():
+                response = await AdvanceConvertorGenerator().acall(
+                    [input for input, _ in failing_pairs], [target for _, target in failing_pairs]
+                )
+        except Exception as e:
+            print('[ConvertorComposer:warning] sub-convertor failed:', repr(e))
+            return None
+        accuracy = await asyncio.to_thread(Evaluator.accuracy, response.callable, input_values, target_values)
+        return response.func_string if accuracy == 1.0 else None
+
+    @staticmethod
+    def compile(func_string: str, sub_func_strings: Dict[str, str], coarse: bool) -> str:
+        """
+        One function named `func` dispatching on the input shape to the
+        sub-convertors and to the convertor `func_string` otherwise
+        """
+        parts = [_rename_func(func_string, 'base')]
+        dispatch = []
+        for i, (shape, sub_func_string) in enumerate(sub_func_strings.items()):
+            parts.append(_rename_func(sub_func_string, f'part{i}'))
+            dispatch.append(f'    {shape!r}: func_part{i},')
+        parts.append(SHAPE_SOURCE.strip())
+        parts.append('_DISPATCH = {\n' + '\n'.join(dispatch) + '\n}')
+        parts.append(
+            'def func(x):\n'
+            f'    convert = _DISPATCH.get(_value_shape(x, {coarse!r}), func_base)\n'
+            '    return convert(x)'
+        )
+        return '\n\n'.join(parts) + '\n'
+
+    async def acompose(self, func_string: str, result: EvaluationResult) -> Optional[dspy.Prediction]:
+        """
+        Compose the convertor `func_string`, evaluated in `result`, with sub-convertors
+        for the inputs it misses. Return None when no partition could be solved or
+        the composition does not improve the accuracy.
+        """
+        coarse, partitions, failing_pairs = await asyncio.to_thread(self._failing_partitions, result)
+        shapes = list(partitions)
+        solutions = await asyncio.gather(*[self._solve(partitions[shape], failing_pairs[shape]) for shape in shapes])
+        sub_func_strings = {shape: solution for shape, solution in zip(shapes, solutions) if solution is not None}
+        print('[ConvertorComposer:acompose] solved', len(sub_func_strings), 'of', len(shapes), 'partitions')
+        if len(sub_func_strings) == 0:
+            return None
+        composed = self.compile(func_string, sub_func_strings, coarse)
+        callable, composed_result, improved = await asyncio.to_thread(self._evaluate_composition, composed, result)
+        if not improved:
+            return None
+        return dspy.Prediction(
+            reasoning=f'The convertor is kept for the values it converts; values of the shapes {list(sub_func_strings)} are converted by dedicated sub-convertors.',
+            callable=callable,
+            func_string=composed,
+            evaluation_result=composed_result,
+            partition_count=len(sub_func_strings),
+        )
+
+    def compose(self, func_string: str, result: EvaluationResult) -> Optional[dspy.Prediction]:
+        return asyncio.run(self.acompose(func_string, result))
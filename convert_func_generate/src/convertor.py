@@ -0,0 +1,97 @@
+"""
+Learned convertors with a columnar batch-apply API
+"""
+import traceback
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+__all__ = [
+    'Convertor'
+]
+
+
+class Convertor:
+    """
+    A learned convertor: a scalar callable plus, optionally, a vectorized
+    callable converting a NumPy array in one call.
+
+    `apply_batch` dictionary-encodes its input, converts each distinct
+    value once and broadcasts the results back, so a low-cardinality
+    column costs time proportional to its distinct count.
+    """
+    def __init__(self, func: Callable, batch_func: Optional[Callable[[np.ndarray], np.ndarray]]=None):
+        self.func = func
+        self.batch_func = batch_func
+
+    def __call__(self, value: Any) -> Any:
+        return self.func(value)
+
+    def call_many(self, values: Sequence[Any]) -> List[Tuple[bool, Any]]:
+        """
+        Convert each value, returning one (ok, output) tuple per value
+        where output is the error traceback when ok is False.
+        """
+        if hasattr(self.func, 'call_many'):
+            return self.func.call_many(values)
+        if self.batch_func is not None:
+            try:
+                return [(True, output) for output in self.batch_func(np.asarray(values)).tolist()]
+            except Exception:
+                pass
+        results = []
+        for value in values:
+            try:
+                results.append((True, self.func(value)))
+            except BaseException:
+                results.append((False, traceback.format_exc()))
+        return results
+
+    def _convert_distinct(self, values: Sequence[Any]) -> List[Any]:
+        if self.batch_func is not None:
+            return self.batch_func(np.asarray(values)).tolist()
+        return self._convert_each(values)
+
+    def _convert_each(self, values: Sequence[Any]) -> List[Any]:
+        if hasattr(self.func, 'call_many'):
+            outputs = []
+            for value, (ok, output) in zip(values, self.func.call_many(values)):
+                if not ok:
+                    raise ValueError(f'convertor failed on {value!r}:\n{output}')
+                outputs.append(output)
+            return outputs
+        return [self.func(value) for value in values]
+
+    def apply_batch(self, values: Any) -> Any:
+        """
+        Convert a whole column. Lists give lists, NumPy arrays give
+        NumPy arrays and Arrow arrays give Arrow arrays. Columns of
+        unhashable values are converted value by value.
+        """
+        if pa is not None and isinstance(values, (pa.Array, pa.ChunkedArray)):
+            if isinstance(values, pa.ChunkedArray):
+                values = values.combine_chunks()
+            encoded = values.dictionary_encode()
+            converted = pa.array(self._convert_distinct(encoded.dictionary.to_pylist()))
+            return converted.take(encoded.indices)
+        if isinstance(values, np.ndarray):
+            try:
+                uniques, inverse = np.unique(values, return_inverse=True)
+            except TypeError:
+                return np.asarray(self.apply_batch(values.tolist()))
+            return np.asarray(self._convert_distinct(uniques.tolist()))[inverse.reshape(values.shape)]
+        codes = dict()
+        try:
+            indices = [codes.setdefault(value, len(codes)) for value in values]
+        except TypeError:
+            # unhashable values (e.g., lists or dicts) cannot be dictionary-encoded
+            return self._convert_each(list(values))
+        converted = self._convert_distinct(list(codes.keys()))
+        return [converted[index] for index in indices]
+
+    def __repr__(self):
+        return f'<Convertor: {getattr(self.func, "func_string", self.func)!r}>'
@@ -0,0 +1,99 @@
+"""
+Cross-run library of verified convertors.
+
+Convertors that fitted a column are appended to a local JSON-lines file and
+indexed in memory by the pattern signature of the column, so a later column
+with the same input/target shapes first tries the known convertors before
+any generation happens.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .evaluator import Evaluator, EvaluationResult
+from .sandbox import SandboxedCallable
+from .convertor import Convertor
+from .value_pattern import column_signature
+
+__all__ = [
+    'ConvertorLibrary'
+]
+
+
+class ConvertorLibrary:
+    """
+    Persistent library of verified convertors indexed by column signature.
+
+    Each entry holds the func_string and its provenance. The compiled form of
+    an entry is cached in memory for the lifetime of the process.
+    """
+    def __init__(self, path: str, max_candidates: int=8):
+        self._path = path
+        self._max_candidates = max_candidates
+        self._index: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._callables: Dict[str, Callable] = dict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    self._index[entry['signature']].append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._index.values())
+
+    def compile(self, entry: Dict[str, Any]) -> Callable:
+        func_string = entry['func_string']
+        with self._lock:
+            if func_string not in self._callables:
+                self._callables[func_string] = Convertor(SandboxedCallable(func_string))
+            return self._callables[func_string]
+
+    def lookup(self, input_values: List[str], target_values: List[str]) -> List[Dict[str, Any]]:
+        """
+        Candidate entries sharing the pattern signature of the column, most recent first
+        """
+        signature = column_signature(input_values, target_values)
+        with self._lock:
+            return list(reversed(self._index.get(signature, [])))[:self._max_candidates]
+
+    def find(self, input_values: List[str], target_values: List[str]) -> Optional[Tuple[Dict[str, Any], EvaluationResult]]:
+        """
+        Return the first candidate entry that fits the column along
+        with its evaluation, or None if no candidate fits.
+        """
+        for entry in self.lookup(input_values, target_values):
+            result = Evaluator.evaluate(self.compile(entry), input_values, target_values, fail_fast=True)
+            if result.is_fit:
+                return entry, result
+        return None
+
+    def add(self, input_values: List[str], target_values: List[str], func_string: str, provenance: Dict[str, Any]) -> bool:
+        """
+        Record a verified convertor. Return False if the same
+        func_string is already indexed under the column signature.
+        """
+        signature = column_signature(input_values, target_values)
+        entry = {
+            'signature': signature,
+            'func_string': func_string,
+            'provenance': dict(provenance, created_at=time.time()),
+        }
+        with self._lock:
+            if any(e['func_string'] == func_string for e in self._index[signature]):
+                return False
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self._path, 'a') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            self._index[signature].append(entry)
+        return True
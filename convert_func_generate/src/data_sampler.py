@@ -1,16 +1,21 @@
 import abc
-from typing import List, Tuple, Dict
+from collections import OrderedDict, defaultdict
+from typing import Any, Iterable, List, Optional, Tuple, Dict
 import json
 import copy
 import random
-from scipy.stats import gmean
+import threading
+import numpy as np
 from .evaluator import Evaluator
+from .dataset_cache import ColumnarDatasetCache
+from .value_pattern import value_shape
 
 
 __all__ = [
     'EvaluateDataGenerator',
     'PairTrainTestDataSampler',
     'GroupTrainTestDataSampler',
+    'DiverseTrainTestDataSampler',
     'ReorderInputAndTarget'
 ]
 
@@ -18,28 +23,64 @@ class EvaluateDataGenerator:
     """
     Generate training data to evaluate the LLM-based
     Column selector.
+
+    With `use_cache`, each training folder is converted once into a
+    columnar binary cache which later runs memory-map lazily.
     """
-    def __init__(self, paths: List[str]):
+    def __init__(self, paths: List[str], root: str='../training_data', use_cache: bool=True):
         self._paths = paths
+        self._root = root
+        self._use_cache = use_cache
 
     def generate(self):
         for path in self._paths:
-            columns = json.loads(open(f'../training_data/{path}/columns.json', 'r').read())
-            rows = json.loads(open(f'../training_data/{path}/rows.json', 'r').read())
-            for i, (col1, col2) in enumerate(zip(columns['ground_truth'], columns['input'])):
-                target_values = [row['ground_truth'][i] for row in rows]
-                input_values = [row['input'][i] for row in rows]
-                yield {
-                    'value_descriptions': [col1, col2],
-                    'target_values': target_values,
-                    'input_values': input_values
-                }
+            if self._use_cache:
+                yield from self._generate_from_cache(path)
+            else:
+                yield from self._generate_from_json(path)
+
+    def _generate_from_cache(self, path: str):
+        for col1, col2, target_values, input_values in ColumnarDatasetCache(f'{self._root}/{path}').columns():
+            yield {
+                'value_descriptions': [col1, col2],
+                'target_values': target_values,
+                'input_values': input_values
+            }
+
+    def _generate_from_json(self, path: str):
+        columns = json.loads(open(f'{self._root}/{path}/columns.json', 'r').read())
+        rows = json.loads(open(f'{self._root}/{path}/rows.json', 'r').read())
+        for i, (col1, col2) in enumerate(zip(columns['ground_truth'], columns['input'])):
+            target_values = [row['ground_truth'][i] for row in rows]
+            input_values = [row['input'][i] for row in rows]
+            yield {
+                'value_descriptions': [col1, col2],
+                'target_values': target_values,
+                'input_values': input_values
+            }
+
+def _column_hash(values: List[str]) -> int:
+    """
+    Order-independent hash of a column: the sum of the hashes of its values
+    """
+    hashes = np.fromiter((hash(str(value)) for value in values), dtype=np.int64, count=len(values))
+    return hash((len(values), int(hashes.sum(dtype=np.uint64))))
+
 
 class TrainTestDataSampler:
     """
     Sampling training and testing data 
     for LLM inferencing
+
+    Whether sorting a pair of columns makes their values more alike than a
+    random pairing does only depends on the values, not on their order, so
+    the decision of `_reorder_values` is memoized by column hash. Samplers
+    run on worker threads, so the memo is only touched under `_reorder_lock`.
     """
+    MAX_REORDER_DECISIONS = 1024
+    _reorder_decisions: 'OrderedDict[Tuple[int, int], bool]' = OrderedDict()
+    _reorder_lock = threading.Lock()
+
     @abc.abstractmethod
     def randomize_values(self, input_values: List[str], target_values: List[str]) -> Tuple[List[str], List[str]]:
         """
@@ -70,15 +111,25 @@ class TrainTestDataSampler:
         Randomize input values so that LLM can produce 
         different results.
         """
-        random_similarities = []
-        _input_values, _target_values = copy.copy(input_values), copy.copy(target_values)
-        for i in range(30):
-            random.shuffle(_input_values)
-            random.shuffle(_target_values)
-            random_similarities.append(Evaluator.rate_similarity(_input_values, _target_values))
-        baseline_similariy = gmean(random_similarities)
-        if Evaluator.rate_similarity(sorted(input_values), sorted(target_values)) > baseline_similariy:
-            return sorted(input_values), sorted(target_values)
+        key = (_column_hash(input_values), _column_hash(target_values))
+        with self._reorder_lock:
+            use_sorted = self._reorder_decisions.get(key)
+            if use_sorted is not None:
+                self._reorder_decisions.move_to_end(key)
+        if use_sorted is not None:
+            if use_sorted:
+                return sorted(input_values), sorted(target_values)
+            return input_values, target_values
+        sorted_input_values, sorted_target_values = sorted(input_values), sorted(target_values)
+        baseline_similariy = Evaluator.rate_random_similarity(input_values, target_values)
+        use_sorted = Evaluator.rate_similarity(sorted_input_values, sorted_target_values) > baseline_similariy
+        with self._reorder_lock:
+            self._reorder_decisions[key] = use_sorted
+            self._reorder_decisions.move_to_end(key)
+            while len(self._reorder_decisions) > self.MAX_REORDER_DECISIONS:
+                self._reorder_decisions.popitem(last=False)
+        if use_sorted:
+            return sorted_input_values, sorted_target_values
         else:
             return input_values, target_values
         
@@ -87,7 +138,7 @@ class TrainTestDataSampler:
         Split data into training and testing
         """
         split_position = len(values) // 2
-        return values[:split_position], values[:split_position]
+        return values[:split_position], values[split_position:]
 
 
 
@@ -125,4 +176,80 @@ class GroupTrainTestDataSampler(TrainTestDataSampler):
         _target_values = copy.copy(target_values)
         random.shuffle(_input_values)
         random.shuffle(_target_values)
-        return _input_values, _target_values
\ No newline at end of file
+        return _input_values, _target_values
+
+
+class DiverseTrainTestDataSampler(PairTrainTestDataSampler):
+    """
+    Sampling a small and diverse set of training pairs
+    for pair-wise data LLM inferencing
+
+    The value pairs are clustered by the coarse shapes of the input and the target,
+    and picked round-robin across the clusters until the estimated prompt tokens of
+    the picked pairs reach `token_budget`. Pairs whose input is in `failure_values`
+    (e.g., where the previous convertor failed) are picked first. The pairs that are
+    not picked, and are not duplicates of picked pairs, form the testing data.
+    The training pairs are returned in picking order, so that consumers
+    trimming them further (e.g., the PromptEncoder) keep the failure cases.
+    """
+    CHARS_PER_TOKEN = 4
+    TOKENS_PER_PAIR = 4
+
+    def __init__(self, token_budget: int=512, min_train_size: int=2):
+        self._token_budget = token_budget
+        self._min_train_size = min_train_size
+
+    @classmethod
+    def estimate_tokens(cls, input_value: Any, target_value: Any) -> int:
+        return (len(str(input_value)) + len(str(target_value))) // cls.CHARS_PER_TOKEN + cls.TOKENS_PER_PAIR
+
+    def split(self, input_values: List[str], target_values: List[str], failure_values: Optional[Iterable[Any]]=None) -> Tuple[Tuple[List[str], List[str]], Tuple[List[str], List[str]]]:
+        """
+        Get training input/target values
+        and testing input/target values
+        """
+        _input_values, _target_values = self.randomize_values(input_values, target_values)
+        pairs = list(zip(_input_values, _target_values))
+        picked = [False] * len(pairs)
+        order = self._prioritize(pairs, set(failure_values) if failure_values is not None else set())
+        tokens = 0
+        seen = set()
+        for position in order:
+            pair = pairs[position]
+            if pair in seen:
+                continue
+            cost = self.estimate_tokens(*pair)
+            if tokens + cost > self._token_budget and len(seen) >= self._min_train_size:
+                break
+            tokens += cost
+            seen.add(pair)
+            picked[position] = True
+        train = [pairs[position] for position in order if picked[position]]
+        test = [pair for pair, is_picked in zip(pairs, picked) if not is_picked and pair not in seen]
+        return (
+            ([input for input, _ in train], [target for _, target in train]),
+            ([input for input, _ in test], [target for _, target in test])
+        )
+
+    @staticmethod
+    def _prioritize(pairs: List[Tuple[Any, Any]], failure_values: set) -> List[int]:
+        """
+        Positions of the pairs in picking order: failure cases first,
+        then one pair per shape cluster at a time, largest clusters first
+        """
+        failures = []
+        clusters = defaultdict(list)
+        for position, (input, target) in enumerate(pairs):
+            try:
+                is_failure = input in failure_values
+            except TypeError:
+                is_failure = False
+            if is_failure:
+                failures.append(position)
+            else:
+                clusters[(value_shape(input, coarse=True), value_shape(target, coarse=True))].append(position)
+        members = sorted(clusters.values(), key=len, reverse=True)
+        order = list(failures)
+        for rank in range(max(map(len, members), default=0)):
+            order.extend(cluster[rank] for cluster in members if rank < len(cluster))
+        return order
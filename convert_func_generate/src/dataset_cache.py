@@ -0,0 +1,166 @@
+"""
+Column-oriented binary cache of the training data folders.
+
+Each `{root}/{path}` folder holding `columns.json` and `rows.json` is converted
+once into one `.npy` array per column. Later runs memory-map the arrays instead
+of parsing the JSON and transposing the rows again, and only the rows that are
+read are converted into Python values.
+"""
+import json
+import os
+import shutil
+import tempfile
+from collections.abc import Sequence
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+
+__all__ = [
+    'ColumnarDatasetCache',
+    'ColumnView'
+]
+
+CACHE_VERSION = 1
+SOURCE_FILES = ('columns.json', 'rows.json')
+
+
+class ColumnView(Sequence):
+    """
+    Read-only list-like view of a memory-mapped column.
+
+    Rows are converted to Python values when they are read, `CHUNK_SIZE`
+    rows at a time when iterating. Slices are views as well; copies
+    (`copy.copy`, `copy.deepcopy`, `tolist`) are plain lists.
+    """
+    CHUNK_SIZE = 4096
+
+    def __init__(self, array: np.ndarray):
+        self._array = array
+
+    def __len__(self) -> int:
+        return len(self._array)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return ColumnView(self._array[index])
+        return self._array[index].item()
+
+    def __iter__(self) -> Iterator[Any]:
+        for start in range(0, len(self._array), self.CHUNK_SIZE):
+            yield from self._array[start:start + self.CHUNK_SIZE].tolist()
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, (ColumnView, list, tuple)) or len(self) != len(other):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def tolist(self) -> List[Any]:
+        return self._array.tolist()
+
+    def __copy__(self) -> List[Any]:
+        return self.tolist()
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> List[Any]:
+        return self.tolist()
+
+    def __repr__(self) -> str:
+        return f'<ColumnView: {len(self)} {self._array.dtype} values>'
+
+
+class ColumnarDatasetCache:
+    """
+    Convert a training folder into per-column arrays on first use
+    and serve the columns lazily from memory-mapped files afterwards.
+
+    String, integer and float columns are stored as `.npy` arrays; columns
+    mixing value types fall back to a JSON list so the values round-trip exactly.
+    """
+    CACHE_DIR = '.columnar_cache'
+
+    def __init__(self, folder: str):
+        self._folder = folder
+        self._cache_folder = os.path.join(folder, self.CACHE_DIR)
+
+    def _source_stamps(self) -> Dict[str, List[int]]:
+        stamps = dict()
+        for name in SOURCE_FILES:
+            stat = os.stat(os.path.join(self._folder, name))
+            stamps[name] = [stat.st_mtime_ns, stat.st_size]
+        return stamps
+
+    def _load_meta(self) -> Optional[Dict[str, Any]]:
+        meta_path = os.path.join(self._cache_folder, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') != CACHE_VERSION or meta.get('sources') != self._source_stamps():
+            return None
+        return meta
+
+    @staticmethod
+    def _kind(values: Tuple[Any, ...]) -> str:
+        types = set(type(value) for value in values)
+        if types == {str}:
+            return 'str'
+        if types == {int}:
+            return 'int'
+        if types == {float}:
+            return 'float'
+        return 'json'
+
+    def build(self) -> Dict[str, Any]:
+        """
+        Parse the JSON files, transpose the rows into columns and write the arrays.
+        """
+        stamps = self._source_stamps()
+        with open(os.path.join(self._folder, 'columns.json'), 'r') as f:
+            columns = json.load(f)
+        with open(os.path.join(self._folder, 'rows.json'), 'r') as f:
+            rows = json.load(f)
+        meta = {'version': CACHE_VERSION, 'sources': stamps, 'columns': columns, 'n_rows': len(rows), 'arrays': dict()}
+        staging = tempfile.mkdtemp(prefix=self.CACHE_DIR, dir=self._folder)
+        try:
+            for side in ('ground_truth', 'input'):
+                transposed = list(zip(*[row[side] for row in rows])) if rows else [tuple() for _ in columns[side]]
+                for i, values in enumerate(transposed):
+                    name = f'{side}_{i}'
+                    kind = self._kind(values)
+                    if kind == 'json':
+                        file_name = f'{name}.json'
+                        with open(os.path.join(staging, file_name), 'w') as f:
+                            json.dump(list(values), f, ensure_ascii=False)
+                    else:
+                        file_name = f'{name}.npy'
+                        dtype = {'str': str, 'int': np.int64, 'float': np.float64}[kind]
+                        np.save(os.path.join(staging, file_name), np.asarray(values, dtype=dtype))
+                    meta['arrays'][name] = {'file': file_name, 'kind': kind}
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            shutil.rmtree(self._cache_folder, ignore_errors=True)
+            os.replace(staging, self._cache_folder)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return meta
+
+    def _read(self, meta: Dict[str, Any], name: str) -> Union[List[Any], ColumnView]:
+        array = meta['arrays'][name]
+        path = os.path.join(self._cache_folder, array['file'])
+        if array['kind'] == 'json':
+            with open(path, 'r') as f:
+                return json.load(f)
+        return ColumnView(np.load(path, mmap_mode='r'))
+
+    def columns(self) -> Iterator[Tuple[str, str, List[Any], List[Any]]]:
+        """
+        Yield (ground_truth_name, input_name, target_values, input_values) per column pair,
+        reading each column only when it is reached. The values of `.npy` columns
+        are `ColumnView`s over the memory-mapped arrays.
+        """
+        meta = self._load_meta()
+        if meta is None:
+            meta = self.build()
+        for i, (col1, col2) in enumerate(zip(meta['columns']['ground_truth'], meta['columns']['input'])):
+            yield col1, col2, self._read(meta, f'ground_truth_{i}'), self._read(meta, f'input_{i}')
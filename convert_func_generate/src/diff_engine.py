@@ -0,0 +1,183 @@
+"""
+Deterministic inspection of the difference between input and target values.
+
+The examples are compared locally (character alignment, common prefixes and
+suffixes, inserted and removed literals, numeric ratios and length deltas) and
+the findings are rendered as the `difference_explaination` and `convertion_hint`
+consumed by `InspectionBasedConvertorGenerator`, in place of an LLM call.
+"""
+import difflib
+import os
+from collections import Counter
+from typing import Any, List, Optional, Tuple
+import numpy as np
+import dspy
+from .value_pattern import value_shape
+
+__all__ = [
+    'DifferenceInspector'
+]
+
+
+class DifferenceInspector:
+    """
+    Describe how target values differ from input values without calling the LM.
+
+    `inspect` returns a dspy.Prediction with the output fields of the
+    `InspectDifference` signature, or None when the examples share no
+    structure worth describing, so that the caller can fall back to the LLM.
+    """
+    MAX_EXAMPLES = 8
+    MIN_SIMILARITY = 0.2
+
+    def __init__(self, max_examples: int=MAX_EXAMPLES, min_similarity: float=MIN_SIMILARITY):
+        self._max_examples = max_examples
+        self._min_similarity = min_similarity
+
+    def inspect(self, input_values: List[Any], target_values: List[Any]) -> Optional[dspy.Prediction]:
+        pairs = list(dict.fromkeys(zip(map(str, input_values), map(str, target_values))))
+        if len(pairs) == 0:
+            return None
+        inputs = [input for input, _ in pairs]
+        targets = [target for _, target in pairs]
+        findings, hints = [], []
+        for analysis in (self._case, self._affixes, self._numeric, self._alignment, self._lengths, self._shapes):
+            finding, hint = analysis(inputs, targets)
+            findings.extend(finding)
+            hints.extend(hint)
+        if len(hints) == 0 and self._mean_similarity(inputs, targets) < self._min_similarity:
+            return None
+        return dspy.Prediction(
+            reasoning='The difference is computed by aligning the characters of each input value with its target value.',
+            difference_explaination='\n'.join(f'- {finding}' for finding in findings),
+            convertion_hint='\n'.join(f'- {hint}' for hint in hints) if hints else '- No simple character edit explains every example.',
+        )
+
+    def _mean_similarity(self, inputs: List[str], targets: List[str]) -> float:
+        ratios = [
+            difflib.SequenceMatcher(None, input, target, autojunk=False).ratio()
+            for input, target in zip(inputs[:self._max_examples], targets[:self._max_examples])
+        ]
+        return float(np.mean(ratios))
+
+    @staticmethod
+    def _case(inputs: List[str], targets: List[str]) -> Tuple[List[str], List[str]]:
+        if inputs == targets:
+            return ['The target values are identical to the input values.'], ['Return the input value unchanged.']
+        for name, method in (('upper', str.upper), ('lower', str.lower), ('title', str.title), ('strip', str.strip)):
+            if [method(input) for input in inputs] == targets:
+                return [f'Every target value equals `x.{name}()` of its input value.'], [f'Return `str(x).{name}()`.']
+        return [], []
+
+    @staticmethod
+    def _affixes(inputs: List[str], targets: List[str]) -> Tuple[List[str], List[str]]:
+        findings, hints = [], []
+        for side, values in (('input', inputs), ('target', targets)):
+            prefix = os.path.commonprefix(values)
+            suffix = os.path.commonprefix([value[::-1] for value in values])[::-1]
+            if len(values) > 1 and prefix:
+                findings.append(f'Every {side} value starts with {prefix!r}.')
+            if len(values) > 1 and suffix:
+                findings.append(f'Every {side} value ends with {suffix!r}.')
+        target_prefix = os.path.commonprefix(targets) if len(targets) > 1 else ''
+        target_suffix = os.path.commonprefix([target[::-1] for target in targets])[::-1] if len(targets) > 1 else ''
+        if target_prefix and not all(input.startswith(target_prefix) for input in inputs):
+            hints.append(f'Prepend the constant {target_prefix!r}.')
+        if target_suffix and not all(input.endswith(target_suffix) for input in inputs):
+            hints.append(f'Append the constant {target_suffix!r}.')
+        return findings, hints
+
+    @staticmethod
+    def _to_float(value: str) -> Optional[float]:
+        try:
+            return float(value.replace(',', '').replace('%', '').replace('$', '').strip())
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _decimals(value: str) -> int:
+        return len(value.split('.')[1]) if '.' in value else 0
+
+    def _numeric(self, inputs: List[str], targets: List[str]) -> Tuple[List[str], List[str]]:
+        numbers = [(self._to_float(input), self._to_float(target)) for input, target in zip(inputs, targets)]
+        if any(input is None or target is None for input, target in numbers):
+            return [], []
+        x = np.array([input for input, _ in numbers])
+        y = np.array([target for _, target in numbers])
+        findings, hints = ['Both input and target values are numbers.'], []
+        decimals = Counter(self._decimals(target) for target in targets)
+        if len(decimals) == 1:
+            findings.append(f'Every target value has {next(iter(decimals))} decimal places.')
+        nonzero = x != 0
+        if nonzero.any():
+            ratios = y[nonzero] / x[nonzero]
+            ratio = float(np.median(ratios))
+            if ratio != 1.0 and np.allclose(ratios, ratio, rtol=1e-2):
+                findings.append(f'The target is about {ratio:.6g} times the input.')
+                hints.append(f'Multiply the numeric input by {ratio:.6g} and format it like the targets.')
+        offsets = y - x
+        offset = float(np.median(offsets))
+        if offset != 0.0 and np.allclose(offsets, offset, atol=1e-9):
+            findings.append(f'The target is the input plus {offset:.6g}.')
+            hints.append(f'Add {offset:.6g} to the numeric input.')
+        if len(decimals) == 1 and len(hints) == 0:
+            hints.append(f'Parse the input as a number and format it with {next(iter(decimals))} decimal places.')
+        return findings, hints
+
+    def _alignment(self, inputs: List[str], targets: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Align each example and collect the literals inserted, removed or replaced in every one of them
+        """
+        findings, inserted, removed, replaced = [], [], [], []
+        for input, target in list(zip(inputs, targets))[:self._max_examples]:
+            steps = []
+            example_inserted, example_removed, example_replaced = set(), set(), set()
+            matcher = difflib.SequenceMatcher(None, input, target, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal':
+                    steps.append(f'keep {input[i1:i2]!r}')
+                elif tag == 'insert':
+                    steps.append(f'insert {target[j1:j2]!r}')
+                    example_inserted.add(target[j1:j2])
+                elif tag == 'delete':
+                    steps.append(f'remove {input[i1:i2]!r}')
+                    example_removed.add(input[i1:i2])
+                else:
+                    steps.append(f'replace {input[i1:i2]!r} with {target[j1:j2]!r}')
+                    example_replaced.add((input[i1:i2], target[j1:j2]))
+            findings.append(f'{input!r} -> {target!r}: ' + ', '.join(steps) + '.')
+            inserted.append(example_inserted)
+            removed.append(example_removed)
+            replaced.append(example_replaced)
+        hints = []
+        for literal in sorted(set.intersection(*inserted)):
+            hints.append(f'Insert the literal {literal!r} into every value.')
+        for literal in sorted(set.intersection(*removed)):
+            hints.append(f'Remove {literal!r} from every value.')
+        for old, new in sorted(set.intersection(*replaced)):
+            hints.append(f'Replace {old!r} with {new!r}.')
+        return findings, hints
+
+    @staticmethod
+    def _lengths(inputs: List[str], targets: List[str]) -> Tuple[List[str], List[str]]:
+        deltas = Counter(len(target) - len(input) for input, target in zip(inputs, targets))
+        if len(deltas) == 1:
+            delta = next(iter(deltas))
+            return [f'Every target value is {abs(delta)} characters {"longer" if delta >= 0 else "shorter"} than its input value.'], []
+        target_lengths = Counter(len(target) for target in targets)
+        if len(target_lengths) == 1:
+            return [f'Every target value has {next(iter(target_lengths))} characters whatever the input length.'], []
+        return [], []
+
+    @staticmethod
+    def _shapes(inputs: List[str], targets: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        The most common character-class shapes, e.g., 'd4-d2-d2' for '2024-03-01'
+        """
+        input_shapes = Counter(value_shape(input) for input in inputs).most_common(3)
+        target_shapes = Counter(value_shape(target) for target in targets).most_common(3)
+        render = lambda shapes: ', '.join(shape for shape, _ in shapes)
+        return [
+            f'Input shapes: {render(input_shapes)}; target shapes: {render(target_shapes)} '
+            "(d: digits, A: upper case letters, a: lower case letters, followed by the run length)."
+        ], []
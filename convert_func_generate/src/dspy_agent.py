@@ -1,22 +1,57 @@
 import abc
+import asyncio
 import dspy
+import os
 import random
-import copy
-from typing import List, Tuple, Callable, Set, Dict
+from typing import List, Tuple, Callable, Set, Dict, Optional
 import numpy as np
-import re
-from .evaluator import Evaluator
+from .evaluator import Evaluator, EvaluationResult
+from .lm_cache import LMResponseCache, CachedChainOfThought
+from .prompt_encoding import PromptEncoder
+from .sandbox import SandboxedCallable
+from .convertor import Convertor
+from .diff_engine import DifferenceInspector
+from .cassette import use_cassette
+from .code_checks import CodeChecker, CodeCheckError
+from .workflow_tool import llm_slot
 
-lm = dspy.LM('ollama_chat/llama3.2:3b', api_base='http://localhost:11434', api_key='', cache=False)
+lm = use_cassette(dspy.LM('ollama_chat/llama3.2:3b', api_base='http://localhost:11434', api_key='', cache=False))
 dspy.configure(lm=lm)
 
+response_cache = LMResponseCache(os.environ.get('CONVERTOR_LM_CACHE', '.lm_cache/responses.sqlite'))
+prompt_encoder = PromptEncoder(field_token_budget=int(os.environ.get('CONVERTOR_FIELD_TOKEN_BUDGET', '512')))
+code_checker = CodeChecker()
+MAX_CODE_REJECTIONS = 3
+
 __all__ = [
     'PairConvertorGenerator',
     'InvalidConvertorReviser',
-    'AdvanceConvertorGenerator'
+    'AdvanceConvertorGenerator',
+    'SpeculativeConvertorGenerator',
+    'response_cache',
+    'prompt_encoder'
 ]
 
 
+def check_code(func_string: str, input_values: Optional[List[str]], rejected_attempts: Optional[List[str]]):
+    """
+    Run the static checks on a generated function before it is executed.
+
+    A rejection is added to `rejected_attempts`, which goes into the next prompt,
+    and raised as CodeCheckError. After MAX_CODE_REJECTIONS rejections the code
+    is let through and left to the evaluation.
+    """
+    violations = code_checker.violations(func_string, input_values)
+    if len(violations) == 0:
+        return
+    if rejected_attempts is not None and len(rejected_attempts) >= MAX_CODE_REJECTIONS:
+        print('[check_code:warning] accepted after', len(rejected_attempts), 'rejections:', violations)
+        return
+    if rejected_attempts is not None:
+        rejected_attempts.append(' '.join(violations))
+    raise CodeCheckError(violations, func_string)
+
+
 class PairwiseConvertionCodeInferencer(dspy.Signature):
     """
     You are a professional python developer. 
@@ -36,6 +71,7 @@ class PairwiseConvertionCodeInferencer(dspy.Signature):
     value_descriptions: List[str] = dspy.InputField(desc='A list of names describing the meaning of the input and output value.')
     input_data_type: str = dspy.InputField(desc='The datatype of the input values.')
     output_data_type: str = dspy.InputField(desc='The datatype of the output values.')
+    rejected_attempts: List[str] = dspy.InputField(desc='Why earlier attempts at the function were rejected. The new function must not repeat these mistakes.')
     convertion_code: str = dspy.OutputField(desc='A function named `func` that convert one of input values to one of the target output values. For example: def func(x: <input_datatype>) -> <output_datatype>: \n return ... ')
     
 
@@ -60,6 +96,7 @@ class GroupwiseConvertionCodeInferencer(dspy.Signature):
     value_descriptions: List[str] = dspy.InputField(desc='A list of names describing the meaning of the input and output value.')
     input_data_type: str = dspy.InputField(desc='The datatype of the input values.')
     output_data_type: str = dspy.InputField(desc='The datatype of the output values.')
+    rejected_attempts: List[str] = dspy.InputField(desc='Why earlier attempts at the function were rejected. The new function must not repeat these mistakes.')
     convertion_code: str = dspy.OutputField(desc='A function named `func` that convert one of input values to one of the target output values. For example: def func(x: <input_datatype>) -> <output_datatype>: \n return ... ')
 
 
@@ -100,6 +137,33 @@ class InspectionBasedConvertorGenerator(dspy.Signature):
     target_data_type: str = dspy.InputField(desc='The data type of the target values.')
     difference_explaination: str = dspy.InputField(desc='An explain on the difference between the input and target values.')
     convertion_hint: str = dspy.InputField(desc='A description of hint on how to convert one input value to one target value.')
+    rejected_attempts: List[str] = dspy.InputField(desc='Why earlier attempts at the function were rejected. The new function must not repeat these mistakes.')
+    convertion_code: str = dspy.OutputField(desc='The re-generated revised function named `func` that convert the input values to the target value. For example: def func(x: <input_data_type>) -> <target_data_type>: \n return ... ')
+
+class ParentBasedConvertorGenerator(dspy.Signature):
+    """
+    You are a professional python developer whose goal is to come up with a function to convert 
+    values in a input list to those in a target list. 
+
+    The difference between the value in the input list and target list is provided, so as 
+    how to convert the input value to the target value. 
+
+    The best function found so far converts most of the values but not all of them. 
+    Revise that function so that it keeps converting the values it already converts 
+    and also converts the values listed as its failures.
+    """
+    input_values: List[str] = dspy.InputField(desc='The list with input values to be converted to values in the target list.')
+    target_values: List[str] = dspy.InputField(desc='''
+    A list of target values where each value is an output from the python function given an input in the list of input values.
+    ''')
+    input_data_type: str = dspy.InputField(desc='The data type of all the input values.')
+    target_data_type: str = dspy.InputField(desc='The data type of the target values.')
+    difference_explaination: str = dspy.InputField(desc='An explain on the difference between the input and target values.')
+    convertion_hint: str = dspy.InputField(desc='A description of hint on how to convert one input value to one target value.')
+    parent_function: str = dspy.InputField(desc='The best function found so far, to be revised.')
+    parent_reasoning: str = dspy.InputField(desc='The reasoning behind the best function found so far.')
+    parent_failures: List[str] = dspy.InputField(desc='Some input values the best function found so far does not convert, each with its output and the expected target value.')
+    rejected_attempts: List[str] = dspy.InputField(desc='Why earlier attempts at the function were rejected. The new function must not repeat these mistakes.')
     convertion_code: str = dspy.OutputField(desc='The re-generated revised function named `func` that convert the input values to the target value. For example: def func(x: <input_data_type>) -> <target_data_type>: \n return ... ')
 
 
@@ -107,70 +171,189 @@ class AdvanceConvertorGenerator(dspy.Module):
     """
     Base template of inferencing convertion function
     from inputs and outputs
+
+    `config` (e.g., `{'temperature': 0.7}`) is passed to every LM call.
+    With `local_inspection`, the difference between the values is described
+    by the DifferenceInspector and the InspectDifference LLM call is only
+    made when the local inspection finds nothing to describe.
+
+    With a `parent` (a dict of `func_string`, `reasoning` and `failures`, e.g.,
+    the best candidate so far), the function is generated as a revision of
+    the parent instead of from scratch.
     """
-    def __init__(self):
-        self._inspector = dspy.ChainOfThought(InspectDifference)
-        self._generator = dspy.ChainOfThought(InspectionBasedConvertorGenerator)
+    def __init__(self, config: Optional[Dict]=None, local_inspection: bool=True):
+        self._config = config
+        self._local_inspector = DifferenceInspector() if local_inspection else None
+        self._inspector = CachedChainOfThought(InspectDifference, cache=response_cache, encoder=prompt_encoder)
+        self._generator = CachedChainOfThought(InspectionBasedConvertorGenerator, cache=response_cache, encoder=prompt_encoder)
+        self._parent_generator = CachedChainOfThought(ParentBasedConvertorGenerator, cache=response_cache, encoder=prompt_encoder)
     
     @staticmethod
-    def _response_postprocess(response: dspy.Prediction) -> dspy.Prediction:
+    def _response_postprocess(response: dspy.Prediction, input_values: Optional[List[str]]=None, rejected_attempts: Optional[List[str]]=None) -> dspy.Prediction:
         """
         Post-processing the response
         """
         response.reasoning
         func_string = response.convertion_code
         func_string = func_string.replace('```python', '').replace('```', '')
-        global func
-        exec(func_string, globals())
+        compile(func_string, '<convertor>', 'exec')
+        check_code(func_string, input_values, rejected_attempts)
         return dspy.Prediction(
             reasoning=response.reasoning,
-            callable=copy.copy(func),
-            func_string=AdvanceConvertorGenerator._remove_docstrings_and_comments(func_string),
+            callable=Convertor(SandboxedCallable(func_string)),
+            func_string=CodeChecker.strip(func_string),
         )
     
-    @staticmethod
-    def _remove_docstrings_and_comments(code):
-        """
-        Remove docstrings and comments from a Python function code string.
+    def _with_config(self, inputs: Dict) -> Dict:
+        if self._config:
+            inputs['config'] = dict(self._config)
+        return inputs
 
-        Args:
-            code (str): The Python function code as a string.
+    def _inspector_inputs(self, input_values: List[str], target_values: List[str]) -> Dict:
+        return self._with_config(dict(
+            input_values=input_values,
+            target_values=target_values,
+            input_data_type=type(input_values[0]),
+            target_data_type=type(target_values[0]),
+        ))
 
-        Returns:
-            str: The Python code with docstrings and comments removed.
-        """
-        # Remove docstrings
-        code = re.sub(r'""".*?"""', '', code, flags=re.DOTALL)
-        # Remove single-line comments
-        code = re.sub(r'#.*', '', code)
-        # Remove any unnecessary blank lines created after removing comments and docstrings
-        code = re.sub(r'\n\s*\n', '\n', code)
-        return code
+    def _generator_inputs(self, input_values: List[str], target_values: List[str], inspect_response: dspy.Prediction, rejected_attempts: List[str], parent: Optional[Dict]=None) -> Dict:
+        inputs = dict(
+            input_values=input_values,
+            target_values=target_values,
+            input_data_type=type(input_values[0]),
+            target_data_type=type(target_values[0]),
+            difference_explaination=inspect_response.difference_explaination,
+            convertion_hint=inspect_response.convertion_hint,
+            rejected_attempts=list(rejected_attempts)
+        )
+        if parent is not None:
+            inputs.update(
+                parent_function=parent['func_string'],
+                parent_reasoning=parent['reasoning'],
+                parent_failures=list(parent['failures']),
+            )
+        return self._with_config(inputs)
 
-    def forward(self, input_values: List[str], target_values: List[str]) -> Tuple[Callable, str]:
+    def _inspect_locally(self, input_values: List[str], target_values: List[str]) -> Optional[dspy.Prediction]:
+        if self._local_inspector is None:
+            return None
+        return self._local_inspector.inspect(input_values, target_values)
+
+    def forward(self, input_values: List[str], target_values: List[str], parent: Optional[Dict]=None) -> Tuple[Callable, str]:
+        generator = self._generator if parent is None else self._parent_generator
+        rejected_attempts = []
         again = True
         while again:
             try:
-                inspect_response = self._inspector(
-                    input_values=input_values,
-                    target_values=target_values,
-                    input_data_type=type(input_values[0]),
-                    target_data_type=type(target_values[0]),
-                    )
-                _response = self._generator(
-                    input_values=input_values,
-                    target_values=target_values,
-                    input_data_type=type(input_values[0]),
-                    target_data_type=type(target_values[0]),
-                    difference_explaination=inspect_response.difference_explaination,
-                    convertion_hint=inspect_response.convertion_hint
-                )
-                response = AdvanceConvertorGenerator._response_postprocess(_response)
+                inspect_response = self._inspect_locally(input_values, target_values)
+                if inspect_response is None:
+                    inspect_response = self._inspector(**self._inspector_inputs(input_values, target_values))
+                generator_inputs = self._generator_inputs(input_values, target_values, inspect_response, rejected_attempts, parent)
+                _response = generator(**generator_inputs)
+                response = AdvanceConvertorGenerator._response_postprocess(_response, input_values, rejected_attempts)
                 again = False
             except SyntaxError:
                 print('[forward:warning] SyntaxError:', _response)
+                generator.discard(**generator_inputs)
         return response
 
+    async def aforward(self, input_values: List[str], target_values: List[str], parent: Optional[Dict]=None) -> Tuple[Callable, str]:
+        generator = self._generator if parent is None else self._parent_generator
+        rejected_attempts = []
+        again = True
+        while again:
+            try:
+                inspect_response = self._inspect_locally(input_values, target_values)
+                if inspect_response is None:
+                    inspect_response = await self._inspector.acall(**self._inspector_inputs(input_values, target_values))
+                generator_inputs = self._generator_inputs(input_values, target_values, inspect_response, rejected_attempts, parent)
+                _response = await generator.acall(**generator_inputs)
+                response = AdvanceConvertorGenerator._response_postprocess(_response, input_values, rejected_attempts)
+                again = False
+            except SyntaxError:
+                print('[aforward:warning] SyntaxError:', _response)
+                generator.discard(**generator_inputs)
+        return response
+
+class SpeculativeConvertorGenerator(dspy.Module):
+    """
+    Best-of-N convertor inference.
+
+    One AdvanceConvertorGenerator call is launched per (training sample, temperature)
+    at once. Each response is evaluated on the whole column as soon as it arrives,
+    unless an equivalent candidate (same normalized AST) was evaluated already, and
+    the pending calls are cancelled when one of them fits. Otherwise the response with
+    the highest (accuracy, f1_score) is returned.
+
+    With a `parent` convertor, every candidate is generated as a revision of it.
+    """
+    TEMPERATURES = (0.0, 0.3, 0.6, 0.9, 1.2)
+
+    def __init__(self, temperatures: Optional[Tuple[float, ...]]=None):
+        self._temperatures = temperatures if temperatures is not None else self.TEMPERATURES
+
+    async def _generate(self, i: int, input_values: List[str], target_values: List[str], parent: Optional[Dict]=None) -> Tuple[int, dspy.Prediction]:
+        temperature = self._temperatures[i % len(self._temperatures)]
+        async with llm_slot():
+            return i, await AdvanceConvertorGenerator(config={'temperature': temperature}).acall(input_values, target_values, parent=parent)
+
+    @staticmethod
+    async def _evaluate(response: dspy.Prediction, input_values: List[str], target_values: List[str]) -> EvaluationResult:
+        result = Evaluator.evaluate(response.callable, input_values, target_values, fail_fast=True)
+        if not await asyncio.to_thread(lambda: result.is_fit):
+            await asyncio.to_thread(lambda: (result.accuracy, result.f1_score))
+        return result
+
+    async def aforward(self, samples: List[Tuple[List[str], List[str]]], input_values: List[str], target_values: List[str], parent: Optional[Dict]=None) -> dspy.Prediction:
+        """
+        Generate one candidate per (train_input_values, train_target_values) in `samples`
+        and validate the candidates against the full `input_values` and `target_values`.
+        `sample_index` of the prediction is the position of the sample the returned candidate was generated from.
+        """
+        tasks = [
+            asyncio.ensure_future(self._generate(i, train_input_values, train_target_values, parent))
+            for i, (train_input_values, train_target_values) in enumerate(samples)
+        ]
+        best, best_result, best_index = None, None, None
+        evaluated, duplicate_count = set(), 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    i, response = await task
+                except Exception as e:
+                    print('[SpeculativeConvertorGenerator:warning] candidate failed:', repr(e))
+                    continue
+                candidate_hash = CodeChecker.normalized_hash(response.func_string)
+                if candidate_hash in evaluated:
+                    duplicate_count += 1
+                    continue
+                evaluated.add(candidate_hash)
+                result = await self._evaluate(response, input_values, target_values)
+                if result.is_fit:
+                    best, best_result, best_index = response, result, i
+                    break
+                if best_result is None or (result.accuracy, result.f1_score) > (best_result.accuracy, best_result.f1_score):
+                    best, best_result, best_index = response, result, i
+        finally:
+            for task in tasks:
+                task.cancel()
+        if best is None:
+            raise RuntimeError('None of the speculative candidates produced a convertor')
+        return dspy.Prediction(
+            reasoning=best.reasoning,
+            callable=best.callable,
+            func_string=best.func_string,
+            evaluation_result=best_result,
+            sample_index=best_index,
+            candidate_count=len(tasks),
+            duplicate_count=duplicate_count,
+        )
+
+    def forward(self, samples: List[Tuple[List[str], List[str]]], input_values: List[str], target_values: List[str], parent: Optional[Dict]=None) -> dspy.Prediction:
+        return asyncio.run(self.aforward(samples, input_values, target_values, parent))
+
+
 class ConvertorGenerator(dspy.Module):
     """
     Base template of inferencing convertion function
@@ -178,7 +361,7 @@ class ConvertorGenerator(dspy.Module):
     """
     def __init__(self, value_descriptions: List[str]):
         self._value_descriptions = value_descriptions
-        self.gen_ai = dspy.ChainOfThought(self.get_code_gen_signature())
+        self.gen_ai = CachedChainOfThought(self.get_code_gen_signature(), cache=response_cache, encoder=prompt_encoder)
 
     @abc.abstractmethod
     def get_code_gen_signature(self) -> dspy.Module:
@@ -189,63 +372,48 @@ class ConvertorGenerator(dspy.Module):
         raise NotImplementedError
     
     @staticmethod
-    def _response_postprocess(response: dspy.Prediction) -> dspy.Prediction:
+    def _response_postprocess(response: dspy.Prediction, input_values: Optional[List[str]]=None, rejected_attempts: Optional[List[str]]=None) -> dspy.Prediction:
         """
         Post-processing the response
         """
         response.reasoning
         func_string = response.convertion_code
         func_string = func_string.replace('```python', '').replace('```', '')
-        global func
-        exec(func_string, globals())
+        compile(func_string, '<convertor>', 'exec')
+        check_code(func_string, input_values, rejected_attempts)
         return dspy.Prediction(
             reasoning=response.reasoning,
-            callable=copy.copy(func),
-            func_string=ConvertorGenerator._remove_docstrings_and_comments(func_string),
+            callable=Convertor(SandboxedCallable(func_string)),
+            func_string=CodeChecker.strip(func_string),
         )
     
-    @staticmethod
-    def _remove_docstrings_and_comments(code):
-        """
-        Remove docstrings and comments from a Python function code string.
-
-        Args:
-            code (str): The Python function code as a string.
-
-        Returns:
-            str: The Python code with docstrings and comments removed.
-        """
-        # Remove docstrings
-        code = re.sub(r'""".*?"""', '', code, flags=re.DOTALL)
-        # Remove single-line comments
-        code = re.sub(r'#.*', '', code)
-        # Remove any unnecessary blank lines created after removing comments and docstrings
-        code = re.sub(r'\n\s*\n', '\n', code)
-        return code
-
     def forward(self, input_values: List[str], target_values: List[str]) -> Tuple[Callable, str]:
         random.shuffle(self._value_descriptions)
+        rejected_attempts = []
         again = True
         while again:
             try:
-                _response = self.gen_ai(
+                gen_inputs = dict(
                     input_values=input_values,
                     target_values=target_values,
                     value_descriptions=self._value_descriptions,
                     input_data_type=type(input_values[0]),
                     output_data_type=type(target_values[0]),
+                    rejected_attempts=list(rejected_attempts),
                     )
-                response = ConvertorGenerator._response_postprocess(_response)
+                _response = self.gen_ai(**gen_inputs)
+                response = ConvertorGenerator._response_postprocess(_response, input_values, rejected_attempts)
                 again = False
             except SyntaxError:
                 print('[forward:warning] SyntaxError:', _response)
+                self.gen_ai.discard(**gen_inputs)
         return response
         
 class ReviseInvalidConvertionFunction(dspy.Signature):
     """
     A junior python developer coded a function named `func` to convert each value in the input list to another value in the target list.
     However, the function raise certain error during the processing of certain input value. 
-    The entire traceback error messages and those values causing the error is provided. 
+    The errors are grouped by their kind, each with a few of the values causing it and a shortened traceback. 
     You are a professional senior python developer whose responsibility is to revise the errorneous function, 
     such that the revised function is able to not only avoid the error but also successfully convert 
     values in the input list to those in the target list. 
@@ -256,40 +424,114 @@ class ReviseInvalidConvertionFunction(dspy.Signature):
     target_values: List[str] = dspy.InputField(desc='A list of target values where each value is an output from the python function given an input in the list of input values.')
     input_data_type: str = dspy.InputField(desc='The data type of all the input values.')
     target_data_type: str = dspy.InputField(desc='The data type of the target values.')
-    error_detail: Dict[str, str] = dspy.InputField(desc='A dictionary holding all the traceback error messages. Its keys are the input values causing the error and the values corresponds to the error messages.')
+    error_detail: Dict[str, str] = dspy.InputField(desc='A dictionary holding one entry per kind of error. Its keys describe the error, the failing line of code, how many input values cause it and some of those values; its values are the shortened traceback messages.')
+    rejected_attempts: List[str] = dspy.InputField(desc='Why earlier attempts at the function were rejected. The new function must not repeat these mistakes.')
     convertion_code: str = dspy.OutputField(desc='The re-generated revised function named `func` that convert the input values to the target value. For example: def func(x: <input_data_type>) -> <target_data_type>: \n return ... ')
 
 class InvalidConvertorReviser(dspy.Module):
     """
     Revise the errorneous function to an error-free function.
+
+    A revision still raising errors is discarded from the response cache, so
+    that revising the same function again asks the LM instead of replaying it.
+
+    The error detail in the prompt is bounded: at most MAX_ERROR_CLUSTERS kinds
+    of errors, each with MAX_ERROR_EXAMPLES input values cut to MAX_EXAMPLE_LENGTH
+    characters, whatever the number of failing values.
     """
+    MAX_ERROR_CLUSTERS = 4
+    MAX_ERROR_EXAMPLES = 3
+    MAX_EXAMPLE_LENGTH = 60
+
     def __init__(self):
-        self._reviser = dspy.ChainOfThought(ReviseInvalidConvertionFunction)
+        self._reviser = CachedChainOfThought(ReviseInvalidConvertionFunction, cache=response_cache, encoder=prompt_encoder)
 
-    def forward(self, incorrect_function: str, incorrect_reasoning: str, input_values: List[str], target_values: List[str]):
-        global func
+    @staticmethod
+    def _shorten(text: str) -> str:
+        if len(text) > InvalidConvertorReviser.MAX_EXAMPLE_LENGTH:
+            return text[:InvalidConvertorReviser.MAX_EXAMPLE_LENGTH] + '...'
+        return text
+
+    @staticmethod
+    def _error_detail(incorrect_function: str, input_values: List[str]) -> Dict[str, str]:
         try:
-            exec(incorrect_function, globals())
+            compile(incorrect_function, '<convertor>', 'exec')
         except BaseException as e:
             raise ValueError(incorrect_function) from e
-        error_msgs = Evaluator.check_function_validity(func, input_values)
-        error_detail = dict([(e['invalid_input_value'], e['error_message']) for e in error_msgs])
+        clusters = Evaluator.check_function_validity(
+            SandboxedCallable(incorrect_function), input_values, max_examples=InvalidConvertorReviser.MAX_ERROR_EXAMPLES
+        )
+        code_lines = incorrect_function.splitlines()
+        error_detail = dict()
+        for cluster in clusters[:InvalidConvertorReviser.MAX_ERROR_CLUSTERS]:
+            examples = ', '.join(InvalidConvertorReviser._shorten(repr(value)) for value in cluster['example_inputs'])
+            description = f"{cluster['error_type']} raised by {cluster['count']} input values (e.g., {examples})"
+            file, _, line = cluster['location'].rpartition(':')
+            if file == '<convertor>' and 0 < int(line) <= len(code_lines):
+                description += f' at line {line}: `{code_lines[int(line) - 1].strip()}`'
+            error_detail[description] = cluster['traceback']
+        hidden = clusters[InvalidConvertorReviser.MAX_ERROR_CLUSTERS:]
+        if hidden:
+            error_detail[f'{len(hidden)} other kinds of errors'] = f"raised by {sum(cluster['count'] for cluster in hidden)} input values in total"
+        return error_detail
+
+    def forward(self, incorrect_function: str, incorrect_reasoning: str, input_values: List[str], target_values: List[str]):
+        error_detail = InvalidConvertorReviser._error_detail(incorrect_function, input_values)
+        rejected_attempts = []
         again = True
         while again:
             try:
-                _response = self._reviser(
+                reviser_inputs = dict(
                     incorrect_function=incorrect_function,
                     incorrect_reasoning=incorrect_reasoning,
                     input_values=input_values,
                     target_values=target_values,
                     input_data_type=type(input_values[0]),
                     target_data_type=type(target_values[0]),
-                    error_detail=error_detail
+                    error_detail=error_detail,
+                    rejected_attempts=list(rejected_attempts)
                 )
+                _response = self._reviser(**reviser_inputs)
+                response = ConvertorGenerator._response_postprocess(_response, input_values, rejected_attempts)
                 again = False
             except SyntaxError:
                 print('[forward:warning] SyntaxError:', _response)
-        return ConvertorGenerator._response_postprocess(_response)
+                self._reviser.discard(**reviser_inputs)
+        response.evaluation_result = Evaluator.evaluate(response.callable, input_values, target_values, fail_fast=True)
+        if not response.evaluation_result.is_valid:
+            self._reviser.discard(**reviser_inputs)
+        return response
+
+    async def aforward(self, incorrect_function: str, incorrect_reasoning: str, input_values: List[str], target_values: List[str]):
+        error_detail = await asyncio.to_thread(
+            InvalidConvertorReviser._error_detail, incorrect_function, input_values
+        )
+        rejected_attempts = []
+        again = True
+        while again:
+            try:
+                reviser_inputs = dict(
+                    incorrect_function=incorrect_function,
+                    incorrect_reasoning=incorrect_reasoning,
+                    input_values=input_values,
+                    target_values=target_values,
+                    input_data_type=type(input_values[0]),
+                    target_data_type=type(target_values[0]),
+                    error_detail=error_detail,
+                    rejected_attempts=list(rejected_attempts)
+                )
+                _response = await self._reviser.acall(**reviser_inputs)
+                response = ConvertorGenerator._response_postprocess(_response, input_values, rejected_attempts)
+                again = False
+            except SyntaxError:
+                print('[aforward:warning] SyntaxError:', _response)
+                self._reviser.discard(**reviser_inputs)
+        response.evaluation_result = await asyncio.to_thread(
+            Evaluator.evaluate, response.callable, input_values, target_values, True
+        )
+        if not response.evaluation_result.is_valid:
+            self._reviser.discard(**reviser_inputs)
+        return response
 
 class PairConvertorGenerator(ConvertorGenerator):
     """
@@ -309,45 +551,150 @@ class GroupConvertorGenerator(ConvertorGenerator):
 
 class NumericConvertorGenerator(dspy.Module):
     """
-    Convertion of values with scaling and rounding
+    Convertion of values with scaling, offset and rounding.
+
+    The fit runs on NumPy arrays: the scale and offset are estimated robustly
+    (median of ratios plus RANSAC over pairs of values) and the number of
+    decimal places is detected from the target column. Besides the scalar
+    callable, a `batch_callable` converting a whole array at once is emitted.
+
+    String targets sharing a number of decimal places (e.g., '0.50', '1.00')
+    or a zero-padded width (e.g., '007') are produced with a format spec
+    (e.g., '.2f', '03.0f') instead of `str`, which would drop the padding.
     """
+    MAX_FIT_VALUES = 10000
+    RANSAC_TRIALS = 64
+
     def __init__(self, value_descriptions: List[str]):
         self._value_descriptions = value_descriptions
     
     def forward(self, input_values: List[str], target_values: List[str]) -> Tuple[Callable, str]:
-        scale = NumericConvertorGenerator._find_scale(input_values, target_values)
+        inputs = np.asarray(input_values, dtype=float)
+        targets = np.asarray(target_values, dtype=float)
         round_num = NumericConvertorGenerator._find_round(target_values)
+        scale, offset = NumericConvertorGenerator._find_scale_and_offset(inputs, targets, round_num)
         target_datatype = type(target_values[0])
-        func = lambda x: target_datatype(round(float(x) * scale, round_num))
-        func_string = f'func = lambda x: {target_datatype.__name__}(round(float(x) * {scale}, {round_num}))'
+        number_format = NumericConvertorGenerator._find_format(target_values) if target_datatype is str else None
+        as_integer = round_num == 0 and target_datatype is str and number_format is None
+        batch_func = NumericConvertorGenerator._make_batch_callable(scale, offset, round_num, target_datatype, as_integer, number_format)
+        func = lambda x: batch_func(np.asarray([x], dtype=float)).tolist()[0]
+        func_string = f'import numpy as np\nfunc = lambda x: {NumericConvertorGenerator._expression(scale, offset, round_num, target_datatype, as_integer, number_format)}'
+        reasoning = f'Values from input to target is scaled by {scale}, shifted by {offset} and target is rounded to {round_num} decimal places'
+        if number_format is not None:
+            reasoning += f' and formatted with {number_format!r}'
         return dspy.Prediction(
-            reasoning=f'Values from input to target is scaled by {scale} and target is rounded to {round_num} decimal places',
-            callable=copy.copy(func),
+            reasoning=reasoning,
+            callable=Convertor(func, batch_func),
+            batch_callable=batch_func,
             func_string=func_string,
         )
-    
-    def _find_scale(input_values: List[str], target_values: List[str]) -> float:
-        scale_list = []
-        for input, target in zip(input_values, target_values):
-            input = float(input)
-            target = float(target)
-            if input != 0.0:
-                scale = target / input
-                scale_list.append(scale)
-        if len(scale_list) > 0:
-            scale_string = f'%e'%np.mean(scale_list)
-            front_value = round(float(scale_string.split('e')[0]))
-            end_value = int(scale_string.split('e')[1])
-            return front_value * 10 ** end_value
-        else:
-            return 1.0
-
-    def _find_round(target_values: List[str]):
-        round_numbers = []
-        for target in target_values:
-            target = str(target)
-            if '.' in target:
-                round_numbers.append(len(target.split('.')[1]))
-            else:
-                round_numbers.append(0)
-        return int(np.max(round_numbers))
\ No newline at end of file
+
+    @staticmethod
+    def _divisor(scale: float) -> Optional[int]:
+        """
+        Down-scaling by an integer factor is applied as a division,
+        which reproduces e.g. thousand-scaled values exactly.
+        """
+        if 0 < abs(scale) < 1 and abs(round(1 / scale) - 1 / scale) < 1e-9 * abs(1 / scale):
+            return round(1 / scale)
+        return None
+
+    @staticmethod
+    def _expression(scale: float, offset: float, round_num: int, target_datatype: type, as_integer: bool, number_format: Optional[str]=None) -> str:
+        divisor = NumericConvertorGenerator._divisor(scale)
+        expression = f'float(x) / {divisor}' if divisor is not None else f'float(x) * {scale}'
+        if offset != 0:
+            expression += f' + {offset}'
+        expression = f'np.round({expression}, {round_num})'
+        if number_format is not None:
+            return f'format({expression}, {number_format!r})'
+        if as_integer:
+            expression = f'int({expression})'
+        return f'{target_datatype.__name__}({expression})'
+
+    @staticmethod
+    def _make_batch_callable(scale: float, offset: float, round_num: int, target_datatype: type, as_integer: bool, number_format: Optional[str]=None) -> Callable[[np.ndarray], np.ndarray]:
+        divisor = NumericConvertorGenerator._divisor(scale)
+        def batch_func(values: np.ndarray) -> np.ndarray:
+            values = np.asarray(values, dtype=float)
+            converted = values / divisor if divisor is not None else values * scale
+            converted = np.round(converted + offset, round_num)
+            if number_format is not None:
+                return np.char.mod(f'%{number_format}', converted)
+            if as_integer:
+                converted = converted.astype(np.int64)
+            return converted.astype(target_datatype)
+        return batch_func
+
+    @staticmethod
+    def _snap(value: float, significant_digits: int) -> float:
+        """
+        Round a value to a number of significant digits, e.g., 0.0009998 -> 0.001
+        """
+        if value == 0 or not np.isfinite(value):
+            return 0.0
+        return float(f'%.{significant_digits - 1}e' % value)
+
+    @staticmethod
+    def _find_scale_and_offset(inputs: np.ndarray, targets: np.ndarray, round_num: int) -> Tuple[float, float]:
+        """
+        Estimate `targets ~= inputs * scale + offset` robustly.
+        Candidates come from the median ratio and from random pairs of values;
+        the candidate explaining the most values within rounding error wins,
+        preferring fewer significant digits and no offset on ties.
+        """
+        if len(inputs) > NumericConvertorGenerator.MAX_FIT_VALUES:
+            picked = np.random.default_rng(0).choice(len(inputs), NumericConvertorGenerator.MAX_FIT_VALUES, replace=False)
+            inputs, targets = inputs[picked], targets[picked]
+        nonzero = inputs != 0
+        raw_candidates = [(1.0, 0.0)]
+        if nonzero.any():
+            raw_candidates.append((float(np.median(targets[nonzero] / inputs[nonzero])), 0.0))
+        if len(inputs) > 1:
+            rng = np.random.default_rng(0)
+            i = rng.integers(0, len(inputs), NumericConvertorGenerator.RANSAC_TRIALS)
+            j = rng.integers(0, len(inputs), NumericConvertorGenerator.RANSAC_TRIALS)
+            valid = inputs[i] != inputs[j]
+            scales = (targets[i][valid] - targets[j][valid]) / (inputs[i][valid] - inputs[j][valid])
+            offsets = targets[i][valid] - scales * inputs[i][valid]
+            raw_candidates.extend(zip(scales.tolist(), offsets.tolist()))
+        candidates = []
+        for raw_scale, raw_offset in raw_candidates:
+            for digits in range(1, 5):
+                scale = NumericConvertorGenerator._snap(raw_scale, digits)
+                offset = round(raw_offset, round_num)
+                candidates.append((scale, 0.0 if abs(offset) < 10 ** -(round_num + 1) else offset, digits))
+        scales = np.asarray([c[0] for c in candidates])
+        offsets = np.asarray([c[1] for c in candidates])
+        tolerance = 0.5 * 10 ** -round_num + 1e-9 * np.abs(targets)
+        residuals = np.abs(inputs[None, :] * scales[:, None] + offsets[:, None] - targets[None, :])
+        inliers = (residuals <= tolerance[None, :]).sum(axis=1)
+        best = max(range(len(candidates)), key=lambda k: (inliers[k], -candidates[k][2], candidates[k][1] == 0.0))
+        return candidates[best][0], candidates[best][1]
+
+    @staticmethod
+    def _find_round(target_values: List[str]) -> int:
+        targets = np.asarray([str(target) for target in target_values])
+        decimals = np.char.str_len(np.char.partition(targets, '.')[:, 2])
+        return int(decimals.max()) if len(decimals) > 0 else 0
+
+    @staticmethod
+    def _find_format(target_values: List[str]) -> Optional[str]:
+        """
+        The format spec (e.g., '.2f' or '05.1f') reproducing every target, if the targets share
+        their number of decimal places and, when zero-padded, their width; None when `str` does
+        """
+        targets = np.asarray([str(target) for target in target_values])
+        if len(targets) == 0:
+            return None
+        decimals = np.char.str_len(np.char.partition(targets, '.')[:, 2])
+        if decimals.min() != decimals.max():
+            return None
+        widths = np.char.str_len(targets)
+        unsigned = np.char.lstrip(targets, '-')
+        padded = widths.min() == widths.max() and bool(np.any(
+            np.char.startswith(unsigned, '0') & (np.char.str_len(unsigned) > decimals + (decimals > 0) + 1)
+        ))
+        if decimals[0] == 0 and not padded:
+            return None
+        return f'{f"0{widths[0]}" if padded else ""}.{decimals[0]}f'
@@ -1,77 +1,309 @@
+import os
+import re
+import time
 import traceback
-from typing import Callable, List
-from jarowinkler import jarowinkler_similarity
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from rapidfuzz.distance import JaroWinkler
+from rapidfuzz.process import cpdist
 from scipy.stats import gmean
+from . import instrumentation
 
 
+class _FailedOutput:
+    """
+    Placeholder output of an input value on which the function raised
+    """
+    def __repr__(self):
+        return '<error>'
+
+FAILED = _FailedOutput()
+
+_FRAME = re.compile(r'^  File "(?P<file>[^"]+)", line (?P<line>\d+)')
+_HARNESS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def trim_traceback(text: str, max_frames: int=2, max_message_length: int=300) -> Tuple[str, Optional[str], str]:
+    """
+    Shorten a formatted traceback to the last `max_frames` frames outside of
+    the evaluation harness and a truncated exception message.
+
+    Return the trimmed traceback, the exception type and the failing location
+    (`file:line` of the innermost kept frame, or '' when there is none).
+    """
+    frames: List[List[str]] = []
+    message: List[str] = []
+    for line in text.rstrip().splitlines():
+        match = _FRAME.match(line)
+        if match:
+            frames.append([line])
+            message = []
+        elif line.startswith('Traceback') or line.startswith('During handling') or line.startswith('The above exception'):
+            continue
+        elif line.startswith(' ') and frames and not message:
+            frames[-1].append(line)
+        else:
+            message.append(line)
+    frames = [frame for frame in frames if not os.path.abspath(_FRAME.match(frame[0]).group('file')).startswith(_HARNESS_DIRECTORY)]
+    frames = frames[-max_frames:]
+    message_text = '\n'.join(message).strip()
+    if len(message_text) > max_message_length:
+        message_text = message_text[:max_message_length] + '...'
+    error_type = message_text.split(':', 1)[0].strip() if message_text else None
+    location = ''
+    if frames:
+        match = _FRAME.match(frames[-1][0])
+        location = f"{match.group('file')}:{match.group('line')}"
+    trimmed = '\n'.join([line for frame in frames for line in frame if line.strip(' ^~')] + [message_text])
+    return trimmed, error_type, location
+
+
+class EvaluationResult:
+    """
+    Outcome of running a function over a column of input values.
+
+    The function is executed at most once per distinct input value and
+    every metric (validity, pairwise accuracy, groupwise f1 and error details)
+    is derived from those outputs. With `fail_fast`, `is_valid` and `is_fit`
+    stop at the first error or mismatch; the remaining input values are only
+    executed when another metric is requested later on.
+
+    Functions exposing `call_many` (e.g., sandboxed functions) are
+    executed in batches instead of one value at a time.
+    """
+    BATCH_SIZE = 64
+
+    def __init__(self, func: Callable, input_values: List[str], target_values: Optional[List[str]]=None, fail_fast: bool=False):
+        self.func = func
+        self.input_values = list(input_values)
+        self.target_values = list(target_values) if target_values is not None else None
+        self._target_set = set(target_values) if target_values is not None else None
+        self._fail_fast = fail_fast
+        self._outputs: Dict[Any, Any] = dict()
+        self._errors: Dict[Any, str] = dict()
+        instrumentation.record('candidate_evaluations')
+
+    def matches(self, func: Callable, input_values: List[str], target_values: Optional[List[str]]=None) -> bool:
+        """
+        Check whether this result was produced by the same function on the same values,
+        so that it can be reused instead of running the function again.
+        """
+        return (
+            self.func is func
+            and self.input_values == list(input_values)
+            and (target_values is None or self.target_values == list(target_values))
+        )
+
+    def _call(self, value: Any) -> Tuple[bool, Any]:
+        try:
+            return True, self.func(value)
+        except BaseException:
+            return False, traceback.format_exc()
+
+    def _evaluate(self, values: List[Any]):
+        pending = [value for value in dict.fromkeys(values) if value not in self._outputs]
+        if len(pending) == 0:
+            return
+        start = time.perf_counter()
+        if hasattr(self.func, 'call_many'):
+            results = self.func.call_many(pending)
+        else:
+            results = [self._call(value) for value in pending]
+        instrumentation.record('evaluation_time', time.perf_counter() - start)
+        instrumentation.record('evaluated_values', len(pending))
+        for value, (ok, output) in zip(pending, results):
+            if ok:
+                self._outputs[value] = output
+            else:
+                self._errors[value] = output
+                self._outputs[value] = FAILED
+
+    def _iter_outputs(self) -> Iterator[Any]:
+        """
+        Yield the output of each input value in order, executing the function lazily
+        """
+        batch_size = self.BATCH_SIZE if hasattr(self.func, 'call_many') else 1
+        for start in range(0, len(self.input_values), batch_size):
+            chunk = self.input_values[start:start + batch_size]
+            self._evaluate(chunk)
+            for value in chunk:
+                yield self._outputs[value]
+
+    def _is_expected(self, output: Any) -> bool:
+        try:
+            return output is not FAILED and output in self._target_set
+        except TypeError:
+            return False
+
+    @property
+    def outputs(self) -> List[Any]:
+        """
+        The output of every input value, FAILED where the function raised
+        """
+        self._evaluate(self.input_values)
+        return [self._outputs[value] for value in self.input_values]
+
+    @property
+    def is_valid(self) -> bool:
+        if self._fail_fast:
+            return all(output is not FAILED for output in self._iter_outputs())
+        return len(self.errors) == 0
+
+    @property
+    def is_fit(self) -> bool:
+        if self._fail_fast:
+            return all(self._is_expected(output) for output in self._iter_outputs())
+        return self.f1_score == 1.0
+
+    @property
+    def errors(self) -> List[Dict[str, str]]:
+        """
+        Those inputs that are not valid for the func and the corresponding error message
+        """
+        return [
+            {
+                'invalid_input_value': value,
+                'error_message': self._errors[value]
+            } for value, output in zip(self.input_values, self.outputs) if output is FAILED
+        ]
+
+    def error_clusters(self, max_examples: int=3) -> List[Dict[str, Any]]:
+        """
+        Errors grouped by exception type and failing location, largest group first.
+        Each cluster keeps the number of failing inputs, up to `max_examples` of them
+        and the trimmed traceback of the first one.
+        """
+        self._evaluate(self.input_values)
+        clusters: Dict[Tuple[Optional[str], str], Dict[str, Any]] = OrderedDict()
+        for value in dict.fromkeys(self.input_values):
+            if value not in self._errors:
+                continue
+            trimmed, error_type, location = trim_traceback(self._errors[value])
+            cluster = clusters.setdefault((error_type, location), {
+                'error_type': error_type,
+                'location': location,
+                'count': 0,
+                'example_inputs': [],
+                'traceback': trimmed
+            })
+            cluster['count'] += 1
+            if len(cluster['example_inputs']) < max_examples:
+                cluster['example_inputs'].append(value)
+        return sorted(clusters.values(), key=lambda cluster: -cluster['count'])
+
+    @property
+    def groupwise_matching(self) -> Dict[str, set]:
+        output_values = set([output for output in self.outputs if output is not FAILED])
+        return {
+            'unexpected_outputs': output_values - self._target_set,
+            'missing_outputs': self._target_set - output_values
+        }
+
+    @property
+    def pairwise_matching(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                'input': input_value,
+                'output': output_value,
+                'target': target_value,
+                'correct': output_value is not FAILED and output_value == target_value
+            } for input_value, output_value, target_value in zip(self.input_values, self.outputs, self.target_values)
+        ]
+
+    @property
+    def f1_score(self) -> float:
+        """
+        The share of rows whose output is one of the target values
+        (rows whose input failed count as misses)
+        """
+        hit = sum(self._is_expected(output) for output in self.outputs)
+        return hit / len(self.target_values)
+
+    @property
+    def accuracy(self) -> float:
+        match_info = self.pairwise_matching
+        return sum([row['correct'] for row in match_info]) / len(match_info)
+
+    def __repr__(self):
+        return f'<EvaluationResult: {len(self._outputs)} of {len(set(self.input_values))} distinct inputs evaluated>'
+
 
 class Evaluator:
     """
     Evaluate and identify values that does not match
     """
+    @staticmethod
+    def evaluate(func: Callable, input_values: List[str], target_values: Optional[List[str]]=None, fail_fast: bool=False) -> EvaluationResult:
+        return EvaluationResult(func, input_values, target_values, fail_fast=fail_fast)
+
     @staticmethod
     def is_valid(func: Callable, input_values: List[str]):
-        return len(Evaluator.check_function_validity(func, input_values)) == 0
-    
+        return Evaluator.evaluate(func, input_values, fail_fast=True).is_valid
+
     @staticmethod
     def is_fit(func: Callable, input_values: List[str], target_values: List[str]):
-        return Evaluator.f1_score(func, input_values, target_values) == 1.0
-    
+        return Evaluator.evaluate(func, input_values, target_values, fail_fast=True).is_fit
+
     @staticmethod
     def f1_score(func: Callable, input_values: List[str], target_values: List[str]):
-        group_match_info = Evaluator.check_groupwise_matching(func, input_values, target_values)
-        hit = len(target_values) - len(group_match_info['unexpected_outputs'])
-        return hit / len(target_values)
-    
+        return Evaluator.evaluate(func, input_values, target_values).f1_score
+
     @staticmethod
     def accuracy(func: Callable, input_values: List[str], target_values: List[str]):
-        match_info = Evaluator.check_pairwise_matching(func, input_values, target_values)
-        return sum([row['correct'] for row in match_info]) / len(match_info)
+        return Evaluator.evaluate(func, input_values, target_values).accuracy
+
+    @staticmethod
+    def _similarities(values1: List[str], values2: List[str]) -> np.ndarray:
+        """
+        Jaro-Winkler similarity of each pair (values1[i], values2[i]), in one batch
+        """
+        return cpdist([str(value) for value in values1], [str(value) for value in values2], scorer=JaroWinkler.normalized_similarity, dtype=np.float32, workers=-1)
+
+    @staticmethod
+    def _gmean(sims: np.ndarray) -> float:
+        with np.errstate(divide='ignore'):
+            return float(gmean(sims)) if len(sims) else 0.0
 
     @staticmethod
     def rate_similarity(values1: List[str], values2: List[str]):
         """
         Compare the match-ability between two value list
         """
-        sims = []
-        for value1, value2 in zip(values1, values2):
-            sims.append(jarowinkler_similarity(str(value1), str(value2)))
-        target_sim = gmean(sims)
-        return target_sim
+        size = min(len(values1), len(values2))
+        return Evaluator._gmean(Evaluator._similarities(values1[:size], values2[:size]))
+
+    @staticmethod
+    def rate_random_similarity(values1: List[str], values2: List[str], sample_size: int=4096, seed: Optional[int]=0):
+        """
+        Estimate the similarity `rate_similarity` gives to a random pairing of the
+        two value lists, from `sample_size` pairs drawn from their cross product
+        """
+        if len(values1) == 0 or len(values2) == 0:
+            return 0.0
+        rng = np.random.default_rng(seed)
+        rows = rng.integers(0, len(values1), size=sample_size)
+        columns = rng.integers(0, len(values2), size=sample_size)
+        return Evaluator._gmean(Evaluator._similarities([values1[i] for i in rows], [values2[j] for j in columns]))
 
     @staticmethod
-    def check_function_validity(func: Callable, input_values: List[str]):
+    def check_function_validity(func: Callable, input_values: List[str], max_examples: int=3):
         """
         Check if the function is valid for every value in the input_values.
-        If not, return those inputs that are not valid for the func and the corresponding 
-        error message. 
-        """
-        results = []
-        for value in input_values:
-            try:
-                func(value)
-            except BaseException as e:
-                error_msg = traceback.format_exc()
-                results.append({
-                    'invalid_input_value': value,
-                    'error_message': error_msg
-                })
-        return results
+        If not, return the errors clustered by exception type and failing line,
+        with a few of the inputs causing each of them and a trimmed traceback.
+        """
+        return Evaluator.evaluate(func, input_values).error_clusters(max_examples=max_examples)
 
     @staticmethod
     def check_groupwise_matching(func: Callable, input_values: List[str], target_values: List[str]):
         """
-        Check if the function convert every value in input_values into 
-        value in and only in output_values. 
+        Check if the function convert every value in input_values into
+        value in and only in output_values.
         If not, show the unexpected additional outputs and the missing outputs
         """
-        output_values = []
-        for value in input_values:
-            output_values.append(func(value))
-        return {
-            'unexpected_outputs': set(output_values) - set(target_values),
-            'missing_outputs': set(target_values) - set(output_values)
-        }
+        return Evaluator.evaluate(func, input_values, target_values).groupwise_matching
+
     @staticmethod
     def check_pairwise_matching(func: Callable, input_values: List[str], target_values: List[str]):
         """
@@ -79,13 +311,4 @@ class Evaluator:
 
         If not, show those incorrect output along with their correct output and the input value
         """
-        results = []
-        for input_value, target_value in zip(input_values, target_values):
-            output_value = func(input_value)
-            results.append({
-                'input': input_value,
-                'output': output_value,
-                'target': target_value,
-                'correct': output_value == target_value
-            })
-        return results
\ No newline at end of file
+        return Evaluator.evaluate(func, input_values, target_values).pairwise_matching
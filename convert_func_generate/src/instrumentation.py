@@ -0,0 +1,198 @@
+"""
+Spans and counters for profiling workflow runs.
+
+A span measures the wall time of a workflow run, of a node or of any code
+region opened with `span(name)`. Code anywhere below an open span can `record`
+counters (LM calls, prompt/completion tokens, candidate evaluations, ...) on it
+without holding a reference to it: the current span lives in a context
+variable, so it follows threads started through the controller and asyncio
+tasks. Counters of a finished span are added to its parent.
+
+The `Tracer` workflow hook opens one span per run and per node and exports the
+finished spans as JSON lines or as a Chrome trace (chrome://tracing, Perfetto).
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+from .workflow_tool import WorkflowHook, WorkflowRun
+
+__all__ = [
+    'Span',
+    'Tracer',
+    'span',
+    'record',
+    'current_span'
+]
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('convertor_span', default=None)
+
+
+class Span:
+    """
+    A timed region with counters, belonging to the tracer that collects it
+    """
+    def __init__(self, name: str, tracer: 'Tracer', parent: Optional['Span']=None, run_id: Optional[int]=None, category: str='span'):
+        self.name = name
+        self.category = category
+        self.tracer = tracer
+        self.parent = parent
+        self.run_id = run_id if run_id is not None else (parent.run_id if parent is not None else None)
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.metrics: Counter = Counter()
+        self.attributes: Dict[str, Any] = dict()
+        self._lock = threading.Lock()
+
+    def record(self, metric: str, value: float=1):
+        with self._lock:
+            self.metrics[metric] += value
+
+    def finish(self):
+        self.end = time.perf_counter()
+        if self.parent is not None:
+            with self.parent._lock:
+                self.parent.metrics.update(self.metrics)
+        self.tracer.collect(self)
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'category': self.category,
+            'run_id': self.run_id,
+            'thread_id': self.thread_id,
+            'start': self.start - self.tracer.origin,
+            'duration': self.duration,
+            'metrics': dict(self.metrics),
+            'attributes': self.attributes,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def record(metric: str, value: float=1):
+    """
+    Add `value` to a counter of the current span, if any
+    """
+    active = _current_span.get()
+    if active is not None:
+        active.record(metric, value)
+
+
+@contextlib.contextmanager
+def span(name: str, category: str='span') -> Iterator[Optional[Span]]:
+    """
+    Time a code region as a child of the current span.
+    Nothing is recorded outside of a traced workflow run.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.tracer, parent=parent, category=category)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+
+class Tracer(WorkflowHook):
+    """
+    Workflow hook recording one span per run and per node.
+    """
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def collect(self, finished: Span):
+        with self._lock:
+            self._spans.append(finished)
+
+    @property
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def _open(self, run: WorkflowRun, name: str, category: str):
+        parent = _current_span.get()
+        opened = Span(name, self, parent=parent if parent is not None and parent.tracer is self else None, run_id=run.run_id, category=category)
+        token = _current_span.set(opened)
+        run.metadata.setdefault(('spans', id(self)), []).append((opened, token))
+        return opened
+
+    def _close(self, run: WorkflowRun, error: Optional[BaseException]=None):
+        opened, token = run.metadata[('spans', id(self))].pop()
+        _current_span.reset(token)
+        if error is not None:
+            opened.attributes['error'] = repr(error)
+        opened.finish()
+
+    def on_run_start(self, run: WorkflowRun, payload: Any):
+        self._open(run, 'run', 'run')
+
+    def on_run_end(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        self._close(run, error)
+
+    def before_node(self, run: WorkflowRun, payload: Any):
+        self._open(run, run.current_node.__class__.__name__, 'node')
+
+    def after_node(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        self._close(run, error)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Call count, total wall time and summed counters per node class
+        """
+        totals = defaultdict(Counter)
+        for finished in self.spans:
+            if finished.category != 'node':
+                continue
+            totals[finished.name]['calls'] += 1
+            totals[finished.name]['wall_time'] += finished.duration
+            totals[finished.name].update(finished.metrics)
+        return {name: dict(total) for name, total in sorted(totals.items(), key=lambda item: -item[1]['wall_time'])}
+
+    def export_jsonl(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            for finished in self.spans:
+                f.write(json.dumps(finished.to_dict(), ensure_ascii=False, default=str) + '\n')
+
+    def export_chrome_trace(self, path: str):
+        """
+        Write the spans in the Chrome trace event format,
+        one row (tid) per workflow run.
+        """
+        events = []
+        for finished in self.spans:
+            events.append({
+                'name': finished.name,
+                'cat': finished.category,
+                'ph': 'X',
+                'ts': (finished.start - self.origin) * 1e6,
+                'dur': (finished.duration or 0.0) * 1e6,
+                'pid': os.getpid(),
+                'tid': finished.run_id if finished.run_id is not None else finished.thread_id,
+                'args': dict(finished.metrics, **finished.attributes),
+            })
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
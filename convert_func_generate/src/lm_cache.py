@@ -0,0 +1,237 @@
+"""
+Persistent disk-backed cache for LM responses.
+
+Responses are content addressed: the key is built from the signature class,
+its instructions and the canonicalized input values, so an identical call made
+in a later run is served from local disk instead of the model.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Sequence
+from typing import Any, Dict, Optional, Tuple
+import dspy
+from . import instrumentation
+
+__all__ = [
+    'LMResponseCache',
+    'CachedChainOfThought'
+]
+
+
+def canonicalize(value: Any) -> Any:
+    """
+    Convert a value into a JSON-serializable form that does not
+    depend on set ordering, dict ordering or object identity.
+    """
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, type):
+        return value.__name__
+    if isinstance(value, dict):
+        items = [(json.dumps(canonicalize(k), sort_keys=True), canonicalize(v)) for k, v in value.items()]
+        return [list(item) for item in sorted(items, key=lambda item: item[0])]
+    if isinstance(value, (set, frozenset)):
+        return sorted((canonicalize(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    if isinstance(value, Sequence) and not isinstance(value, bytes):
+        return [canonicalize(v) for v in value]
+    return str(value)
+
+
+class LMResponseCache:
+    """
+    A sqlite-backed response store with LRU eviction.
+
+    Entries older than `max_age` seconds (since last access) are dropped, and
+    the least recently used entries are evicted whenever the store grows beyond
+    `max_entries` or `max_bytes`.
+    """
+    def __init__(self, path: str, max_entries: int=100000, max_bytes: int=512 * 1024 ** 2, max_age: float=90 * 24 * 3600):
+        self._path = path
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._hits = 0
+        self._misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, response TEXT, size INTEGER, created REAL, accessed REAL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._connection.commit()
+            self._evict()
+        return self._connection
+
+    @staticmethod
+    def make_key(signature: type, inputs: Dict[str, Any], namespace: str='') -> str:
+        """
+        Build the content address of a call to `signature` with `inputs`.
+        """
+        content = json.dumps({
+            'namespace': namespace,
+            'signature': signature.__name__,
+            'instructions': signature.instructions,
+            'input_fields': list(signature.input_fields.keys()),
+            'output_fields': list(signature.output_fields.keys()),
+            'inputs': canonicalize(inputs),
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+            connection.commit()
+            self._hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, response: Dict[str, Any]):
+        text = json.dumps(response, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                'INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, text, len(text.encode('utf-8')), now, now)
+            )
+            connection.commit()
+            self._evict()
+
+    def discard(self, key: str):
+        """
+        Drop an entry, e.g., when the cached response turns out to be unusable.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            connection.commit()
+
+    def _evict(self):
+        connection = self._connection
+        connection.execute('DELETE FROM responses WHERE accessed < ?', (time.time() - self._max_age,))
+        count, size = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if count > self._max_entries or size > self._max_bytes:
+            rows = connection.execute('SELECT key, size FROM responses ORDER BY accessed ASC').fetchall()
+            stale_keys = []
+            for key, entry_size in rows:
+                if count <= self._max_entries and size <= self._max_bytes:
+                    break
+                stale_keys.append((key,))
+                count -= 1
+                size -= entry_size
+            connection.executemany('DELETE FROM responses WHERE key = ?', stale_keys)
+        connection.commit()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, size = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'entries': count,
+            'bytes': size
+        }
+
+
+class CachedChainOfThought(dspy.Module):
+    """
+    dspy.ChainOfThought whose responses are looked up in
+    a LMResponseCache before calling the LM.
+
+    With an `encoder` (see prompt_encoding.PromptEncoder), the inputs are
+    encoded before the lookup and the prompt tokens of each LM call are recorded.
+    LM calls, cache hits, LM time and tokens are counted on the current
+    instrumentation span.
+    """
+    def __init__(self, signature: type, cache: Optional[LMResponseCache]=None, encoder: Optional[Any]=None):
+        self._signature = signature
+        self._cache = cache
+        self._encoder = encoder
+        self._predictor = dspy.ChainOfThought(signature)
+
+    def _encode(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if self._encoder is None:
+            return inputs
+        return self._encoder.encode(inputs)
+
+    def _record(self, raw_inputs: Dict[str, Any], inputs: Dict[str, Any]):
+        instrumentation.record('lm_calls')
+        if self._encoder is not None:
+            _, prompt_tokens = self._encoder.record(self._signature, raw_inputs, inputs)
+            instrumentation.record('prompt_tokens', prompt_tokens)
+
+    def _record_completion(self, prediction: dspy.Prediction, elapsed: float):
+        instrumentation.record('lm_time', elapsed)
+        usage = prediction.get_lm_usage() if hasattr(prediction, 'get_lm_usage') else None
+        if usage:
+            completion_tokens = sum(model_usage.get('completion_tokens') or 0 for model_usage in usage.values())
+        elif self._encoder is not None:
+            completion_tokens = sum(self._encoder.count_tokens(str(value)) for value in prediction.values())
+        else:
+            return
+        instrumentation.record('completion_tokens', completion_tokens)
+
+    def _key(self, inputs: Dict[str, Any]) -> str:
+        lm = dspy.settings.lm
+        return LMResponseCache.make_key(self._signature, inputs, namespace=getattr(lm, 'model', ''))
+
+    def _lookup(self, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[dspy.Prediction]]:
+        if self._cache is None:
+            return None, None
+        key = self._key(kwargs)
+        response = self._cache.get(key)
+        if response is None:
+            return key, None
+        instrumentation.record('lm_cache_hits')
+        return key, dspy.Prediction(**response)
+
+    def forward(self, **raw_kwargs) -> dspy.Prediction:
+        kwargs = self._encode(raw_kwargs)
+        key, cached = self._lookup(kwargs)
+        if cached is not None:
+            return cached
+        self._record(raw_kwargs, kwargs)
+        start = time.perf_counter()
+        prediction = self._predictor(**kwargs)
+        self._record_completion(prediction, time.perf_counter() - start)
+        if key is not None:
+            self._cache.put(key, dict(prediction.items()))
+        return prediction
+
+    async def aforward(self, **raw_kwargs) -> dspy.Prediction:
+        kwargs = self._encode(raw_kwargs)
+        key, cached = self._lookup(kwargs)
+        if cached is not None:
+            return cached
+        self._record(raw_kwargs, kwargs)
+        start = time.perf_counter()
+        prediction = await self._predictor.acall(**kwargs)
+        self._record_completion(prediction, time.perf_counter() - start)
+        if key is not None:
+            self._cache.put(key, dict(prediction.items()))
+        return prediction
+
+    def discard(self, **kwargs):
+        """
+        Remove the cached response of a call, so that
+        the next identical call goes to the LM again.
+        """
+        if self._cache is not None:
+            self._cache.discard(self._key(self._encode(kwargs)))
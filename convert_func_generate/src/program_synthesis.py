@@ -0,0 +1,192 @@
+"""
+Rule-based program synthesis of convertion functions.
+
+A FlashFill-style enumerative synthesizer: the target string of every example
+is explained as a concatenation of expressions over the input (substrings,
+integer arithmetic, zero-padding, rounding and number formatting) and constant
+literals. Programs consistent with a few examples are verified on every pair of
+the column before they are emitted, so columns it solves never touch the LLM.
+"""
+from typing import Callable, Iterator, List, Optional, Tuple
+import dspy
+from .convertor import Convertor
+
+__all__ = [
+    'ProgramSynthesizer',
+    'SynthesisConvertorGenerator'
+]
+
+Atom = Tuple[str, Tuple[str, ...]]
+
+
+class ProgramSynthesizer:
+    """
+    Enumerate the DSL against the examples and return the simplest
+    `func_string` explaining all of them.
+    """
+    MAX_SLICE_POSITIONS = 16
+    SCALE_EXPONENTS = range(-6, 7)
+    DECIMALS = range(0, 5)
+
+    def __init__(self, max_parts: int=5, max_search_examples: int=4, max_expansions: int=20000, max_solutions: int=64):
+        self._max_parts = max_parts
+        self._max_search_examples = max_search_examples
+        self._max_expansions = max_expansions
+        self._max_solutions = max_solutions
+
+    def synthesize(self, input_values: List[str], target_values: List[str]) -> Optional[str]:
+        """
+        Return the func_string of a program converting every input to its target,
+        or None when the DSL cannot express the convertion.
+        """
+        if len(input_values) == 0 or not all(isinstance(target, str) for target in target_values):
+            return None
+        pairs = list(dict.fromkeys(zip(map(str, input_values), target_values)))
+        if len(set(input for input, _ in pairs)) < len(pairs):
+            return None
+        examples = self._select_examples(pairs)
+        atoms = self._enumerate_atoms([input for input, _ in examples])
+        solutions = sorted(
+            self._search(examples, atoms),
+            key=lambda parts: (sum(len(code) for code, is_constant in parts if is_constant), len(parts))
+        )
+        for parts in solutions:
+            func_string = self._render(parts)
+            func = self.compile(func_string)
+            if all(self._safe_call(func, input) == target for input, target in pairs):
+                return func_string
+        return None
+
+    @staticmethod
+    def compile(func_string: str) -> Callable:
+        namespace = dict()
+        exec(func_string, namespace)
+        return namespace['func']
+
+    @staticmethod
+    def _safe_call(func: Callable, value: str) -> Optional[str]:
+        try:
+            return func(value)
+        except Exception:
+            return None
+
+    def _select_examples(self, pairs: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """
+        Pick a few examples covering the extremes of input and target lengths
+        """
+        chosen = [
+            pairs[0],
+            min(pairs, key=lambda pair: len(pair[0])),
+            max(pairs, key=lambda pair: len(pair[0])),
+            min(pairs, key=lambda pair: len(pair[1])),
+            max(pairs, key=lambda pair: len(pair[1])),
+        ] + pairs
+        return list(dict.fromkeys(chosen))[:self._max_search_examples]
+
+    def _enumerate_atoms(self, inputs: List[str]) -> List[Atom]:
+        """
+        Enumerate expressions over `x` and keep one expression
+        per distinct behaviour on the example inputs.
+        """
+        min_length = min(len(input) for input in inputs)
+        codes = ['x', 'x.strip()', 'x.upper()', 'x.lower()']
+        slices = []
+        for start in self._slice_positions(min_length, allow_zero=True):
+            for end in self._slice_positions(min_length, allow_zero=False) + [None]:
+                start_code = '' if start == 0 else str(start)
+                end_code = '' if end is None else str(end)
+                slices.append(f'x[{start_code}:{end_code}]')
+        codes.extend(slices)
+        for sub in ['x'] + slices:
+            codes.extend([
+                f'str(int({sub}))',
+                f'str(int({sub}) + 1)',
+                f'str(int({sub}) - 1)',
+                f'str((int({sub}) - 1) // 3 + 1)',
+                f'str(int({sub})).zfill(2)',
+                f'str(int({sub})).zfill(4)',
+            ])
+        for exponent in self.SCALE_EXPONENTS:
+            scaled = 'float(x)' if exponent == 0 else (
+                f'float(x) * {10 ** exponent}' if exponent > 0 else f'float(x) / {10 ** -exponent}'
+            )
+            codes.append(f'str(int(round({scaled})))')
+            for decimals in self.DECIMALS:
+                codes.extend([
+                    f'str(round({scaled}, {decimals}))',
+                    f"f'{{{scaled}:.{decimals}f}}'",
+                    f"f'{{{scaled}:,.{decimals}f}}'",
+                ])
+        atoms = dict()
+        for code in codes:
+            func = eval(f'lambda x: {code}')
+            outputs = tuple(self._safe_call(func, input) for input in inputs)
+            if None in outputs or '' in outputs or outputs in atoms:
+                continue
+            atoms[outputs] = (code, func)
+        return [(code, outputs) for outputs, (code, _) in atoms.items()]
+
+    def _slice_positions(self, length: int, allow_zero: bool) -> List[int]:
+        """
+        Slice positions counted from both ends of the shortest input
+        """
+        limit = min(length, self.MAX_SLICE_POSITIONS)
+        positions = list(range(0, limit)) if allow_zero else list(range(1, limit + 1))
+        return positions + [-i for i in range(1, limit + 1)]
+
+    def _search(self, examples: List[Tuple[str, str]], atoms: List[Atom]) -> Iterator[List[Tuple[str, bool]]]:
+        """
+        Depth-first search over concatenations of atoms and constants whose
+        partial outputs stay a prefix of every target.
+        """
+        targets = [target for _, target in examples]
+        expansions = 0
+        found = 0
+
+        def _extend(offsets: List[int], parts: List[Tuple[str, bool]]) -> Iterator[List[Tuple[str, bool]]]:
+            nonlocal expansions, found
+            if all(offset == len(target) for offset, target in zip(offsets, targets)):
+                found += 1
+                yield list(parts)
+                return
+            if len(parts) >= self._max_parts or expansions >= self._max_expansions or found >= self._max_solutions:
+                return
+            expansions += 1
+            for code, outputs in atoms:
+                if all(target.startswith(output, offset) for target, output, offset in zip(targets, outputs, offsets)):
+                    yield from _extend([offset + len(output) for offset, output in zip(offsets, outputs)], parts + [(code, False)])
+            if parts and parts[-1][1]:
+                return
+            remainder = targets[0][offsets[0]:]
+            for length in range(1, len(remainder) + 1):
+                constant = remainder[:length]
+                if not all(target.startswith(constant, offset) for target, offset in zip(targets, offsets)):
+                    break
+                yield from _extend([offset + length for offset in offsets], parts + [(repr(constant), True)])
+
+        yield from _extend([0] * len(examples), [])
+
+    @staticmethod
+    def _render(parts: List[Tuple[str, bool]]) -> str:
+        expression = ' + '.join(code for code, _ in parts) if parts else "''"
+        return f'def func(x):\n    x = str(x)\n    return {expression}\n'
+
+
+class SynthesisConvertorGenerator(dspy.Module):
+    """
+    Convertion of string values by rule-based program synthesis.
+    Return None when no program of the DSL fits the values.
+    """
+    def __init__(self, synthesizer: Optional[ProgramSynthesizer]=None):
+        self._synthesizer = synthesizer if synthesizer is not None else ProgramSynthesizer()
+
+    def forward(self, input_values: List[str], target_values: List[str]) -> Optional[dspy.Prediction]:
+        func_string = self._synthesizer.synthesize(input_values, target_values)
+        if func_string is None:
+            return None
+        func = ProgramSynthesizer.compile(func_string)
+        return dspy.Prediction(
+            reasoning='The convertion is synthesized from the examples as a concatenation of substring, arithmetic and formatting operations.',
+            callable=Convertor(func),
+            func_string=func_string,
+        )
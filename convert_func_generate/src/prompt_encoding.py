@@ -0,0 +1,151 @@
+"""
+Token-efficient encoding of the value lists passed to the LM.
+
+Input/target pairs are deduplicated, pairs repeating the shape of already shown
+pairs are elided and each field is capped at a token budget before dspy renders
+the prompt. The token count of every rendered prompt is recorded, along with
+an estimate of the raw prompt, so that the savings of the encoding can be
+reported.
+"""
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import dspy
+from .value_pattern import value_shape
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+__all__ = [
+    'TokenCounter',
+    'PromptEncoder'
+]
+
+
+class TokenCounter:
+    """
+    Count tokens with tiktoken when its encoding is available,
+    otherwise estimate them as one token per four characters.
+    """
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, encoding_name: str='cl100k_base'):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+            except Exception:
+                self._encoding = None
+
+    def __call__(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return (len(text) + self.CHARS_PER_TOKEN - 1) // self.CHARS_PER_TOKEN
+
+
+class PromptEncoder:
+    """
+    Shrink the `input_values`/`target_values` fields of a call while
+    keeping the remaining pairs aligned.
+
+    - identical (input, target) pairs are kept once
+    - at most `max_per_shape` pairs of the same input/target shape are kept,
+      picked round-robin so that every shape is shown before any repeats
+    - each of the two fields is capped at `field_token_budget` tokens
+    """
+    PAIR_FIELDS = ('input_values', 'target_values')
+
+    def __init__(self, field_token_budget: int=512, max_per_shape: int=8, token_counter: Optional[TokenCounter]=None):
+        self._field_token_budget = field_token_budget
+        self._max_per_shape = max_per_shape
+        self._count = token_counter if token_counter is not None else TokenCounter()
+        self._adapter = dspy.ChatAdapter()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def count_tokens(self, text: str) -> int:
+        return self._count(text)
+
+    def encode_pairs(self, input_values: List[Any], target_values: List[Any]) -> Tuple[List[Any], List[Any]]:
+        pairs = list(dict.fromkeys(zip(input_values, target_values)))
+        shapes = [(value_shape(input, coarse=True), value_shape(target, coarse=True)) for input, target in pairs]
+        ranks = []
+        seen = Counter()
+        for shape in shapes:
+            ranks.append(seen[shape])
+            seen[shape] += 1
+        order = sorted(
+            (position for position, rank in enumerate(ranks) if rank < self._max_per_shape),
+            key=lambda position: ranks[position]
+        )
+        kept = []
+        input_tokens, target_tokens = 0, 0
+        for position in order:
+            input, target = pairs[position]
+            input_cost = self._count(repr(input)) + 1
+            target_cost = self._count(repr(target)) + 1
+            if kept and (input_tokens + input_cost > self._field_token_budget or target_tokens + target_cost > self._field_token_budget):
+                break
+            input_tokens += input_cost
+            target_tokens += target_cost
+            kept.append(position)
+        kept.sort()
+        return [pairs[position][0] for position in kept], [pairs[position][1] for position in kept]
+
+    def encode(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Encode the keyword inputs of a call. Only aligned `input_values`
+        and `target_values` lists are changed.
+        """
+        input_values, target_values = (inputs.get(field) for field in self.PAIR_FIELDS)
+        if not isinstance(input_values, (list, tuple)) or not isinstance(target_values, (list, tuple)) or len(input_values) != len(target_values):
+            return inputs
+        try:
+            encoded_inputs, encoded_targets = self.encode_pairs(input_values, target_values)
+        except TypeError:
+            return inputs
+        return dict(inputs, input_values=encoded_inputs, target_values=encoded_targets)
+
+    def prompt_tokens(self, signature: type, inputs: Dict[str, Any]) -> int:
+        """
+        Token count of the prompt dspy renders for a call to `signature`
+        """
+        inputs = {key: value for key, value in inputs.items() if key in signature.input_fields}
+        messages = self._adapter.format(signature, demos=[], inputs=inputs)
+        return sum(self._count(str(message['content'])) for message in messages)
+
+    @staticmethod
+    def _list_chars(values: Any) -> int:
+        """
+        Length of `repr(values)` for a list of values, without building the string
+        """
+        return sum(len(repr(value)) for value in values) + 2 * max(len(values), 1)
+
+    def record(self, signature: type, raw_inputs: Dict[str, Any], encoded_inputs: Dict[str, Any]) -> Tuple[int, int]:
+        """
+        Record and return the prompt tokens before and after the encoding.
+
+        Only the encoded prompt is rendered and counted; the raw prompt is
+        estimated from it plus the characters the encoding removed from
+        the pair fields, at TokenCounter.CHARS_PER_TOKEN characters per token.
+        """
+        encoded_tokens = self.prompt_tokens(signature, encoded_inputs)
+        raw_tokens = encoded_tokens
+        if raw_inputs is not encoded_inputs:
+            removed_chars = sum(
+                self._list_chars(raw_inputs[field]) - self._list_chars(encoded_inputs[field])
+                for field in self.PAIR_FIELDS if raw_inputs.get(field) is not encoded_inputs.get(field)
+            )
+            raw_tokens += max(removed_chars, 0) // TokenCounter.CHARS_PER_TOKEN
+        with self._lock:
+            self._stats['prompts'] += 1
+            self._stats['raw_tokens'] += raw_tokens
+            self._stats['encoded_tokens'] += encoded_tokens
+        return raw_tokens, encoded_tokens
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,298 @@
+"""
+Sandboxed execution of generated convertor functions.
+
+Function strings produced by the LLM are executed inside a warm pool of
+worker processes instead of the workflow process itself, so that
+an infinite loop, a pathological regex or a memory blow-up only costs
+the worker it ran in.
+
+The workflow process runs several threads (the workflow loop, the batch and
+evaluation pools, rapidfuzz workers), and forking a threaded process can
+deadlock the child on a lock held by another thread. Workers are therefore
+forked from a single-threaded fork server (or spawned where there is none),
+never from the workflow process itself, including the replacements of
+workers killed on timeout.
+"""
+import atexit
+import builtins
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+from typing import Any, List, Optional, Sequence, Tuple
+
+__all__ = [
+    'SandboxExecutor',
+    'SandboxedCallable',
+    'SandboxError',
+    'get_default_executor'
+]
+
+DEFAULT_ALLOWED_IMPORTS = (
+    're', 'math', 'datetime', 'decimal', 'fractions', 'string', 'calendar',
+    'collections', 'itertools', 'functools', 'typing', 'numbers', 'numpy'
+)
+BLOCKED_BUILTINS = (
+    'open', 'input', 'exec', 'eval', 'compile', 'breakpoint', 'exit', 'quit', 'help', '__import__'
+)
+MAX_CACHED_FUNCTIONS = 256
+# seconds a new worker may take to import the main module before it is replaced
+STARTUP_TIMEOUT = 60.0
+
+
+class SandboxError(Exception):
+    """
+    An exception raised by a function inside the sandbox,
+    carrying the traceback text produced in the worker.
+    """
+
+
+def _restricted_import(allowed_imports: Sequence[str]):
+    def _import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name.split('.')[0] not in allowed_imports:
+            raise ImportError(f'import of {name!r} is not allowed in the sandbox')
+        return builtins.__import__(name, globals, locals, fromlist, level)
+    return _import
+
+
+def _on_alarm(signum, frame):
+    raise TimeoutError('call exceeded the sandbox time limit')
+
+
+def _limit_memory(memory_limit: Optional[int]):
+    """
+    Cap the address space of the worker to its current size plus `memory_limit` bytes.
+    """
+    if memory_limit is None:
+        return
+    try:
+        import resource
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = current + memory_limit
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ImportError, OSError, ValueError):
+        pass
+
+
+def _load_function(func_string: str, allowed_imports: Sequence[str]):
+    safe_builtins = {k: v for k, v in vars(builtins).items() if k not in BLOCKED_BUILTINS}
+    safe_builtins['__import__'] = _restricted_import(allowed_imports)
+    namespace = {'__builtins__': safe_builtins, '__name__': '__convertor__'}
+    exec(compile(func_string, '<convertor>', 'exec'), namespace)
+    return namespace['func']
+
+
+def _worker_main(connection, allowed_imports: Sequence[str], memory_limit: Optional[int]):
+    """
+    Loop of a worker process: announce readiness with one None message, then
+    receive (func_string, values, call_timeout) and send back one
+    (ok, output_or_traceback) message per value.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    _limit_memory(memory_limit)
+    connection.send(None)
+    functions = dict()
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        func_string, values, call_timeout = message
+        if func_string not in functions:
+            if len(functions) >= MAX_CACHED_FUNCTIONS:
+                functions.clear()
+            try:
+                functions[func_string] = (True, _load_function(func_string, allowed_imports))
+            except BaseException:
+                functions[func_string] = (False, traceback.format_exc())
+        loaded, func = functions[func_string]
+        for value in values:
+            if not loaded:
+                result = (False, func)
+            else:
+                signal.setitimer(signal.ITIMER_REAL, call_timeout)
+                try:
+                    result = (True, func(value))
+                except BaseException:
+                    result = (False, traceback.format_exc())
+                finally:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            try:
+                connection.send(result)
+            except BaseException:
+                connection.send((False, traceback.format_exc()))
+
+
+class _Worker:
+    """
+    Handle of one worker process
+    """
+    def __init__(self, context, allowed_imports: Sequence[str], memory_limit: Optional[int]):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, tuple(allowed_imports), memory_limit),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.ready = False
+
+    def wait_ready(self, timeout: float):
+        """
+        Wait for the readiness message of a new worker
+        """
+        if self.ready:
+            return
+        if not self.connection.poll(timeout):
+            raise EOFError('worker process did not start in time')
+        self.connection.recv()
+        self.ready = True
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class SandboxExecutor:
+    """
+    Run function strings in a pool of worker processes
+    with per-call and per-batch wall-clock timeouts, a memory limit
+    and an import allowlist.
+
+    Workers come from the 'forkserver' start method, whose server preloads the
+    main module and this module once, so that a worker starts with a fork of
+    a single-threaded process instead of an import of the main module.
+    """
+    def __init__(
+            self,
+            n_workers: int=min(4, os.cpu_count() or 1),
+            call_timeout: float=1.0,
+            batch_timeout: float=30.0,
+            memory_limit: Optional[int]=512 * 1024 ** 2,
+            allowed_imports: Sequence[str]=DEFAULT_ALLOWED_IMPORTS):
+        self._call_timeout = call_timeout
+        self._batch_timeout = batch_timeout
+        self._memory_limit = memory_limit
+        self._allowed_imports = tuple(allowed_imports)
+        methods = multiprocessing.get_all_start_methods()
+        if 'forkserver' in methods:
+            self._context = multiprocessing.get_context('forkserver')
+            self._context.set_forkserver_preload(['__main__', __name__])
+        else:
+            self._context = multiprocessing.get_context('spawn')
+        self._idle: 'queue.Queue[_Worker]' = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        for _ in range(n_workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._context, self._allowed_imports, self._memory_limit)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        with self._lock:
+            self._workers.remove(worker)
+        return self._spawn()
+
+    def run(self, func_string: str, values: Sequence[Any], call_timeout: Optional[float]=None, batch_timeout: Optional[float]=None) -> List[Tuple[bool, Any]]:
+        """
+        Apply the function named `func` defined in `func_string` to each value.
+        Return one (ok, output) tuple per value where output is the traceback
+        text when ok is False.
+        """
+        call_timeout = self._call_timeout if call_timeout is None else call_timeout
+        batch_timeout = self._batch_timeout if batch_timeout is None else batch_timeout
+        values = list(values)
+        results = []
+        worker = self._idle.get()
+        try:
+            worker.wait_ready(STARTUP_TIMEOUT)
+            worker.connection.send((func_string, values, call_timeout))
+            batch_deadline = time.monotonic() + batch_timeout
+            # grace period on top of the in-worker alarm for calls that never return to the interpreter
+            call_limit = call_timeout * 2 + 0.1
+            while len(results) < len(values):
+                remaining = batch_deadline - time.monotonic()
+                wait = min(call_limit, remaining)
+                if wait <= 0 or not worker.connection.poll(wait):
+                    reason = 'call' if call_limit < remaining else 'batch'
+                    message = f'TimeoutError: {reason} exceeded the sandbox time limit'
+                    results.extend([(False, message)] * (len(values) - len(results)))
+                    worker = self._replace(worker)
+                    break
+                results.append(worker.connection.recv())
+        except (EOFError, OSError):
+            message = 'SandboxError: worker process died (e.g., by exceeding the memory limit) or did not start'
+            results.extend([(False, message)] * (len(values) - len(results)))
+            worker = self._replace(worker)
+        finally:
+            self._idle.put(worker)
+        return results
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            try:
+                worker.connection.send(None)
+            except (OSError, ValueError):
+                pass
+            worker.kill()
+
+
+_default_executor: Optional[SandboxExecutor] = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor() -> SandboxExecutor:
+    """
+    The process-wide executor, started on first use
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = SandboxExecutor()
+            atexit.register(_default_executor.close)
+    return _default_executor
+
+
+class SandboxedCallable:
+    """
+    Callable proxy of a function string that is executed in a SandboxExecutor
+    """
+    def __init__(self, func_string: str, executor: Optional[SandboxExecutor]=None):
+        self.func_string = func_string
+        self._executor = executor
+
+    @property
+    def executor(self) -> SandboxExecutor:
+        return self._executor if self._executor is not None else get_default_executor()
+
+    def __call__(self, value: Any) -> Any:
+        ok, output = self.executor.run(self.func_string, [value])[0]
+        if not ok:
+            raise SandboxError(output)
+        return output
+
+    def call_many(self, values: Sequence[Any]) -> List[Tuple[bool, Any]]:
+        """
+        Apply the function to a batch of values in one round trip
+        """
+        return self.executor.run(self.func_string, values)
@@ -0,0 +1,263 @@
+"""
+Budget-aware scheduling of the refinement iterations of workflow runs.
+
+Every run (one column) is granted a wall-time and an LM token budget. The
+scheduler follows the (accuracy, f1_score) trajectory of the column across
+iterations and decides whether another iteration is worth its cost:
+
+- a column whose trajectory stalls is stopped early, after one attempt at
+  aligning its values when the outputs look right but misaligned;
+- a column whose convertors keep fitting the training values but not the
+  held-out testing values (overfit, e.g. hard-coded mappings) is stopped early;
+- a column whose convertors keep raising errors is revised at most
+  `max_revisions` times in a row, and not at all once out of budget;
+- the unspent budget of a finished or stopped column goes to a pool shared by
+  the batch, from which columns close to fitting borrow when they run out.
+
+Spending is measured per node: wall time between `before_node` and
+`after_node`, and the prompt/completion tokens counted on the node span of the
+`Tracer`, so the scheduler must come after the tracer in the controller hooks
+for tokens to be accounted.
+"""
+import contextvars
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from .instrumentation import current_span
+from .workflow_tool import WorkflowHook, WorkflowRun
+
+__all__ = [
+    'ColumnBudget',
+    'IterationScheduler'
+]
+
+_current_budget: contextvars.ContextVar = contextvars.ContextVar('convertor_budget', default=None)
+
+
+class ColumnBudget:
+    """
+    Granted and spent budget and the evaluation trajectory of one run
+    """
+    def __init__(self, seconds: float, tokens: int):
+        self.granted_seconds = seconds
+        self.granted_tokens = tokens
+        self.spent_seconds = 0.0
+        self.spent_tokens = 0
+        self.trajectory: List[Tuple[float, float]] = []
+        self.aligned = False
+        self.overfit_streak = 0
+        self.revisions = 0
+        self.stop_reason: Optional[str] = None
+
+    @property
+    def iterations(self) -> int:
+        return len(self.trajectory)
+
+    @property
+    def best(self) -> Tuple[float, float]:
+        return max(self.trajectory, default=(0.0, 0.0))
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent_seconds >= self.granted_seconds or self.spent_tokens >= self.granted_tokens
+
+    def iteration_cost(self) -> Tuple[float, int]:
+        """
+        Average seconds and tokens spent per iteration so far
+        """
+        iterations = max(self.iterations, 1)
+        return self.spent_seconds / iterations, int(self.spent_tokens / iterations)
+
+    def state(self) -> Dict[str, Any]:
+        """
+        The budget as a JSON-compatible dict, e.g., to checkpoint it
+        """
+        return dict(vars(self), trajectory=[list(point) for point in self.trajectory])
+
+    def load_state(self, state: Dict[str, Any]):
+        """
+        Continue from a budget saved with `state`
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.trajectory = [tuple(point) for point in self.trajectory]
+
+    def stalled(self, patience: int, min_improvement: float) -> bool:
+        """
+        Whether the best accuracy or f1 score has not improved by `min_improvement`
+        over the last `patience` iterations
+        """
+        if self.iterations <= patience:
+            return False
+        before = max(self.trajectory[:-patience])
+        recent = max(self.trajectory[-patience:])
+        return recent[0] < before[0] + min_improvement and recent[1] < before[1] + min_improvement
+
+
+class IterationScheduler(WorkflowHook):
+    """
+    Workflow hook granting each run `seconds_per_column` seconds and
+    `tokens_per_column` LM tokens, and deciding after every evaluation
+    whether the run should iterate ('feedback'), align its values first
+    ('align_values') or stop ('end').
+
+    A column whose best accuracy reaches `near_fit_accuracy` may borrow the
+    cost of one more iteration from the shared pool when it is out of budget.
+    `max_iterations` bounds the iterations of a column regardless of budget,
+    and `max_revisions` the consecutive revisions of an erroneous convertor.
+    """
+    def __init__(
+            self,
+            seconds_per_column: float=120.0,
+            tokens_per_column: int=30000,
+            max_iterations: int=5,
+            max_revisions: int=3,
+            patience: int=2,
+            min_improvement: float=0.02,
+            near_fit_accuracy: float=0.8):
+        self.seconds_per_column = seconds_per_column
+        self.tokens_per_column = tokens_per_column
+        self.max_iterations = max_iterations
+        self.max_revisions = max_revisions
+        self.patience = patience
+        self.min_improvement = min_improvement
+        self.near_fit_accuracy = near_fit_accuracy
+        self._lock = threading.Lock()
+        self._pool_seconds = 0.0
+        self._pool_tokens = 0
+        self._stats: Dict[str, float] = {'columns': 0, 'iterations': 0, 'revisions': 0, 'borrowed': 0, 'released_seconds': 0.0, 'released_tokens': 0}
+
+    @staticmethod
+    def current() -> Optional[ColumnBudget]:
+        """
+        The budget of the workflow run in progress, if any
+        """
+        return _current_budget.get()
+
+    def on_run_start(self, run: WorkflowRun, payload: Any):
+        budget = ColumnBudget(self.seconds_per_column, self.tokens_per_column)
+        token = _current_budget.set(budget)
+        run.metadata[('budget', id(self))] = (budget, token)
+        with self._lock:
+            self._stats['columns'] += 1
+
+    def on_run_end(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        budget, token = run.metadata.pop(('budget', id(self)))
+        _current_budget.reset(token)
+        self._release(budget)
+
+    def before_node(self, run: WorkflowRun, payload: Any):
+        run.metadata[('node_start', id(self))] = time.perf_counter()
+
+    def after_node(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        budget, _ = run.metadata[('budget', id(self))]
+        budget.spent_seconds += time.perf_counter() - run.metadata.pop(('node_start', id(self)))
+        node_span = current_span()
+        if node_span is not None:
+            budget.spent_tokens += int(node_span.metrics['prompt_tokens'] + node_span.metrics['completion_tokens'])
+
+    def _release(self, budget: ColumnBudget):
+        """
+        Return the unspent budget of a finished column to the pool
+        """
+        seconds = max(budget.granted_seconds - budget.spent_seconds, 0.0)
+        tokens = max(budget.granted_tokens - budget.spent_tokens, 0)
+        with self._lock:
+            self._pool_seconds += seconds
+            self._pool_tokens += tokens
+            self._stats['released_seconds'] += seconds
+            self._stats['released_tokens'] += tokens
+
+    def _borrow(self, budget: ColumnBudget) -> bool:
+        """
+        Grant a near-fit column the cost of one more iteration from the pool
+        """
+        seconds, tokens = budget.iteration_cost()
+        seconds = max(seconds, budget.spent_seconds - budget.granted_seconds)
+        tokens = max(tokens, budget.spent_tokens - budget.granted_tokens)
+        with self._lock:
+            if self._pool_seconds < seconds or self._pool_tokens < tokens:
+                return False
+            self._pool_seconds -= seconds
+            self._pool_tokens -= tokens
+            self._stats['borrowed'] += 1
+        budget.granted_seconds += seconds
+        budget.granted_tokens += tokens
+        return True
+
+    def observe(self, evaluation: Dict[str, float]):
+        """
+        Add the evaluation of the current convertor to the trajectory of the current run.
+        `train_accuracy` and `test_accuracy`, when given, are used to detect overfitting.
+        """
+        budget = self.current()
+        if budget is None:
+            return
+        budget.trajectory.append((evaluation['accuracy'], evaluation['f1_score']))
+        budget.revisions = 0
+        budget.overfit_streak = budget.overfit_streak + 1 if self._overfit(evaluation) else 0
+        with self._lock:
+            self._stats['iterations'] += 1
+
+    @staticmethod
+    def _overfit(evaluation: Dict[str, float]) -> bool:
+        """
+        Whether the convertor fits the training values but not the held-out testing values
+        """
+        return evaluation.get('train_accuracy') == 1.0 and evaluation.get('test_accuracy', float('nan')) < 1.0
+
+    def may_revise(self) -> bool:
+        """
+        Whether the current run may revise its erroneous convertor once more;
+        otherwise the convertor goes on to be evaluated as it is
+        """
+        budget = self.current()
+        if budget is None:
+            return True
+        if budget.revisions >= self.max_revisions or budget.exhausted:
+            print('[IterationScheduler:may_revise] evaluate the erroneous convertor after', budget.revisions, 'revisions')
+            return False
+        budget.revisions += 1
+        with self._lock:
+            self._stats['revisions'] += 1
+        return True
+
+    def decide(self, evaluation: Dict[str, float]) -> str:
+        """
+        'end', 'align_values' or 'feedback' for the current run given its last evaluation
+        """
+        budget = self.current()
+        if budget is None:
+            budget = ColumnBudget(self.seconds_per_column, self.tokens_per_column)
+        decision = self._decide(budget, evaluation)
+        if decision == 'align_values':
+            budget.aligned = True
+        elif decision == 'end' and budget.stop_reason is not None:
+            print('[IterationScheduler:decide] stop after', budget.iterations, 'iterations:', budget.stop_reason)
+        return decision
+
+    def _decide(self, budget: ColumnBudget, evaluation: Dict[str, float]) -> str:
+        misaligned = evaluation['f1_score'] > evaluation['accuracy'] + 0.1
+        if budget.iterations >= self.max_iterations:
+            budget.stop_reason = 'max iterations'
+            return 'end'
+        if budget.exhausted:
+            if budget.best[0] < self.near_fit_accuracy or not self._borrow(budget):
+                budget.stop_reason = 'out of budget'
+                return 'end'
+        if budget.overfit_streak >= self.patience:
+            budget.stop_reason = 'overfit to the training values'
+            return 'end'
+        if budget.stalled(self.patience, self.min_improvement):
+            if budget.aligned or not misaligned:
+                budget.stop_reason = 'stalled'
+                return 'end'
+            return 'align_values'
+        if misaligned and not budget.aligned and budget.iterations > self.patience:
+            return 'align_values'
+        return 'feedback'
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stats, pool_seconds=self._pool_seconds, pool_tokens=self._pool_tokens)
@@ -0,0 +1,51 @@
+"""
+Pattern signatures of values, e.g., '2024Q3' -> 'd4A1d1'
+"""
+from collections import Counter
+from typing import Any, List
+
+
+def _char_class(char: str) -> str:
+    if char.isdigit():
+        return 'd'
+    if char.isalpha():
+        return 'A' if char.isupper() else 'a'
+    if char.isspace():
+        return ' '
+    return char
+
+
+def value_shape(value: Any, coarse: bool=False) -> str:
+    """
+    Character-class shape of a value: digits, upper and lower case letters
+    are collapsed into runs of 'd', 'A' and 'a' followed by the run length,
+    other characters are kept literally. With `coarse`, the run lengths are
+    dropped so that e.g. '4556954' and '74863743' share a shape.
+    """
+    shape = []
+    previous = None
+    length = 0
+    for char in str(value):
+        current = _char_class(char)
+        if current == previous and current in 'dAa ':
+            length += 1
+            continue
+        if previous is not None:
+            shape.append(previous if coarse or previous not in 'dAa ' else f'{previous}{length}')
+        previous, length = current, 1
+    if previous is not None:
+        shape.append(previous if coarse or previous not in 'dAa ' else f'{previous}{length}')
+    return ''.join(shape)
+
+
+def column_signature(input_values: List[Any], target_values: List[Any], max_shapes: int=3) -> str:
+    """
+    Signature of a column convertion: the most common pairs of
+    coarse input/target shapes, in a canonical order.
+    """
+    counts = Counter(
+        (value_shape(input, coarse=True), value_shape(target, coarse=True))
+        for input, target in zip(input_values, target_values)
+    )
+    shapes = sorted(shape for shape, _ in counts.most_common(max_shapes))
+    return '|'.join(f'{input_shape}->{target_shape}' for input_shape, target_shape in shapes)
@@ -2,13 +2,48 @@
 For building up agent interaction workflow
 """
 import abc
-from typing import Dict
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from typing import Dict, List, Iterable, Iterator, Tuple, Optional, AsyncIterator
 from typing import Any, Callable
 
+_llm_semaphore: contextvars.ContextVar = contextvars.ContextVar('workflow_llm_semaphore', default=None)
+
+
+@contextlib.asynccontextmanager
+async def llm_slot():
+    """
+    Hold one LLM slot of the controller running the current `llm_fanout` node
+    for the duration of one LLM call (no-op outside of such a node)
+    """
+    semaphore = _llm_semaphore.get()
+    if semaphore is None:
+        yield
+        return
+    async with semaphore:
+        yield
+
+
 class WorkflowNode:
     """
     A branching node in the workflow
+
+    `process` and `determine_downstream` may be defined either as plain
+    methods or as coroutines (`async def`). Nodes waiting on an LLM should
+    set `llm_bound` so that the controller can bound their concurrency.
+    Nodes issuing several LLM calls at once should set `llm_fanout` instead:
+    they do not hold a slot as a whole, and take one with `llm_slot()` per call.
     """
+    llm_bound: bool = False
+    llm_fanout: bool = False
+
     def __init__(self):
         self._next_nodes: Dict[str, 'WorkflowNode'] = dict()
 
@@ -40,55 +75,277 @@ class WorkflowNode:
         """
         return payload
 
+def workflow_node_ids(start_node: WorkflowNode) -> Dict[WorkflowNode, str]:
+    """
+    Stable ids of the nodes reachable from `start_node`, as `ClassName#k`
+    where k counts the nodes of the same class in breadth-first order.
+    """
+    ids = dict()
+    counts = defaultdict(int)
+    queue = deque([start_node])
+    while queue:
+        node = queue.popleft()
+        if node in ids:
+            continue
+        name = node.__class__.__name__
+        ids[node] = f'{name}#{counts[name]}'
+        counts[name] += 1
+        queue.extend(node._next_nodes.values())
+    return ids
+
+class WorkflowRun:
+    """
+    State of one run of the workflow over a payload.
+
+    `metadata` is free for hooks to keep per-run state in.
+    """
+    _ids = itertools.count()
+
+    def __init__(self, start_node: WorkflowNode):
+        self.run_id = next(WorkflowRun._ids)
+        self.metadata: Dict[Any, Any] = dict()
+        self.current_node = start_node
+        self.node_records: List[WorkflowNode] = []
+        self.input_payload_records: List[Any] = []
+        self.output_payload_records: List[Any] = []
+
+    @property
+    def records(self):
+        return list(map(lambda x: f'<{x[0].__class__.__name__}: {x[1]}=>{x[2]}>', zip(self.node_records, self.input_payload_records, self.output_payload_records)))
+
+class WorkflowHook:
+    """
+    Callbacks around the runs and the nodes of a WorkflowController.
+
+    `after_node` and `on_run_end` receive the exception when the
+    node or the run raised; the exception is re-raised afterwards.
+
+    `restore` may return a (node, payload) pair saved by an earlier run of
+    the same payload; the run then continues right after that node.
+    """
+    def on_run_start(self, run: WorkflowRun, payload: Any):
+        pass
+
+    def restore(self, run: WorkflowRun, payload: Any) -> Optional[Tuple[WorkflowNode, Any]]:
+        return None
+
+    def on_run_end(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        pass
+
+    def before_node(self, run: WorkflowRun, payload: Any):
+        pass
+
+    def after_node(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        pass
+
 class WorkflowController:
     """
     Controlling the operation of the workflow.
+
+    The controller itself is stateless across runs: every run keeps its state in
+    its own WorkflowRun, so one controller can serve many threads at once.
     """
-    def __init__(self, start_node: WorkflowNode, verbose: bool=False, verbose_callback: Callable=lambda x: x):
+    def __init__(self, start_node: WorkflowNode, verbose: bool=False, verbose_callback: Callable=lambda x: x, hooks: Optional[List[WorkflowHook]]=None):
         self._verbose = verbose
         self._start_node = start_node
-        self._current_node = start_node
         self._verbose_callback = verbose_callback
+        self._hooks: List[WorkflowHook] = list(hooks) if hooks is not None else []
+        self._local = threading.local()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    def add_hook(self, hook: WorkflowHook):
+        self._hooks.append(hook)
 
     def run(self, payload):
         """
         Go from one step to another
+
+        The run is driven on the event loop of the controller, shared by every
+        synchronous run, so async nodes (and the LLM clients they hold) always
+        live on the same loop, even when `run` is called from within another loop.
+        """
+        run = WorkflowRun(self._start_node)
+        self._local.last_run = run
+        loop = self._event_loop()
+        if threading.get_ident() == self._loop_thread.ident:
+            raise RuntimeError('WorkflowController.run cannot be called from a node running on its own event loop; await run_async instead')
+        return asyncio.run_coroutine_threadsafe(self._drive(run, payload), loop).result()
+
+    async def run_async(self, payload, llm_semaphore: Optional[asyncio.Semaphore]=None, executor: Optional[Executor]=None):
         """
-        self._current_node = self._start_node
-        self._node_records = []
-        self._input_payload_records = []
-        self._output_payload_records = []
-        while not self._current_node.is_end:
-            self._operate_node(self._current_node, payload)
-            downstreams = self._current_node._next_nodes
-            name = self._current_node.determine_downstream(payload)
-            self._current_node = downstreams[name]
-        self._operate_node(self._current_node, payload)
+        Go from one step to another on the running event loop.
+
+        Coroutine nodes are awaited, synchronous nodes run in `executor`
+        and LLM-bound nodes hold `llm_semaphore` while they are processing.
+        """
+        return await self._drive(WorkflowRun(self._start_node), payload, llm_semaphore, executor)
+
+    async def _drive(self, run: WorkflowRun, payload: Any, llm_semaphore: Optional[asyncio.Semaphore]=None, executor: Optional[Executor]=None):
+        payload, processed = self._start_run(run, payload)
+        try:
+            while True:
+                if not processed:
+                    payload = await self._operate_node_async(run, payload, llm_semaphore, executor)
+                processed = False
+                if run.current_node.is_end:
+                    break
+                downstreams = run.current_node._next_nodes
+                name = await self._call_async(run.current_node.determine_downstream, payload, executor)
+                run.current_node = downstreams[name]
+        except BaseException as e:
+            self._end_run(run, payload, e)
+            raise
+        self._end_run(run, payload)
         return payload
-    
-    def _operate_node(self, current_node: WorkflowNode, payload: Dict):
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The event loop of the synchronous runs, started on first use in a daemon thread
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name='workflow-loop', daemon=True)
+                self._loop_thread.start()
+        return self._loop
+
+    def run_batch(self, payloads: Iterable[Any], max_workers: int=4) -> Iterator[Tuple[int, Any]]:
+        """
+        Run many payloads through the workflow concurrently.
+
+        Payloads are pulled lazily from `payloads` and yielded as
+        (index, payload) in the order they complete.
+        """
+        payloads = iter(payloads)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = dict()
+            for i, payload in enumerate(payloads):
+                running[executor.submit(self.run, payload)] = i
+                if len(running) >= max_workers * 2:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield running.pop(future), future.result()
+            for future in as_completed(running):
+                yield running[future], future.result()
+
+    async def run_batch_async(
+            self,
+            payloads: Iterable[Any],
+            max_concurrency: int=256,
+            max_llm_concurrency: int=4,
+            max_workers: int=4) -> AsyncIterator[Tuple[int, Any]]:
+        """
+        Schedule many payloads on one event loop, with at most `max_concurrency`
+        workflows in flight and at most `max_llm_concurrency` LLM-bound nodes
+        (or LLM calls of `llm_fanout` nodes) processing at a time.
+        Synchronous nodes share a pool of `max_workers` threads.
+
+        Yield (index, payload) in the order they complete.
+        """
+        llm_semaphore = asyncio.Semaphore(max_llm_concurrency)
+        slots = asyncio.Semaphore(max_concurrency)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            async def _run(i: int, payload: Any) -> Tuple[int, Any]:
+                async with slots:
+                    return i, await self.run_async(payload, llm_semaphore=llm_semaphore, executor=executor)
+            tasks = [asyncio.ensure_future(_run(i, payload)) for i, payload in enumerate(payloads)]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    @staticmethod
+    async def _call_async(method: Callable, payload: Any, executor: Optional[Executor]=None) -> Any:
+        """
+        Await a coroutine method or run a plain method in `executor`,
+        in both cases within the context variables of the caller.
+        """
+        if inspect.iscoroutinefunction(method):
+            return await method(payload)
+        context = contextvars.copy_context()
+        result = await asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, method, payload))
+        if inspect.isawaitable(result):
+            return await result
+        return result
+
+    async def _operate_node_async(self, run: WorkflowRun, payload: Dict, llm_semaphore: Optional[asyncio.Semaphore], executor: Optional[Executor]):
+        self._before_node(run, payload)
+        try:
+            if run.current_node.llm_fanout and llm_semaphore is not None:
+                token = _llm_semaphore.set(llm_semaphore)
+                try:
+                    payload = await self._call_async(run.current_node.process, payload, executor)
+                finally:
+                    _llm_semaphore.reset(token)
+            elif run.current_node.llm_bound and llm_semaphore is not None:
+                async with llm_semaphore:
+                    payload = await self._call_async(run.current_node.process, payload, executor)
+            else:
+                payload = await self._call_async(run.current_node.process, payload, executor)
+        except BaseException as e:
+            self._call_hooks('after_node', run, payload, e)
+            raise
+        self._after_node(run, payload)
+        return payload
+
+    def _call_hooks(self, name: str, *args):
+        for hook in (reversed(self._hooks) if name in ('after_node', 'on_run_end') else self._hooks):
+            getattr(hook, name)(*args)
+
+    def _start_run(self, run: WorkflowRun, payload: Any) -> Tuple[Any, bool]:
+        """
+        Notify the hooks of a new run. If a hook restores a saved state, move the run
+        to the saved node and return the saved payload flagged as already processed.
+        """
+        self._call_hooks('on_run_start', run, payload)
+        for hook in self._hooks:
+            restored = hook.restore(run, payload)
+            if restored is not None:
+                run.current_node, payload = restored
+                if self._verbose:
+                    print('[_start_run] Resume after', run.current_node)
+                return payload, True
+        return payload, False
+
+    @property
+    def node_ids(self) -> Dict[WorkflowNode, str]:
+        return workflow_node_ids(self._start_node)
+
+    def _end_run(self, run: WorkflowRun, payload: Any, error: Optional[BaseException]=None):
+        self._call_hooks('on_run_end', run, payload, error)
+
+    def _before_node(self, run: WorkflowRun, payload: Dict):
         if self._verbose:
-            print('[_operate_node] Start', current_node)
-        self._node_records.append(current_node)
-        self._input_payload_records.append(payload)
-        payload = current_node.process(payload)
-        self._record_workflow_in_payload(payload)
-        self._output_payload_records.append(payload)
+            print('[_operate_node] Start', run.current_node)
+        run.node_records.append(run.current_node)
+        run.input_payload_records.append(payload)
+        self._call_hooks('before_node', run, payload)
+
+    def _after_node(self, run: WorkflowRun, payload: Dict):
+        self._record_workflow_in_payload(run, payload)
+        run.output_payload_records.append(payload)
+        self._call_hooks('after_node', run, payload)
         if self._verbose:
             print('[_operate_node] Show payload data:', self._verbose_callback(payload))
         if self._verbose:
-            print('[_operate_node] End', current_node)
+            print('[_operate_node] End', run.current_node)
 
-    
-    def _record_workflow_in_payload(self, payload: Dict):
+    def _record_workflow_in_payload(self, run: WorkflowRun, payload: Dict):
         if 'workflow_records' in payload:
-            payload['workflow_records'].append(self._current_node)
+            payload['workflow_records'].append(run.current_node)
         else:
-            payload['workflow_records'] = [self._current_node]
+            payload['workflow_records'] = [run.current_node]
 
     @property
     def records(self):
-        return list(map(lambda x: f'<{x[0].__class__.__name__}: {x[1]}=>{x[2]}>', zip(self._node_records, self._input_payload_records, self._output_payload_records)))
+        """
+        Records of the latest run made by the calling thread
+        """
+        return self._local.last_run.records
 
 class EndNode(WorkflowNode):
     """
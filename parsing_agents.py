@@ -1,6 +1,7 @@
 import dspy
+from convert_func_generate.src.cassette import use_cassette
 from typing import List
-lm = dspy.LM('ollama_chat/llama3.2', api_base='http://localhost:11434', api_key='')
+lm = use_cassette(dspy.LM('ollama_chat/llama3.2', api_base='http://localhost:11434', api_key=''))
 dspy.configure(lm=lm)
 
 class ReorderColumn(dspy.Signature):